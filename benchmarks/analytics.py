@@ -0,0 +1,120 @@
+"""
+Vergleicht die bisherigen Dict-Schleifen mit der spaltenweisen Auswertung aus utils.analytics.
+
+    python benchmarks/analytics.py --rows 100000
+
+Die Dict-Schleifen bekommen datetime-Objekte wie vom ORM, die Spalten Tagesnummern wie von `epoch_day`.
+Zusätzlich wird das Laden aus SQLite mit beiden Datumsformen gemessen.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, Transaction
+from utils.analytics import (frame_from_rows, top_categories, category_shares, month_over_month, compare_months,
+                             month_index, epoch_day, day_number)
+
+CATEGORIES = ["groceries", "dining_out", "housing", "utilities", "transportation", "shopping",
+              "streaming_subscription", "insurance", "income", "entertainment", "health", "travel"]
+
+def make_rows(count: int, seed: int = 42):
+    """Erzeugt (amount, date, category, type)-Tupel über die letzten drei Jahre."""
+    rng = random.Random(seed)
+    start = datetime.now() - timedelta(days=3 * 365)
+    return [
+        (
+            round(rng.uniform(1, 250), 2),
+            start + timedelta(minutes=rng.randrange(3 * 365 * 24 * 60)),
+            rng.choice(CATEGORIES),
+            'income' if rng.random() < 0.1 else 'expense'
+        )
+        for _ in range(count)
+    ]
+
+def as_day_rows(rows):
+    """Dieselben Zeilen mit Tagesnummern statt datetime, wie sie `load_user_history` aus SQLite liest."""
+    return [(a, day_number(d), c, t) for a, d, c, t in rows]
+
+def load_session(rows):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.bulk_insert_mappings(Transaction, [
+        dict(user_id=1, amount=a, date=d, category=c, type=t) for a, d, c, t in rows
+    ])
+    session.commit()
+    return session
+
+def load(session, date_column):
+    return session.query(Transaction.amount, date_column, Transaction.category, Transaction.type).filter(
+        Transaction.user_id == 1
+    ).all()
+
+def legacy(rows) -> None:
+    """Nachbau der bisherigen Auswertung (get_top_categories, weekly_summary) über Dicts."""
+    transactions = [{'amount': a, 'date': d, 'category': c, 'type': t} for a, d, c, t in rows]
+    category_totals = {}
+    for t in transactions:
+        if t['type'] == 'expense':
+            category_totals[t['category']] = category_totals.get(t['category'], 0) + t['amount']
+    sorted(category_totals.items(), key=lambda x: x[1], reverse=True)[:5]
+
+    monthly = {}
+    for t in transactions:
+        if t['type'] == 'expense':
+            key = (t['date'].year, t['date'].month, t['category'])
+            monthly[key] = monthly.get(key, 0) + t['amount']
+
+def columnar(rows) -> None:
+    frame = frame_from_rows(rows)
+    now = datetime.now()
+    current = month_index(now.year, now.month)
+    top_categories(frame, 'expense', 5)
+    category_shares(frame, 'expense', month=current)
+    month_over_month(frame, 'expense', months=6, window=3)
+    compare_months(frame, current - 1, current)
+
+def columnar_ops_only(frame) -> None:
+    now = datetime.now()
+    current = month_index(now.year, now.month)
+    top_categories(frame, 'expense', 5)
+    category_shares(frame, 'expense', month=current)
+    month_over_month(frame, 'expense', months=6, window=3)
+    compare_months(frame, current - 1, current)
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    day_rows = as_day_rows(rows)
+    frame = frame_from_rows(day_rows)
+    session = load_session(rows)
+
+    results = {
+        "Dict-Schleifen": min(timeit.repeat(lambda: legacy(rows), number=1, repeat=args.repeat)),
+        "Spalten inkl. Aufbau": min(timeit.repeat(lambda: columnar(day_rows), number=1, repeat=args.repeat)),
+        "Spalten nur Auswertung": min(timeit.repeat(lambda: columnar_ops_only(frame), number=1, repeat=args.repeat)),
+        "Laden mit datetime": min(timeit.repeat(lambda: load(session, Transaction.date), number=1, repeat=args.repeat)),
+        "Laden mit Tagesnummer": min(timeit.repeat(
+            lambda: load(session, epoch_day(Transaction.date)), number=1, repeat=args.repeat
+        )),
+    }
+    session.close()
+
+    print(f"{args.rows} Transaktionen, bester von {args.repeat} Läufen:")
+    for name, seconds in results.items():
+        print(f"  {name:<24} {seconds * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
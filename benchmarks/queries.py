@@ -0,0 +1,88 @@
+"""
+Prüft, dass die Jobs unabhängig von der Zahl der Benutzer mit einer festen Zahl Abfragen auskommen.
+
+    python benchmarks/queries.py --users 10 200
+
+Legt eine SQLite-Datenbank im Speicher an und beendet sich mit Exit-Code 1, wenn eine Auswertung
+ihr Abfragebudget überschreitet oder mit mehr Benutzern mehr Abfragen braucht.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import Base, Budget, Goal, Transaction, User
+from database.goals import goal_pace
+from utils.forecasting import forecast_budgets
+from utils.reminders import overspent_budgets
+from utils.profiling import assert_max_queries
+
+CATEGORIES = ["groceries", "dining_out", "housing", "transportation", "savings"]
+
+# Auswertung -> erlaubte Abfragen
+CHECKS = {
+    'budget_check': (lambda session, ids: overspent_budgets(session), 1),
+    'goal_progress': (lambda session, ids: goal_pace(session, ids), 1),
+    'budget_forecast': (lambda session, ids: forecast_budgets(session, user_ids=ids), 5),
+}
+
+def seed(session, users: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    now = datetime.now()
+    for index in range(users):
+        user = User(username=f"user{index}", telegram_id=1000 + index, last_active_at=now)
+        session.add(user)
+        session.flush()
+        for category in CATEGORIES[:-1]:
+            session.add(Budget(user_id=user.id, name=category, limit=200.0, year=now.year, month=now.month))
+        session.add(Goal(user_id=user.id, name="Urlaub", target_amount=1000.0, category='savings',
+                         deadline=now + timedelta(days=90), created_at=now - timedelta(days=400)))
+        for _ in range(50):
+            session.add(Transaction(
+                user_id=user.id, amount=round(rng.uniform(1, 150), 2), type='expense',
+                category=rng.choice(CATEGORIES), date=now - timedelta(days=rng.randrange(365))
+            ))
+    session.commit()
+    return [user_id for (user_id,) in session.query(User.id)]
+
+def run(users: int) -> dict:
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        ids = seed(session, users)
+        counts = {}
+        for name, (check, limit) in CHECKS.items():
+            with assert_max_queries(limit, name=name, engine=engine) as stats:
+                check(session, ids)
+            counts[name] = stats.queries
+        return counts
+    finally:
+        session.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs='+', default=[10, 200])
+    args = parser.parse_args()
+
+    try:
+        results = {users: run(users) for users in args.users}
+    except AssertionError as e:
+        print(e)
+        sys.exit(1)
+
+    for users, counts in results.items():
+        print(f"{users:>6} Benutzer: " + ", ".join(f"{name}={count}" for name, count in counts.items()))
+    if len({tuple(counts.values()) for counts in results.values()}) > 1:
+        print("Die Zahl der Abfragen hängt von der Zahl der Benutzer ab.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
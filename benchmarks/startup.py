@@ -0,0 +1,69 @@
+"""
+Misst die Importzeit des Bots mit `python -X importtime` und prüft ein Zeitbudget.
+
+    python benchmarks/startup.py --budget-ms 800
+
+Beendet sich mit Exit-Code 1, wenn das Budget überschritten wird oder ein schweres Modul
+(matplotlib, requests) schon beim Import geladen wird.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Diese Module dürfen erst bei Bedarf geladen werden
+LAZY_MODULES = ("matplotlib", "requests")
+
+def measure_import(module: str = "telegram_budget_app"):
+    """Importiert das Modul in einem frischen Interpreter und gibt (Gesamtzeit in ms, {Modul: kumulative µs}) zurück."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    # Zeilenformat: "import time: <self µs> | <kumulativ µs> | <eingerücktes Modul>"
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|", 2)
+        cumulative[name.strip()] = int(cumulative_us)
+
+    return cumulative.get(module, 0) / 1000, cumulative
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=800.0)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # Der erste Lauf wärmt Bytecode- und Dateisystem-Caches auf und wird verworfen
+    measure_import()
+    runs = [measure_import() for _ in range(args.runs)]
+    total_ms, cumulative = min(runs, key=lambda run: run[0])
+
+    print(f"Importzeit telegram_budget_app: {total_ms:.1f} ms (Budget {args.budget_ms:.0f} ms, bester von {args.runs} Läufen)")
+    print(f"\nTop {args.top} Module nach kumulativer Zeit:")
+    modules = {name: us for name, us in cumulative.items() if name != "telegram_budget_app"}
+    for name, us in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({name.split(".")[0] for name in cumulative} & set(LAZY_MODULES))
+    if eager:
+        print(f"\nFEHLER: Beim Start geladen, sollte lazy sein: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"\nFEHLER: Budget um {total_ms - args.budget_ms:.1f} ms überschritten.")
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
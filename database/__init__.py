@@ -1,2 +1,4 @@
 from .engine import engine, SessionLocal
-from .models import Base, User, Transaction, Budget, Goal
\ No newline at end of file
+from .models import Base, User, Transaction, Budget, Goal, JobLease, RecurringTransaction, WeeklyDigest, ScheduledDelivery, MonthlyAggregate, Household, HouseholdMember, HouseholdBudget, HouseholdAggregate, HouseholdMemberAggregate
+from . import goals  # registriert die Listener für den Zielfortschritt
+from . import households  # registriert die Listener für die Haushaltssummen
\ No newline at end of file
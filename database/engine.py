@@ -1,7 +1,21 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = "sqlite:///./test.db"  # SQLite database URL
+# Sekunden, die eine Verbindung auf eine Schreibsperre wartet, bevor "database is locked" gemeldet wird
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+
+engine = create_engine(DATABASE_URL, connect_args={"timeout": DB_BUSY_TIMEOUT})
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Wie utils.persistence: mit WAL blockieren Leser keine Schreiber, und die Worker im Cluster-Betrieb
+    # warten per Timeout aufeinander statt mit "database is locked" abzubrechen
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
-engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
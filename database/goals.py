@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import event, func, inspect, or_, update
+
+from .models import Goal, Transaction, User
+
+# Ziele ohne eigene Kategorie zählen Sparbuchungen
+DEFAULT_GOAL_CATEGORY = 'savings'
+
+def apply_goal_progress(connection, user_id: int, category: Optional[str], date: Optional[datetime], amount: float) -> None:
+    """Schreibt `amount` auf alle Ziele des Benutzers mit dieser Kategorie fort, die vor der Buchung angelegt wurden."""
+    if not user_id or not category or not amount:
+        return
+    conditions = [Goal.user_id == user_id, Goal.category == category.lower()]
+    if date is not None:
+        conditions.append(or_(Goal.created_at.is_(None), Goal.created_at <= date))
+    connection.execute(
+        update(Goal).where(*conditions).values(current_amount=func.coalesce(Goal.current_amount, 0.0) + amount)
+    )
+
+# Die Listener greifen bei ORM-Einfügungen, -Änderungen und -Löschungen. Massenoperationen wie das
+# Archivieren (query.delete) laufen bewusst daran vorbei: archivierte Buchungen bleiben im Fortschritt.
+
+@event.listens_for(Transaction, 'after_insert')
+def _transaction_inserted(mapper, connection, target) -> None:
+    apply_goal_progress(connection, target.user_id, target.category, target.date, target.amount or 0.0)
+
+@event.listens_for(Transaction, 'after_delete')
+def _transaction_deleted(mapper, connection, target) -> None:
+    apply_goal_progress(connection, target.user_id, target.category, target.date, -(target.amount or 0.0))
+
+@event.listens_for(Transaction, 'after_update')
+def _transaction_updated(mapper, connection, target) -> None:
+    state = inspect(target)
+    fields = ('user_id', 'category', 'date', 'amount')
+    histories = {name: state.attrs[name].history for name in fields}
+    if not any(history.has_changes() for history in histories.values()):
+        return
+    old = {
+        name: history.deleted[0] if history.deleted else getattr(target, name)
+        for name, history in histories.items()
+    }
+    apply_goal_progress(connection, old['user_id'], old['category'], old['date'], -(old['amount'] or 0.0))
+    apply_goal_progress(connection, target.user_id, target.category, target.date, target.amount or 0.0)
+
+def goal_pace(session, user_ids: List[int], now: Optional[datetime] = None) -> List[tuple]:
+    """
+    Fortschritt und nötige Sparrate pro Woche für alle Ziele der Benutzer in einer Abfrage.
+    Gibt (telegram_id, name, current_amount, target_amount, deadline, per_week) zurück; per_week ist
+    None für Ziele ohne Frist.
+    """
+    now = now or datetime.now()
+    remaining = func.max(Goal.target_amount - func.coalesce(Goal.current_amount, 0.0), 0.0)
+    # Mindestens ein Tag, damit abgelaufene Fristen den gesamten Rest als Wochenrate zeigen
+    days_left = func.max(func.julianday(Goal.deadline) - func.julianday(now.isoformat(' ')), 1.0)
+    per_week = remaining * 7.0 / days_left
+    return session.query(
+        User.telegram_id, Goal.name, Goal.current_amount, Goal.target_amount, Goal.deadline, per_week
+    ).join(User, User.id == Goal.user_id).filter(
+        Goal.user_id.in_(user_ids)
+    ).order_by(Goal.user_id, Goal.deadline).all()
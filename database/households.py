@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import Household, HouseholdAggregate, HouseholdBudget, HouseholdMember, HouseholdMemberAggregate, Transaction, User
+
+# Wie utils.archive.UNKNOWN_CATEGORY: NULL wäre im Unique-Constraint nie gleich
+UNKNOWN_CATEGORY = 'unknown'
+
+def normalize_category(category: Optional[str]) -> str:
+    """Schreibweise, unter der Haushaltsbudgets und -summen Kategorien vergleichen ("Lebensmittel" = "lebensmittel")."""
+    return (category or UNKNOWN_CATEGORY).strip().lower()
+
+def apply_household_totals(connection, household_id: Optional[int], user_id: Optional[int], category: Optional[str],
+                           kind: Optional[str], date: Optional[datetime], amount: float, count: int) -> None:
+    """Schreibt Betrag und Anzahl auf die Monatssummen des Haushalts und des Mitglieds fort (Upsert)."""
+    if not household_id or not kind or date is None:
+        return
+    stmt = sqlite_insert(HouseholdAggregate).values(
+        household_id=household_id, year=date.year, month=date.month,
+        category=normalize_category(category), type=kind, total=amount, count=count
+    )
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[HouseholdAggregate.household_id, HouseholdAggregate.year, HouseholdAggregate.month,
+                        HouseholdAggregate.category, HouseholdAggregate.type],
+        set_={'total': HouseholdAggregate.total + stmt.excluded.total,
+              'count': HouseholdAggregate.count + stmt.excluded.count}
+    ))
+    if not user_id:
+        return
+    stmt = sqlite_insert(HouseholdMemberAggregate).values(
+        household_id=household_id, user_id=user_id, year=date.year, month=date.month, type=kind, total=amount
+    )
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[HouseholdMemberAggregate.household_id, HouseholdMemberAggregate.user_id,
+                        HouseholdMemberAggregate.year, HouseholdMemberAggregate.month, HouseholdMemberAggregate.type],
+        set_={'total': HouseholdMemberAggregate.total + stmt.excluded.total}
+    ))
+
+# Wie bei den Zielen greifen die Listener nur bei ORM-Schreibvorgängen. Das Archivieren löscht per
+# query.delete und lässt die Haushaltssummen damit bewusst unverändert.
+
+_FIELDS = ('household_id', 'user_id', 'category', 'type', 'date', 'amount')
+
+@event.listens_for(Transaction, 'before_insert')
+def _assign_household(mapper, connection, target) -> None:
+    # Buchungen von Mitgliedern landen automatisch im gemeinsamen Haushaltsbuch
+    if target.household_id is None and target.user_id is not None:
+        target.household_id = connection.execute(
+            select(HouseholdMember.household_id).where(HouseholdMember.user_id == target.user_id)
+        ).scalar()
+
+@event.listens_for(Transaction, 'after_insert')
+def _transaction_inserted(mapper, connection, target) -> None:
+    apply_household_totals(connection, target.household_id, target.user_id, target.category, target.type,
+                           target.date, target.amount or 0.0, 1)
+
+@event.listens_for(Transaction, 'after_delete')
+def _transaction_deleted(mapper, connection, target) -> None:
+    apply_household_totals(connection, target.household_id, target.user_id, target.category, target.type,
+                           target.date, -(target.amount or 0.0), -1)
+
+@event.listens_for(Transaction, 'after_update')
+def _transaction_updated(mapper, connection, target) -> None:
+    state = inspect(target)
+    histories = {name: state.attrs[name].history for name in _FIELDS}
+    if not any(history.has_changes() for history in histories.values()):
+        return
+    old = {
+        name: history.deleted[0] if history.deleted else getattr(target, name)
+        for name, history in histories.items()
+    }
+    apply_household_totals(connection, old['household_id'], old['user_id'], old['category'], old['type'],
+                           old['date'], -(old['amount'] or 0.0), -1)
+    apply_household_totals(connection, target.household_id, target.user_id, target.category, target.type,
+                           target.date, target.amount or 0.0, 1)
+
+def household_budget_status(session, user_id: int, category: str,
+                            now: Optional[datetime] = None) -> Optional[Tuple[int, str, float, float]]:
+    """
+    Haushaltsbudget der Kategorie für den Haushalt des Benutzers in einer Abfrage über die Monatssummen.
+    Gibt (household_id, Haushaltsname, Limit, Ausgaben im laufenden Monat) zurück oder None ohne Budget.
+    """
+    now = now or datetime.now()
+    category = normalize_category(category)
+    return session.query(
+        Household.id, Household.name, HouseholdBudget.limit, func.coalesce(HouseholdAggregate.total, 0.0)
+    ).select_from(HouseholdMember).join(
+        Household, Household.id == HouseholdMember.household_id
+    ).join(
+        HouseholdBudget, and_(HouseholdBudget.household_id == Household.id, HouseholdBudget.name == category)
+    ).outerjoin(
+        HouseholdAggregate, and_(
+            HouseholdAggregate.household_id == Household.id,
+            HouseholdAggregate.year == now.year,
+            HouseholdAggregate.month == now.month,
+            HouseholdAggregate.category == category,
+            HouseholdAggregate.type == 'expense'
+        )
+    ).filter(HouseholdMember.user_id == user_id).first()
+
+def household_splits(session, household_id: int, now: Optional[datetime] = None) -> List[Tuple[str, float, float, float]]:
+    """
+    Aufteilung der Ausgaben des laufenden Monats: je Mitglied (Name, bezahlt, Anteil, Saldo).
+    Der Anteil richtet sich nach dem Gewicht `share`; ein positiver Saldo heißt, das Mitglied hat zu viel bezahlt.
+    """
+    now = now or datetime.now()
+    rows = session.query(
+        User.username, User.telegram_id, HouseholdMember.share, func.coalesce(HouseholdMemberAggregate.total, 0.0)
+    ).select_from(HouseholdMember).join(
+        User, User.id == HouseholdMember.user_id
+    ).outerjoin(
+        HouseholdMemberAggregate, and_(
+            HouseholdMemberAggregate.household_id == HouseholdMember.household_id,
+            HouseholdMemberAggregate.user_id == HouseholdMember.user_id,
+            HouseholdMemberAggregate.year == now.year,
+            HouseholdMemberAggregate.month == now.month,
+            HouseholdMemberAggregate.type == 'expense'
+        )
+    ).filter(HouseholdMember.household_id == household_id).order_by(HouseholdMember.joined_at).all()
+
+    total = sum(paid for _, _, _, paid in rows)
+    weights = sum(share or 0.0 for _, _, share, _ in rows)
+    splits = []
+    for username, telegram_id, share, paid in rows:
+        owed = total * (share or 0.0) / weights if weights else 0.0
+        splits.append((username or str(telegram_id), paid, owed, paid - owed))
+    return splits
@@ -0,0 +1,53 @@
+from typing import List, Set
+
+from sqlalchemy import text
+
+from .models import Base
+
+# Spalten, die nach dem ersten Release zu bestehenden Tabellen hinzugekommen sind. create_all legt nur
+# fehlende Tabellen an und ändert bestehende nicht; diese Spalten werden daher per ALTER TABLE nachgetragen.
+# (Tabelle, Spalte, Wert für bestehende Zeilen oder None)
+ADDED_COLUMNS = [
+    ('transactions', 'recurring_id', None),
+    ('transactions', 'household_id', None),
+    ('users', 'last_active_at', None),
+    ('users', 'is_blocked', False),
+    ('users', 'timezone', None),
+    ('goals', 'category', None),
+    ('goals', 'deadline', None),
+    ('goals', 'created_at', None),  # leer = Ziel zählt alle bisherigen Buchungen (database.goals)
+]
+
+def existing_columns(connection, table: str) -> Set[str]:
+    """Spaltennamen einer Tabelle laut PRAGMA table_info; leer, wenn es die Tabelle nicht gibt."""
+    return {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+
+def add_missing_columns(engine) -> List[str]:
+    """
+    Trägt fehlende Spalten aus ADDED_COLUMNS und die zugehörigen Indizes in bestehende Tabellen nach und füllt
+    bestehende Zeilen auf. Mehrfacher Aufruf ist unschädlich. Gibt die hinzugefügten Spalten zurück.
+    """
+    added = []
+    with engine.begin() as connection:
+        for table_name, column_name, backfill in ADDED_COLUMNS:
+            columns = existing_columns(connection, table_name)
+            if not columns:
+                continue  # Neue Datenbank: create_all legt die Tabelle vollständig an
+            if column_name not in columns:
+                column = Base.metadata.tables[table_name].c[column_name]
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+                added.append(f"{table_name}.{column_name}")
+            if backfill is not None:
+                connection.execute(
+                    text(f"UPDATE {table_name} SET {column_name} = :value WHERE {column_name} IS NULL"),
+                    {'value': backfill}
+                )
+
+        # Indizes der Modelle, die auf bestehenden Tabellen fehlen (auch die der nachgetragenen Spalten)
+        for table_name in dict.fromkeys(table for table, _, _ in ADDED_COLUMNS):
+            columns = existing_columns(connection, table_name)
+            for index in Base.metadata.tables[table_name].indexes:
+                if all(column.name in columns for column in index.columns):
+                    index.create(connection, checkfirst=True)
+    return added
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from datetime import datetime
 
 Base = declarative_base()
 
@@ -9,14 +10,19 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
     email = Column(String, unique=True, index=True, nullable=True)
-    hashed_password = Column(String)
+    hashed_password = Column(String, nullable=True)  # Wird nur gesetzt, wenn der Benutzer ein Passwort vergibt
     
     # Hinzugefügtes Attribut für Telegram-ID
     telegram_id = Column(Integer, unique=True, index=True, nullable=False)
+    last_active_at = Column(DateTime, index=True, nullable=True)
+    is_blocked = Column(Boolean, default=False, index=True)  # Gesetzt, wenn Telegram "Forbidden" meldet
+    timezone = Column(String, nullable=True)  # IANA-Name, z. B. 'Europe/Berlin'; leer = Standardzeitzone
 
     transactions = relationship("Transaction", back_populates="owner")
     budgets = relationship("Budget", back_populates="owner")
     goals = relationship("Goal", back_populates="owner")
+    recurring_transactions = relationship("RecurringTransaction", back_populates="owner")
+    scheduled_deliveries = relationship("ScheduledDelivery", back_populates="owner")
 
 class Transaction(Base):
     __tablename__ = 'transactions'
@@ -29,9 +35,14 @@ class Transaction(Base):
     subcategory = Column(String, index=True)
     currency = Column(String, index=True)
     type = Column(String, index=True)  # 'expense' oder 'income'
+    recurring_id = Column(Integer, ForeignKey('recurring_transactions.id'), nullable=True, index=True)
+    # Gemeinsames Haushaltsbuch; wird beim Einfügen aus der Mitgliedschaft gesetzt (database.households)
+    household_id = Column(Integer, ForeignKey('households.id'), nullable=True, index=True)
 
     owner = relationship("User", back_populates="transactions")
 
+    __table_args__ = (Index('ix_transactions_user_date', 'user_id', 'date'),)
+
 class Budget(Base):
     __tablename__ = 'budgets'
     id = Column(Integer, primary_key=True, index=True)
@@ -48,7 +59,149 @@ class Goal(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String)
     target_amount = Column(Float)
-    current_amount = Column(Float, default=0.0)
+    current_amount = Column(Float, default=0.0)  # Wird bei jeder Buchung fortgeschrieben (database.goals)
     user_id = Column(Integer, ForeignKey('users.id'))
+    category = Column(String, index=True)  # Buchungen dieser Kategorie zählen zum Ziel
+    deadline = Column(DateTime, index=True, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
     
-    owner = relationship("User", back_populates="goals")
\ No newline at end of file
+    owner = relationship("User", back_populates="goals")
+
+class JobLease(Base):
+    __tablename__ = 'job_leases'
+    # Sorgt dafür, dass ein geplanter Job nur auf einem Knoten läuft
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class RecurringTransaction(Base):
+    __tablename__ = 'recurring_transactions'
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    signature = Column(String, index=True)  # Normalisierte Beschreibung + gerundeter Betrag
+    description = Column(String)
+    amount = Column(Float)
+    category = Column(String)
+    subcategory = Column(String)
+    currency = Column(String)
+    type = Column(String)
+    interval_days = Column(Integer)
+    occurrences = Column(Integer, default=0)
+    last_date = Column(DateTime)
+    next_date = Column(DateTime, index=True)
+    active = Column(Boolean, default=True)
+    auto_book = Column(Boolean, default=False)  # Nur auf Wunsch des Benutzers automatisch buchen
+
+    owner = relationship("User", back_populates="recurring_transactions")
+
+    __table_args__ = (UniqueConstraint('user_id', 'signature', name='uq_recurring_user_signature'),)
+
+class WeeklyDigest(Base):
+    __tablename__ = 'weekly_digests'
+    # Vorberechnete Wochenzusammenfassungen; sent_at ist leer, bis die Nachricht verschickt wurde
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(String, index=True)  # ISO-Woche, z. B. '2024-W05'
+    user_id = Column(Integer, ForeignKey('users.id'))
+    telegram_id = Column(Integer)
+    text = Column(String)
+    created_at = Column(DateTime)
+    sent_at = Column(DateTime, nullable=True, index=True)
+    error = Column(String, nullable=True)
+
+    __table_args__ = (UniqueConstraint('run_id', 'user_id', name='uq_weekly_digest_run_user'),)
+
+class ScheduledDelivery(Base):
+    __tablename__ = 'scheduled_deliveries'
+    # Nächster Zustelltermin je Benutzer und Job (UTC); der Scheduler liest nur die fälligen Einträge
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    job = Column(String, nullable=False)
+    due_at = Column(DateTime, nullable=False)
+
+    owner = relationship("User", back_populates="scheduled_deliveries")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'job', name='uq_scheduled_delivery_user_job'),
+        Index('ix_scheduled_deliveries_job_due', 'job', 'due_at'),
+    )
+
+class MonthlyAggregate(Base):
+    __tablename__ = 'monthly_aggregates'
+    # Monatssummen archivierter Transaktionen; die Einzelbuchungen liegen in den Archivdateien (utils.archive)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    category = Column(String)
+    type = Column(String)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'year', 'month', 'category', 'type', name='uq_monthly_aggregate'),
+    )
+
+class Household(Base):
+    __tablename__ = 'households'
+    # Gemeinsames Haushaltsbuch mehrerer Benutzer (Familie, WG)
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    invite_code = Column(String, unique=True, index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    members = relationship("HouseholdMember", back_populates="household", cascade="all, delete-orphan")
+    budgets = relationship("HouseholdBudget", back_populates="household", cascade="all, delete-orphan")
+
+class HouseholdMember(Base):
+    __tablename__ = 'household_members'
+    # Ein Benutzer gehört höchstens einem Haushalt an
+    id = Column(Integer, primary_key=True, index=True)
+    household_id = Column(Integer, ForeignKey('households.id'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, unique=True)
+    share = Column(Float, default=1.0)  # Gewicht bei der Aufteilung der gemeinsamen Ausgaben
+    joined_at = Column(DateTime, default=datetime.now)
+
+    household = relationship("Household", back_populates="members")
+    user = relationship("User")
+
+class HouseholdBudget(Base):
+    __tablename__ = 'household_budgets'
+    id = Column(Integer, primary_key=True, index=True)
+    household_id = Column(Integer, ForeignKey('households.id'), nullable=False)
+    name = Column(String, nullable=False)  # muss mit `Transaction.category` übereinstimmen
+    limit = Column(Float, nullable=False)
+
+    household = relationship("Household", back_populates="budgets")
+
+    __table_args__ = (UniqueConstraint('household_id', 'name', name='uq_household_budget'),)
+
+class HouseholdAggregate(Base):
+    __tablename__ = 'household_aggregates'
+    # Monatssummen je Haushalt und Kategorie, bei jeder Buchung fortgeschrieben (database.households)
+    id = Column(Integer, primary_key=True, index=True)
+    household_id = Column(Integer, ForeignKey('households.id'), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    category = Column(String, nullable=False)
+    type = Column(String, nullable=False)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('household_id', 'year', 'month', 'category', 'type', name='uq_household_aggregate'),
+    )
+
+class HouseholdMemberAggregate(Base):
+    __tablename__ = 'household_member_aggregates'
+    # Monatssummen je Mitglied für die Aufteilung der gemeinsamen Ausgaben
+    id = Column(Integer, primary_key=True, index=True)
+    household_id = Column(Integer, ForeignKey('households.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    type = Column(String, nullable=False)
+    total = Column(Float, default=0.0)
+
+    __table_args__ = (
+        UniqueConstraint('household_id', 'user_id', 'year', 'month', 'type', name='uq_household_member_aggregate'),
+    )
\ No newline at end of file
@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import DateTime, Float, bindparam, text
+
+# Externes FTS5-Inhaltsverzeichnis über transactions; Trigger halten es synchron
+_FTS_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+        description, category, subcategory,
+        content='transactions', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+        INSERT INTO transactions_fts (rowid, description, category, subcategory)
+        VALUES (new.id, new.description, new.category, new.subcategory);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description, category, subcategory)
+        VALUES ('delete', old.id, old.description, old.category, old.subcategory);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF description, category, subcategory ON transactions BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, description, category, subcategory)
+        VALUES ('delete', old.id, old.description, old.category, old.subcategory);
+        INSERT INTO transactions_fts (rowid, description, category, subcategory)
+        VALUES (new.id, new.description, new.category, new.subcategory);
+    END
+    """,
+]
+
+def ensure_search_index(engine) -> None:
+    """Legt den Volltextindex samt Triggern an und befüllt ihn beim ersten Mal aus den bestehenden Transaktionen."""
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'")
+        ).first()
+        for statement in _FTS_STATEMENTS:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')"))
+
+def build_match_query(terms: List[str]) -> str:
+    """Wandelt Suchbegriffe in eine FTS5-Abfrage mit Präfixsuche um: ['rew', 'kino'] -> '"rew"* "kino"*'."""
+    tokens = [term.replace('"', '') for term in terms]
+    return ' '.join(f'"{token}"*' for token in tokens if token)
+
+def search_transactions(session, user_id: int, terms: List[str], min_amount: Optional[float] = None,
+                        max_amount: Optional[float] = None, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, page: int = 0,
+                        page_size: int = 10) -> Tuple[List[tuple], bool]:
+    """
+    Sucht in Beschreibung, Kategorie und Unterkategorie der Transaktionen eines Benutzers.
+    Gibt eine Seite von (date, amount, currency, category, description, type)-Zeilen zurück und
+    ob es weitere Treffer gibt.
+    """
+    conditions = ["transactions_fts MATCH :match", "t.user_id = :user_id"]
+    params = {"match": build_match_query(terms), "user_id": user_id, "limit": page_size + 1, "offset": page * page_size}
+    if min_amount is not None:
+        conditions.append("t.amount >= :min_amount")
+        params["min_amount"] = min_amount
+    if max_amount is not None:
+        conditions.append("t.amount <= :max_amount")
+        params["max_amount"] = max_amount
+    if since is not None:
+        conditions.append("t.date >= :since")
+        params["since"] = since
+    if until is not None:
+        conditions.append("t.date < :until")
+        params["until"] = until
+
+    statement = text(
+        "SELECT t.date, t.amount, t.currency, t.category, t.description, t.type "
+        "FROM transactions_fts JOIN transactions t ON t.id = transactions_fts.rowid "
+        f"WHERE {' AND '.join(conditions)} "
+        "ORDER BY t.date DESC LIMIT :limit OFFSET :offset"
+    )
+    # Datumswerte im selben Format wie die DateTime-Spalte binden und zurücklesen
+    statement = statement.bindparams(
+        *(bindparam(name, type_=DateTime) for name in ('since', 'until') if name in params)
+    ).columns(date=DateTime, amount=Float)
+    rows = session.execute(statement, params).fetchall()
+    return rows[:page_size], len(rows) > page_size
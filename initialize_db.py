@@ -1,3 +1,20 @@
-from database import Base, engine
+from database import Base, SessionLocal, engine
+from database.migrations import add_missing_columns
+from database.search import ensure_search_index
+from utils.scheduler import backfill_schedules
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+Base.metadata.create_all(bind=engine)
+# Bestehende Datenbanken: neue Spalten per ALTER TABLE nachtragen
+added = add_missing_columns(engine)
+if added:
+    print(f"Spalten hinzugefügt: {', '.join(added)}")
+ensure_search_index(engine)
+
+# Zustelltermine für bestehende Benutzer; der Bot holt das beim Start ebenfalls nach
+session = SessionLocal()
+try:
+    created = backfill_schedules(session)
+    if created:
+        print(f"Zustelltermine angelegt: {created}")
+finally:
+    session.close()
\ No newline at end of file
@@ -1,7 +1,17 @@
+import asyncio
+import csv
+import io
 import logging
 import os
 from dotenv import load_dotenv
-from telegram import Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup
+
+# .env vor den utils-Modulen laden: sie lesen ihre Einstellungen (z. B. JOB_SHARDS, PROFILE_QUERIES) beim Import
+load_dotenv()
+
+from telegram import (
+    Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -10,21 +20,37 @@ from telegram.ext import (
     filters,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    InlineQueryHandler,
 )
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func
-from database import engine, SessionLocal
-from database.models import User, Transaction, Budget, Goal
+from sqlalchemy import exists, func, insert, literal, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import SessionLocal
+from database.models import User, Transaction, Budget, Goal, RecurringTransaction
+from database.search import search_transactions
+from database.goals import DEFAULT_GOAL_CATEGORY, goal_pace
 from datetime import datetime, time, timedelta
-from utils.api_integration import categorize_transaction, get_financial_recommendations, APIError, debug_api_response
-from utils.visualization import generate_financial_report
+from utils.api_integration import get_financial_recommendations, APIError, UNCATEGORIZED, debug_api_response, llm_client
+from utils.batcher import categorizer
 from utils.reminders import schedule_budget_check_job
-import bcrypt
+from utils.cluster import run_webhook_cluster, leader_only
+from utils.persistence import SQLitePersistence
+from utils.digests import stage_weekly_digests, send_weekly_digests
+from utils.jobs import iter_pages, relevant_user_criteria, relevant_user_ids, run_sharded, send_to_user, track_activity
+from utils.ratelimit import AsyncRateLimiter
+from database.households import normalize_category as normalize_household_category
+from utils.households import check_household_budget, create_household, household_overview, join_household, leave_household, membership, notify_household, set_household_budget
+from utils.snapshots import INLINE_CACHE_TIME, inline_entries, snapshot_cache
+from utils.profiling import profile_handlers, profiled, setup as setup_profiling
+from utils.archive import archive_transactions, category_type_totals, load_archived_transactions
+from utils.scheduler import DEFAULT_TIMEZONE, backfill_schedules, claim_due, is_valid_timezone, schedule_user
+from utils.recurring import match_recurring, mark_booked, parse_amount, upcoming_recurring, detect_recurring, book_due_recurring
 import pytz
 import calendar
-
-# Load environment variables
-load_dotenv()
+import re
+import threading
+from typing import List
 
 # Set up logging
 logging.basicConfig(
@@ -33,12 +59,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize database session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
 # Define states for Conversation Handlers
 ADD_TRANSACTION, SET_BUDGET, SET_GOAL = range(3)
 
+# Transaktionen je Lauf der Nachkategorisierung
+RECATEGORIZE_BATCH_SIZE = 100
+
 # Fügen Sie diese Funktion am Anfang der Datei hinzu
 def normalize_category(category: str) -> str:
     """Normalizes category names to merge similar categories."""
@@ -146,17 +172,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/addexpense - Ausgabe hinzufügen\n"
         "/addincome - Einnahme hinzufügen\n"
         "/list - Letzte Transaktionen anzeigen\n"
-        "/delete <nummer> - Transaktion löschen\n\n"
+        "/export - Alle Transaktionen als CSV\n"
+        "/search <begriff> - Transaktionen durchsuchen\n"
+        "/delete <nummer> - Transaktion löschen\n"
+        "/recurring - Wiederkehrende Zahlungen\n\n"
         "💰 Budgets & Ziele:\n"
         "/setbudget - Budget festlegen\n"
         "/viewbudget - Budgets anzeigen\n"
         "/setgoal - Finanzziel setzen\n"
-        "/viewgoals - Ziele anzeigen\n\n"
+        "/viewgoals - Ziele anzeigen\n"
+        "/household - Gemeinsames Haushaltsbuch\n\n"
         "📈 Berichte & Analysen:\n"
-        "/report - Finanzübersicht generieren\n"
+        "/report [text|matplotlib] - Finanzübersicht generieren\n"
+        "/trends - Ausgabenentwicklung anzeigen\n"
+        "/compare - Zwei Monate vergleichen\n"
         "/advice - Finanzratschläge erhalten\n\n"
         "🛠 Sonstiges:\n"
         "/mergecategories <alt> <neu> - Kategorien zusammenführen\n"
+        "/timezone <zone> - Zeitzone für Benachrichtigungen\n"
         "/help - Diese Hilfe anzeigen\n\n"
         "Tippe einen Befehl oder /help <befehl> für mehr Infos."
     )
@@ -170,17 +203,24 @@ async def detailed_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     command = context.args[0].lower()
     help_texts = {
-        "addexpense": "Füge eine neue Ausgabe hinzu. Beispiel: /addexpense 50€ für Lebensmittel",
+        "addexpense": "Füge eine neue Ausgabe hinzu. Beispiel: /addexpense 50€ für Lebensmittel\nMehrere Ausgaben auf einmal: eine pro Zeile.",
         "addincome": "Füge eine neue Einnahme hinzu. Beispiel: /addincome 1000€ Gehalt",
         "list": "Zeigt deine letzten 10 Transaktionen an.",
+        "export": "Schickt dir alle Transaktionen (auch archivierte) als CSV-Datei.",
+        "search": "Durchsucht alle Transaktionen. Beispiel: /search rewe 10-50€ seit 01.01.2024 bis 31.03.2024",
         "delete": "Löscht eine Transaktion. Nutze /list und dann /delete <nummer>",
+        "recurring": "Zeigt erkannte wiederkehrende Zahlungen. /recurring auto <nummer> bucht sie automatisch.",
         "setbudget": "Lege ein neues Budget fest. Beispiel: /setbudget Lebensmittel: 300€ pro Monat",
         "viewbudget": "Zeigt alle deine aktuellen Budgets an.",
-        "setgoal": "Setze ein finanzielles Ziel. Beispiel: /setgoal Urlaub: 1000€ bis 31.12.2023",
+        "setgoal": "Setze ein finanzielles Ziel. Beispiel: /setgoal Urlaub: 1000€ bis 31.12.2023 #travel\nBuchungen der angegebenen Kategorie (Standard: savings) zählen zum Ziel.",
         "viewgoals": "Zeigt alle deine aktuellen finanziellen Ziele an.",
-        "report": "Generiert einen visuellen Bericht deiner Ausgaben und Einnahmen.",
+        "household": "Gemeinsames Haushaltsbuch für Familie oder WG. Lege einen Haushalt mit /household create <Name> an und teile den Einladungscode; andere treten mit /household join <Code> bei. Danach zählen eure Buchungen zu den gemeinsamen Budgets (/household budget <Kategorie> <Betrag>).",
+        "report": "Generiert einen visuellen Bericht deiner Ausgaben und Einnahmen. /report text liefert eine Textübersicht, /report matplotlib den ausführlichen Bericht.",
+        "trends": "Zeigt deine Ausgaben der letzten 6 Monate mit Veränderung und gleitendem Durchschnitt.",
+        "compare": "Vergleicht zwei Monate je Kategorie. Beispiel: /compare 01.2024 02.2024",
         "advice": "Gibt dir personalisierte Finanzratschläge basierend auf deinen Daten.",
-        "mergecategories": "Führt zwei Kategorien zusammen. Beispiel: /mergecategories Essen Lebensmittel"
+        "mergecategories": "Führt zwei Kategorien zusammen. Beispiel: /mergecategories Essen Lebensmittel",
+        "timezone": "Setzt deine Zeitzone, nach der sich Prognosen und Zusammenfassungen richten. Beispiel: /timezone Europe/Vienna"
     }
 
     if command in help_texts:
@@ -194,32 +234,38 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Begrüßungsnachricht und Registrierung des Benutzers."""
     user = update.effective_user
     session = SessionLocal()
-    db_user = session.query(User).filter(User.telegram_id == user.id).first()
-    if not db_user:
-        # Sichere Passwort-Hashing
-        plain_password = "IhrStandardPasswort"  # Ersetzen Sie dies durch ein tatsächliches Passwort
-        hashed = bcrypt.hashpw(plain_password.encode('utf-8'), bcrypt.gensalt())
-        
-        db_user = User(
-            telegram_id=user.id,
-            username=user.username,
-            hashed_password=hashed.decode('utf-8')  # Speichern Sie als String
+    try:
+        # Telegram-Usernamen können an ein anderes Konto weitergegeben werden; der alte Eintrag gibt ihn frei,
+        # damit der Unique-Constraint auf username das Anlegen nicht verhindert
+        if user.username:
+            session.query(User).filter(User.username == user.username, User.telegram_id != user.id).update(
+                {User.username: None}, synchronize_session=False
+            )
+        # Idempotentes Anlegen per Upsert, ohne Passwort-Hash: der Bot authentifiziert über die Telegram-ID
+        result = session.execute(
+            sqlite_insert(User)
+            .values(telegram_id=user.id, username=user.username, last_active_at=datetime.now())
+            .on_conflict_do_nothing()
         )
-        session.add(db_user)
         session.commit()
-        session.refresh(db_user)
-        logger.info(f"Neuer Benutzer erstellt: Telegram ID = {db_user.telegram_id}, Username = {db_user.username}")
-        await update.message.reply_text(
-            f"Willkommen, {user.first_name}! Dein Konto wurde erstellt.",
-            reply_markup=ForceReply(selective=True)
-        )
-    else:
-        logger.info(f"Benutzer gefunden: Telegram ID = {db_user.telegram_id}, Username = {db_user.username}")
-        await update.message.reply_text(
-            f"Willkommen zurück, {user.first_name}!",
-            reply_markup=ForceReply(selective=True)
-        )
-    session.close()
+
+        if result.rowcount:
+            user_id = session.query(User.id).filter(User.telegram_id == user.id).scalar()
+            schedule_user(session, user_id, None)
+            session.commit()
+            logger.info(f"Neuer Benutzer erstellt: Telegram ID = {user.id}, Username = {user.username}")
+            await update.message.reply_text(
+                f"Willkommen, {user.first_name}! Dein Konto wurde erstellt.",
+                reply_markup=ForceReply(selective=True)
+            )
+        else:
+            logger.info(f"Benutzer gefunden: Telegram ID = {user.id}, Username = {user.username}")
+            await update.message.reply_text(
+                f"Willkommen zurück, {user.first_name}!",
+                reply_markup=ForceReply(selective=True)
+            )
+    finally:
+        session.close()
 
 async def add_transaction_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the process of adding a transaction."""
@@ -237,46 +283,81 @@ async def add_transaction_start(update: Update, context: ContextTypes.DEFAULT_TY
     )
     return ADD_TRANSACTION
 
+def degraded_categorization(text: str, error: Exception) -> tuple:
+    """Ersatz, wenn die API nicht erreichbar ist: Betrag lokal lesen, Kategorie später nachtragen."""
+    logger.warning(f"Kategorisierung nicht verfügbar ({error}), speichere '{text}' ohne Kategorie.")
+    return UNCATEGORIZED, '', parse_amount(text), 'EUR'
+
 async def add_transaction_end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Processes the added transaction."""
+    """Processes the added transaction. Nachrichten mit mehreren Zeilen werden als Sammelbuchung verarbeitet."""
     user_input = update.message.text
     user = update.effective_user
-    session = SessionLocal()
 
-    try:
-        # Verwende die verbesserte Kategorisierungsfunktion
-        category, subcategory, amount, currency = categorize_transaction(user_input)
+    lines = [line.strip() for line in user_input.splitlines() if line.strip()]
+    if len(lines) > 1:
+        return await add_transactions_batch(update, context, lines)
 
-        if amount <= 0:
-            await update.message.reply_text("Der Betrag muss größer als 0 sein.")
-            return ADD_TRANSACTION
+    session = SessionLocal()
+    transaction_type = context.user_data.get('transaction_type', 'expense')
 
+    try:
         db_user = session.query(User).filter(User.telegram_id == user.id).first()
         if not db_user:
             await update.message.reply_text("Benutzerkonto nicht gefunden. Bitte starte den Bot mit /start.")
             return ConversationHandler.END
 
+        # Bekannte wiederkehrende Zahlungen (Miete, Abos) werden ohne API-Anfrage kategorisiert
+        recurring = match_recurring(session, db_user.id, user_input, transaction_type)
+        if recurring:
+            category, subcategory, amount, currency = (
+                recurring.category, recurring.subcategory, parse_amount(user_input), recurring.currency
+            )
+        else:
+            try:
+                # Gleichzeitige Eingaben mehrerer Benutzer werden zu einer API-Anfrage gebündelt
+                category, subcategory, amount, currency = await categorizer.categorize(user_input)
+            except APIError as e:
+                # Degraded Mode: mit lokal gelesenem Betrag speichern, die Kategorie holt recategorize_pending nach
+                category, subcategory, amount, currency = degraded_categorization(user_input, e)
+                if amount is None:
+                    await update.message.reply_text(
+                        "Die Kategorisierung ist gerade nicht erreichbar und ich konnte keinen Betrag erkennen. "
+                        "Bitte gib den Betrag als Zahl an, z. B. 12,50€ Mittagessen."
+                    )
+                    return ADD_TRANSACTION
+
+        if amount <= 0:
+            await update.message.reply_text("Der Betrag muss größer als 0 sein.")
+            return ADD_TRANSACTION
+
+        now = datetime.now()
         transaction = Transaction(
             user_id=db_user.id,
             amount=amount,
             description=user_input,
-            date=datetime.now(),
+            date=now,
             category=category,
             subcategory=subcategory,
             currency=currency,
-            type=context.user_data.get('transaction_type', 'expense')
+            type=transaction_type,
+            recurring_id=recurring.id if recurring else None
         )
         session.add(transaction)
+        if recurring:
+            mark_booked(recurring, now)
         session.commit()
 
-        await update.message.reply_text(
+        message = (
             f"{'Ausgabe' if transaction.type == 'expense' else 'Einnahme'} hinzugefügt: "
             f"{transaction.amount} {transaction.currency} für {transaction.description}\n"
             f"Kategorie: {transaction.category}\n"
             f"Unterkategorie: {transaction.subcategory}"
         )
+        if transaction.category == UNCATEGORIZED:
+            message += "\n\nDie Kategorie wird nachgetragen, sobald der Dienst wieder erreichbar ist."
+        await update.message.reply_text(message)
 
-        if transaction.type == 'expense':
+        if transaction.type == 'expense' and transaction.category != UNCATEGORIZED:
             await check_budget(update, context, db_user, transaction.category, transaction.amount)
 
     except Exception as e:
@@ -287,35 +368,129 @@ async def add_transaction_end(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     return ConversationHandler.END
 
+async def add_transactions_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, lines: List[str]) -> int:
+    """Bucht mehrere Transaktionen aus einer Nachricht über gebündelte API-Anfragen und einen Commit."""
+    user = update.effective_user
+    transaction_type = context.user_data.get('transaction_type', 'expense')
+    session = SessionLocal()
+
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Benutzerkonto nicht gefunden. Bitte starte den Bot mit /start.")
+            return ConversationHandler.END
+
+        # Wie bei Einzelbuchungen: bekannte wiederkehrende Zahlungen zuerst, nur der Rest geht an die API
+        recurring = [match_recurring(session, db_user.id, line, transaction_type) for line in lines]
+        pending = [line for line, match in zip(lines, recurring) if not match]
+        categorized = iter(await asyncio.gather(*(categorizer.categorize(line) for line in pending), return_exceptions=True))
+        results = []
+        for line, match in zip(lines, recurring):
+            if match:
+                results.append((match.category, match.subcategory, parse_amount(line), match.currency))
+                continue
+            result = next(categorized)
+            if isinstance(result, APIError):
+                result = degraded_categorization(line, result)
+            elif isinstance(result, Exception):
+                raise result
+            results.append(result)
+
+        now = datetime.now()
+        transactions = []
+        skipped = []
+        category_totals = {}
+        summary_lines = []
+        for line, match, (category, subcategory, amount, currency) in zip(lines, recurring, results):
+            if amount is None or amount <= 0:
+                skipped.append(line)
+                continue
+            transactions.append(Transaction(
+                user_id=db_user.id,
+                amount=amount,
+                description=line,
+                date=now,
+                category=category,
+                subcategory=subcategory,
+                currency=currency,
+                type=transaction_type,
+                recurring_id=match.id if match else None
+            ))
+            if match:
+                mark_booked(match, now)
+            category_totals[category] = category_totals.get(category, 0) + amount
+            summary_lines.append(f"- {amount} {currency} für {line} ({category})")
+
+        session.add_all(transactions)
+        session.commit()
+
+        summary = f"{len(transactions)} {'Ausgaben' if transaction_type == 'expense' else 'Einnahmen'} hinzugefügt:\n"
+        summary += "\n".join(summary_lines)
+        if skipped:
+            summary += "\n\nNicht übernommen (kein gültiger Betrag):\n" + "\n".join(f"- {line}" for line in skipped)
+        await update.message.reply_text(summary)
+
+        if transaction_type == 'expense':
+            for category, amount in category_totals.items():
+                if category != UNCATEGORIZED:
+                    await check_budget(update, context, db_user, category, amount)
+
+    except Exception as e:
+        logger.error(f"Fehler beim Hinzufügen der Transaktionen: {e}")
+        await update.message.reply_text("Es gab einen Fehler beim Hinzufügen der Transaktionen.")
+    finally:
+        session.close()
+
+    return ConversationHandler.END
+
 async def check_budget(update: Update, context: ContextTypes.DEFAULT_TYPE, db_user: User, category: str, amount: float) -> None:
     """Checks the budget for a given category and sends warnings if necessary."""
     session = SessionLocal()
     try:
         budget = session.query(Budget).filter(Budget.user_id == db_user.id, Budget.name == category).first()
         if budget:
-            total = session.query(func.sum(Transaction.amount)).filter(
+            # Ausgaben des laufenden Monats, damit sie mit den noch anstehenden Zahlungen desselben Monats
+            # vergleichbar sind (der laufende Monat liegt nie im Archiv)
+            now = datetime.now()
+            month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            total = session.query(func.coalesce(func.sum(Transaction.amount), 0.0)).filter(
                 Transaction.user_id == db_user.id,
                 Transaction.category == category,
-                Transaction.type == 'expense'
-            ).scalar() or 0.0
+                Transaction.type == 'expense',
+                Transaction.date >= month_start,
+                Transaction.date < month_end
+            ).scalar()
+
+            # Noch anstehende Daueraufträge dieses Monats sind bereits fest eingeplant
+            upcoming = sum(
+                amount_due for _, name, amount_due in upcoming_recurring(session, now, month_end, [db_user.id])
+                if name == category
+            )
 
             if total > budget.limit:
                 percentage = (total / budget.limit) * 100
                 await update.message.reply_text(
                     f"⚠️ Warning: You've exceeded your budget for {category}!\n"
                     f"Limit: {budget.limit}€\n"
-                    f"Current expenses: {total}€ ({percentage:.1f}% of budget)"
+                    f"Expenses this month: {total}€ ({percentage:.1f}% of budget)"
                 )
-            elif total > budget.limit * 0.8:
+            elif total + upcoming > budget.limit * 0.8:
                 percentage = (total / budget.limit) * 100
-                await update.message.reply_text(
+                message = (
                     f"⚠️ Attention: You've used {percentage:.1f}% of your budget for {category}.\n"
                     f"Limit: {budget.limit}€\n"
-                    f"Current expenses: {total}€"
+                    f"Expenses this month: {total}€"
                 )
+                if upcoming:
+                    message += f"\nUpcoming recurring payments this month: {upcoming}€"
+                await update.message.reply_text(message)
     finally:
         session.close()
 
+    # Gemeinsames Budget des Haushalts: eine Abfrage über die Monatssummen, Warnung an alle Mitglieder
+    await check_household_budget(context.bot, db_user.id, category, amount)
+
 async def set_budget_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Startet den Prozess zum Setzen eines Budgets."""
     await update.message.reply_text(
@@ -369,7 +544,9 @@ async def set_goal_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Startet den Prozess zum Setzen eines finanziellen Ziels."""
     await update.message.reply_text(
         "Bitte gib dein finanzielles Ziel ein. Zum Beispiel:\n"
-        "Sparen: 1000€ bis 31.12.2024"
+        "Sparen: 1000€ bis 31.12.2024\n\n"
+        "Standardmäßig zählen Buchungen der Kategorie 'savings'. Eine andere Kategorie gibst du mit # an:\n"
+        "Urlaub: 1500€ bis 30.06.2025 #travel"
     )
     return SET_GOAL
 
@@ -387,8 +564,12 @@ async def set_goal_end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             return ConversationHandler.END
 
         description, rest = user_input.split(':', 1)
+        # Optionale Kategorie als #kategorie am Ende
+        category_match = re.search(r'#(\S+)', rest)
+        category = category_match.group(1).lower() if category_match else DEFAULT_GOAL_CATEGORY
+        rest = re.sub(r'#\S+', '', rest)
         amount, deadline_str = rest.strip().split(' bis ')
-        amount = float(amount.replace('€', ''))
+        amount = float(amount.replace('€', '').replace(',', '.'))
         deadline = datetime.strptime(deadline_str.strip(), '%d.%m.%Y')
 
         db_user = session.query(User).filter(User.telegram_id == user.id).first()
@@ -396,11 +577,17 @@ async def set_goal_end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             user_id=db_user.id,
             name=description.strip(),
             target_amount=amount,
-            current_amount=0.0
+            current_amount=0.0,
+            category=category,
+            deadline=deadline,
+            created_at=datetime.now()
         )
         session.add(goal)
         session.commit()
-        await update.message.reply_text(f"Finanzielles Ziel gesetzt: {goal.name} - {goal.target_amount}€ bis {deadline.strftime('%d.%m.%Y')}.")
+        await update.message.reply_text(
+            f"Finanzielles Ziel gesetzt: {goal.name} - {goal.target_amount}€ bis {deadline.strftime('%d.%m.%Y')}.\n"
+            f"Buchungen der Kategorie '{category}' zählen ab jetzt zum Ziel."
+        )
         session.close()
     except Exception as e:
         logger.error(f"Fehler beim Setzen des Ziels: {e}")
@@ -437,21 +624,152 @@ async def view_goals(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     else:
         goal_text = "Deine aktuellen finanziellen Ziele:\n"
         for goal in goals:
-            goal_text += f"- {goal.name}: {goal.target_amount}€\n"
+            current_amount = goal.current_amount or 0.0
+            goal_text += f"- {goal.name}: {current_amount:.2f}€ von {goal.target_amount}€"
+            if goal.deadline:
+                goal_text += f" bis {goal.deadline.strftime('%d.%m.%Y')}"
+            if goal.category:
+                goal_text += f" (#{goal.category})"
+            goal_text += "\n"
         await update.message.reply_text(goal_text)
     session.close()
 
+async def inline_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Beantwortet Inline-Anfragen (@bot groceries) mit den Summen des laufenden Monats aus dem Schnappschuss-Cache.
+    Nur beim ersten Aufruf oder nach Ablauf des Schnappschusses wird die Datenbank gelesen.
+    """
+    inline_query = update.inline_query
+    snapshot = snapshot_cache.get(inline_query.from_user.id)
+    if snapshot is None:
+        session = SessionLocal()
+        try:
+            snapshot = snapshot_cache.load(session, inline_query.from_user.id)
+        finally:
+            session.close()
+
+    if snapshot is None:
+        await inline_query.answer(
+            [], cache_time=INLINE_CACHE_TIME, is_personal=True,
+            button=InlineQueryResultsButton(text="Bot starten", start_parameter="inline")
+        )
+        return
+
+    results = [
+        InlineQueryResultArticle(
+            id=str(index), title=title, description=description,
+            input_message_content=InputTextMessageContent(message)
+        )
+        for index, (title, description, message) in enumerate(inline_entries(snapshot, inline_query.query))
+    ]
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+HOUSEHOLD_USAGE = (
+    "Verwendung:\n"
+    "/household - Übersicht und Aufteilung des laufenden Monats\n"
+    "/household create <Name> - Haushalt anlegen\n"
+    "/household join <Code> - Haushalt beitreten\n"
+    "/household leave - Haushalt verlassen\n"
+    "/household budget <Kategorie> <Betrag> - Gemeinsames Monatsbudget setzen\n"
+    "/household share <Gewicht> - Deinen Anteil an den Ausgaben festlegen (Standard 1)"
+)
+
+async def household(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Verwaltet das gemeinsame Haushaltsbuch. Buchungen von Mitgliedern zählen automatisch zum Haushalt."""
+    user = update.effective_user
+    args = context.args or []
+    action = args[0].lower() if args else ''
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
+        member = membership(session, db_user.id)
+
+        if action in ('create', 'join') and member:
+            await update.message.reply_text(
+                f"Du bist bereits Mitglied im Haushalt {member.household.name}. Verlasse ihn zuerst mit /household leave."
+            )
+        elif action == 'create':
+            name = ' '.join(args[1:]).strip() or f"Haushalt von {user.first_name}"
+            created = create_household(session, db_user.id, name)
+            await update.message.reply_text(
+                f"Haushalt {created.name} angelegt. Andere treten mit /household join {created.invite_code} bei."
+            )
+        elif action == 'join':
+            if len(args) != 2:
+                await update.message.reply_text(HOUSEHOLD_USAGE)
+                return
+            joined = join_household(session, db_user.id, args[1])
+            if joined is None:
+                await update.message.reply_text("Unbekannter Einladungscode.")
+                return
+            await notify_household(context.bot, joined.id, f"{user.first_name} ist dem Haushalt {joined.name} beigetreten.")
+        elif not member:
+            await update.message.reply_text(
+                "Du bist in keinem Haushalt. Lege einen an mit /household create <Name> oder tritt mit /household join <Code> bei."
+            )
+        elif action == 'leave':
+            name = member.household.name
+            if leave_household(session, member):
+                await update.message.reply_text(f"Du hast den Haushalt {name} als letztes Mitglied verlassen; er wurde aufgelöst.")
+            else:
+                await update.message.reply_text(f"Du hast den Haushalt {name} verlassen. Bisherige Buchungen bleiben im Haushaltsbuch.")
+        elif action == 'budget':
+            if len(args) != 3:
+                await update.message.reply_text(HOUSEHOLD_USAGE)
+                return
+            category, limit = normalize_household_category(args[1]), float(args[2].replace(',', '.').rstrip('€'))
+            set_household_budget(session, member.household_id, category, limit)
+            await notify_household(
+                context.bot, member.household_id,
+                f"{user.first_name} hat das Haushaltsbudget für {category} auf {limit:.2f}€ pro Monat gesetzt."
+            )
+        elif action == 'share':
+            if len(args) != 2 or float(args[1].replace(',', '.')) <= 0:
+                await update.message.reply_text(HOUSEHOLD_USAGE)
+                return
+            member.share = float(args[1].replace(',', '.'))
+            session.commit()
+            await update.message.reply_text(f"Dein Anteil an den gemeinsamen Ausgaben hat jetzt das Gewicht {member.share:g}.")
+        elif action:
+            await update.message.reply_text(HOUSEHOLD_USAGE)
+        else:
+            await update.message.reply_text(household_overview(session, member.household))
+    except ValueError:
+        await update.message.reply_text(HOUSEHOLD_USAGE)
+    except Exception as e:
+        logger.error(f"Fehler bei /household: {e}")
+        await update.message.reply_text("Es gab einen Fehler beim Bearbeiten des Haushalts.")
+    finally:
+        session.close()
+
 async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Generiert und sendet einen Finanzberich an den Benutzer."""
+    """
+    Generiert und sendet einen Finanzbericht an den Benutzer.
+    /report liefert ein schnell gerendertes Bild, /report text eine Textübersicht und
+    /report matplotlib den ausführlichen Bericht über matplotlib.
+    """
+    from utils.visualization import generate_financial_report, render_chart_report, render_text_report
+
     user = update.effective_user
+    mode = context.args[0].lower() if context.args else 'chart'
     session = SessionLocal()
     db_user = session.query(User).filter(User.telegram_id == user.id).first()
 
     try:
-        report_image = generate_financial_report(db_user.id)
-        with open(report_image, 'rb') as photo:
-            await update.message.reply_photo(photo=photo, caption="Dein Finanzbericht:")
-        os.remove(report_image)  # Entferne das temporäre Bild
+        if mode == 'text':
+            await update.message.reply_text(render_text_report(db_user.id))
+        elif mode == 'matplotlib':
+            # matplotlib wird erst beim ersten Bericht dieser Art geladen
+            report_image = generate_financial_report(db_user.id)
+            with open(report_image, 'rb') as photo:
+                await update.message.reply_photo(photo=photo, caption="Dein Finanzbericht:")
+            os.remove(report_image)  # Entferne das temporäre Bild
+        else:
+            image, caption = render_chart_report(db_user.id)
+            await update.message.reply_photo(photo=image, caption=caption)
     except ValueError as ve:
         logger.error(f"Fehler beim Generieren des Berichts: {ve}")
         await update.message.reply_text(str(ve))
@@ -480,6 +798,41 @@ async def list_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     session.close()
 
+async def export_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Exportiert alle Transaktionen des Benutzers als CSV, inklusive der archivierten."""
+    user = update.effective_user
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
+
+        columns = ('date', 'amount', 'currency', 'type', 'category', 'subcategory', 'description')
+        hot = session.query(*(getattr(Transaction, name) for name in columns)).filter(
+            Transaction.user_id == db_user.id
+        ).order_by(Transaction.date).all()
+        # Archivierte Jahre werden nur für den Export geöffnet
+        archived = [tuple(getattr(row, name) for name in columns) for row in load_archived_transactions(db_user.id)]
+    finally:
+        session.close()
+
+    rows = archived + hot
+    if not rows:
+        await update.message.reply_text("Du hast noch keine Transaktionen.")
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[0].isoformat() if row[0] else '', *row[1:]])
+    await update.message.reply_document(
+        document=io.BytesIO(buffer.getvalue().encode('utf-8')),
+        filename='transaktionen.csv',
+        caption=f"{len(rows)} Transaktionen"
+    )
+
 async def delete_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Löscht eine Transaktion basierend auf der Nummer aus der Liste."""
     user = update.effective_user
@@ -509,45 +862,314 @@ async def delete_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
     finally:
         session.close()
 
-async def check_budget_progress(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Überprüft den Fortschritt der Budgets und sendet Benachrichtigungen."""
+async def check_budget_progress(bot, user_ids: List[int], limiter: AsyncRateLimiter) -> None:
+    """Prognostiziert die Monatsausgaben je Budget der fälligen Benutzer und warnt frühzeitig vor Überschreitungen."""
+    from utils.forecasting import forecast_budgets, forecast_warnings
+
     session = SessionLocal()
-    users = session.query(User).all()
+    try:
+        forecasts = forecast_budgets(session, user_ids=user_ids)
+    finally:
+        session.close()
 
-    for user in users:
-        budgets = session.query(Budget).filter(Budget.user_id == user.id).all()
-        for budget in budgets:
-            total = session.query(func.sum(Transaction.amount)).filter(
-                Transaction.user_id == user.id,
-                Transaction.category == budget.name,
-                Transaction.type == 'expense',
-                Transaction.date >= datetime.now().replace(day=1)
-            ).scalar() or 0.0
-
-            percentage = (total / budget.limit) * 100 if budget.limit > 0 else 0
-            if percentage >= 80:
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"Achtung: Du hast bereits {percentage:.1f}% deines Budgets für {budget.name} ausgegeben."
-                )
+    for telegram_id, text in forecast_warnings(forecasts).items():
+        await send_to_user(bot, telegram_id, text, limiter)
 
-    session.close()
+async def check_goal_progress(bot, user_ids: List[int], limiter: AsyncRateLimiter) -> None:
+    """Meldet den fälligen Benutzern den Fortschritt ihrer Ziele und die nötige Sparrate pro Woche."""
+    session = SessionLocal()
+    try:
+        rows = goal_pace(session, user_ids)
+    finally:
+        session.close()
+
+    messages = {}
+    for telegram_id, name, current_amount, target_amount, deadline, per_week in rows:
+        current_amount = current_amount or 0.0
+        progress = (current_amount / target_amount) * 100 if target_amount else 0
+        line = f"- {name}: {progress:.1f}% ({current_amount:.2f}€ von {target_amount}€)"
+        if deadline and current_amount < target_amount:
+            line += f", bis {deadline.strftime('%d.%m.%Y')} noch {per_week:.2f}€ pro Woche"
+        messages.setdefault(telegram_id, []).append(line)
+
+    for telegram_id, lines in messages.items():
+        await send_to_user(bot, telegram_id, "Ziel-Update:\n" + "\n".join(lines), limiter)
+
+async def trends(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Zeigt die Ausgabenentwicklung der letzten Monate und die Kategorienanteile des aktuellen Monats."""
+    from utils.analytics import load_user_history, month_over_month, category_shares, month_index
+
+    user = update.effective_user
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
+
+        frame = load_user_history(session, db_user.id)
+        if not len(frame):
+            await update.message.reply_text("Du hast noch keine Transaktionen.")
+            return
 
-async def check_goal_progress(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Überprüft den Fortschritt der Ziele und sendet Benachrichtigungen."""
+        message = "📈 Ausgaben der letzten 6 Monate:\n\n"
+        for label, total, delta, average in month_over_month(frame, 'expense', months=6, window=3):
+            message += f"{label}: {total:.2f}€ ({delta:+.2f}€, Ø3M {average:.2f}€)\n"
+
+        now = datetime.now()
+        shares = category_shares(frame, 'expense', month=month_index(now.year, now.month))
+        if shares:
+            message += "\nAnteile diesen Monat:\n"
+            for category, share in shares[:5]:
+                message += f"- {category}: {share * 100:.1f}%\n"
+
+        await update.message.reply_text(message)
+    except Exception as e:
+        logger.error(f"Fehler beim Berechnen der Trends: {e}")
+        await update.message.reply_text("Es gab einen Fehler beim Berechnen der Trends.")
+    finally:
+        session.close()
+
+async def compare(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Vergleicht die Ausgaben zweier Monate je Kategorie (Standard: Vormonat mit aktuellem Monat)."""
+    from utils.analytics import load_user_history, compare_months, month_index, month_label
+
+    user = update.effective_user
     session = SessionLocal()
-    users = session.query(User).all()
+    try:
+        if context.args and len(context.args) == 2:
+            first, second = (datetime.strptime(arg, '%m.%Y') for arg in context.args)
+            month_a = month_index(first.year, first.month)
+            month_b = month_index(second.year, second.month)
+        else:
+            now = datetime.now()
+            month_b = month_index(now.year, now.month)
+            month_a = month_b - 1
 
-    for user in users:
-        goals = session.query(Goal).filter(Goal.user_id == user.id).all()
-        for goal in goals:
-            progress = (goal.current_amount / goal.target_amount) * 100 if goal.target_amount > 0 else 0
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
+
+        frame = load_user_history(session, db_user.id)
+        rows = compare_months(frame, month_a, month_b, 'expense')
+        if not rows:
+            await update.message.reply_text(f"Keine Ausgaben in {month_label(month_a)} oder {month_label(month_b)}.")
+            return
+
+        message = f"Vergleich {month_label(month_a)} → {month_label(month_b)}:\n\n"
+        for category, total_a, total_b, delta in rows[:10]:
+            message += f"- {category}: {total_a:.2f}€ → {total_b:.2f}€ ({delta:+.2f}€)\n"
+        message += f"\nGesamt: {sum(r[1] for r in rows):.2f}€ → {sum(r[2] for r in rows):.2f}€"
+        await update.message.reply_text(message)
+    except ValueError:
+        await update.message.reply_text("Ungültiges Format. Beispiel: /compare 01.2024 02.2024")
+    except Exception as e:
+        logger.error(f"Fehler beim Vergleichen der Monate: {e}")
+        await update.message.reply_text("Es gab einen Fehler beim Vergleichen der Monate.")
+    finally:
+        session.close()
+
+def parse_search_args(args: List[str]) -> dict:
+    """
+    Zerlegt '/search rewe 10-50€ seit 01.01.2024 bis 31.03.2024' in Suchbegriffe und Filter.
+    Beträge als Bereich 'von-bis' (eine Seite darf fehlen), Datumsangaben im Format TT.MM.JJJJ.
+    """
+    query = {'terms': [], 'min_amount': None, 'max_amount': None, 'since': None, 'until': None}
+    tokens = list(args)
+    while tokens:
+        token = tokens.pop(0)
+        amount_range = re.fullmatch(r'(\d+(?:[.,]\d+)?)?-(\d+(?:[.,]\d+)?)?€?', token)
+        if token.lower() in ('seit', 'ab', 'bis') and tokens:
+            day = datetime.strptime(tokens.pop(0), '%d.%m.%Y')
+            if token.lower() == 'bis':
+                query['until'] = (day + timedelta(days=1)).isoformat()
+            else:
+                query['since'] = day.isoformat()
+        elif amount_range and token != '-':
+            low, high = amount_range.groups()
+            query['min_amount'] = float(low.replace(',', '.')) if low else None
+            query['max_amount'] = float(high.replace(',', '.')) if high else None
+        else:
+            query['terms'].append(token)
+    return query
+
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Volltextsuche über alle Transaktionen des Benutzers."""
+    try:
+        query = parse_search_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text("Ungültiges Datum. Bitte verwende das Format TT.MM.JJJJ.")
+        return
+
+    if not query['terms']:
+        await update.message.reply_text("Bitte gib einen Suchbegriff an. Beispiel: /search rewe 10-50€ seit 01.01.2024")
+        return
+
+    # Für die Seitennavigation über die Buttons merken (wird mit user_data persistiert)
+    context.user_data['search'] = query
+    text, reply_markup = search_page_message(update.effective_user.id, query, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Blättert in den Suchergebnissen."""
+    callback_query = update.callback_query
+    await callback_query.answer()
+    query = context.user_data.get('search')
+    if not query:
+        await callback_query.edit_message_text("Die Suche ist abgelaufen. Bitte starte sie erneut mit /search.")
+        return
+    page = int(callback_query.data.split(':', 1)[1])
+    text, reply_markup = search_page_message(update.effective_user.id, query, page)
+    await callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+def search_page_message(telegram_id: int, query: dict, page: int, page_size: int = 10):
+    """Lädt eine Ergebnisseite und baut Text und Navigationsbuttons."""
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == telegram_id).first()
+        if not db_user:
+            return "Bitte starte den Bot zuerst mit /start.", None
+        rows, has_more = search_transactions(
+            session, db_user.id, query['terms'],
+            min_amount=query['min_amount'], max_amount=query['max_amount'],
+            since=datetime.fromisoformat(query['since']) if query['since'] else None,
+            until=datetime.fromisoformat(query['until']) if query['until'] else None,
+            page=page, page_size=page_size
+        )
+    finally:
+        session.close()
+
+    if not rows:
+        return ("Keine Treffer." if page == 0 else "Keine weiteren Treffer."), None
+
+    text = f"Suchergebnisse für '{' '.join(query['terms'])}' (Seite {page + 1}):\n\n"
+    for i, (date, amount, currency, category, description, tx_type) in enumerate(rows, page * page_size + 1):
+        text += f"{i}. {date.strftime('%d.%m.%Y')} - {amount} {currency or '€'} {description} ({category}, {tx_type})\n"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Zurück", callback_data=f"search:{page - 1}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("Weiter ▶", callback_data=f"search:{page + 1}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def list_recurring(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Zeigt erkannte wiederkehrende Zahlungen. Mit /recurring auto <nummer> wird das automatische Buchen umgeschaltet."""
+    user = update.effective_user
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
+
+        items = session.query(RecurringTransaction).filter(
+            RecurringTransaction.user_id == db_user.id,
+            RecurringTransaction.active.is_(True)
+        ).order_by(RecurringTransaction.next_date).all()
+
+        if context.args and len(context.args) == 2 and context.args[0].lower() == 'auto':
+            index = int(context.args[1]) - 1
+            if not 0 <= index < len(items):
+                await update.message.reply_text("Eintrag nicht gefunden.")
+                return
+            item = items[index]
+            item.auto_book = not item.auto_book
+            session.commit()
+            state = "wird ab jetzt automatisch gebucht" if item.auto_book else "wird nicht mehr automatisch gebucht"
+            await update.message.reply_text(f"{item.description} {state}.")
+            return
+
+        if not items:
+            await update.message.reply_text("Es wurden noch keine wiederkehrenden Zahlungen erkannt.")
+            return
+
+        message = "Wiederkehrende Zahlungen:\n\n"
+        for i, item in enumerate(items, 1):
+            message += (
+                f"{i}. {item.description} - {item.amount}{item.currency or '€'} alle {item.interval_days} Tage, "
+                f"nächste am {item.next_date.strftime('%d.%m.%Y')}{' (auto)' if item.auto_book else ''}\n"
+            )
+        message += "\nMit /recurring auto <nummer> automatisch buchen lassen."
+        await update.message.reply_text(message)
+    except ValueError:
+        await update.message.reply_text("Bitte gib eine gültige Nummer ein.")
+    except Exception as e:
+        logger.error(f"Fehler bei wiederkehrenden Zahlungen: {e}")
+        await update.message.reply_text("Es gab einen Fehler beim Laden der wiederkehrenden Zahlungen.")
+    finally:
+        session.close()
+
+async def process_recurring(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Erkennt neue wiederkehrende Zahlungen und bucht fällige Einträge mit auto_book."""
+    session = SessionLocal()
+    try:
+        detected = detect_recurring(session)
+        booked = book_due_recurring(session)
+        logger.info(f"Wiederkehrende Zahlungen: {detected} erkannt, {len(booked)} gebucht.")
+    finally:
+        session.close()
+
+    for telegram_id, description, amount, currency in booked:
+        try:
             await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=f"Ziel-Update: {goal.name} - Fortschritt: {progress:.1f}%"
+                chat_id=telegram_id,
+                text=f"Automatisch gebucht: {amount} {currency} für {description}"
             )
+        except Exception as e:
+            logger.error(f"Fehler beim Senden der Buchungsbestätigung an {telegram_id}: {e}")
 
-    session.close()
+async def recategorize_pending(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Kategorisiert im Degraded Mode gespeicherte Transaktionen nach, sobald die API wieder erreichbar ist."""
+    if llm_client.breaker.is_open:
+        return
+
+    session = SessionLocal()
+    try:
+        pending = session.query(Transaction.id, Transaction.description, User.telegram_id).join(
+            User, User.id == Transaction.user_id
+        ).filter(Transaction.category == UNCATEGORIZED).order_by(Transaction.id).limit(RECATEGORIZE_BATCH_SIZE).all()
+    finally:
+        session.close()
+    if not pending:
+        return
+
+    results = await asyncio.gather(
+        *(categorizer.categorize(description) for _, description, _ in pending), return_exceptions=True
+    )
+    updates = []
+    notices = {}
+    for (transaction_id, description, telegram_id), result in zip(pending, results):
+        if isinstance(result, Exception):
+            continue
+        category, subcategory, _, currency = result
+        updates.append({'id': transaction_id, 'category': category, 'subcategory': subcategory, 'currency': currency})
+        notices.setdefault(telegram_id, []).append(f"- {description}: {category}")
+
+    # Über das ORM, damit der Zielfortschritt (database.goals) die neue Kategorie mitbekommt
+    session = SessionLocal()
+    try:
+        values = {row['id']: row for row in updates}
+        for transaction in session.query(Transaction).filter(Transaction.id.in_(list(values))):
+            for name in ('category', 'subcategory', 'currency'):
+                setattr(transaction, name, values[transaction.id][name])
+        session.commit()
+    finally:
+        session.close()
+    logger.info(f"Nachkategorisierung: {len(updates)} von {len(pending)} Transaktionen.")
+
+    for telegram_id, lines in notices.items():
+        await send_to_user(context.bot, telegram_id, "Nachträglich kategorisiert:\n" + "\n".join(lines))
+
+async def archive_old_transactions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Verschiebt Transaktionen jenseits der Aufbewahrungsfrist ins Archiv."""
+    session = SessionLocal()
+    try:
+        archived = archive_transactions(session)
+        logger.info(f"Archiv: insgesamt {archived} Transaktionen verschoben.")
+    finally:
+        session.close()
 
 async def get_advice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Generates and sends personalized financial advice."""
@@ -559,22 +1181,21 @@ async def get_advice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             await update.message.reply_text("Please start the bot with /start first.")
             return
 
-        transactions = session.query(Transaction).filter(Transaction.user_id == db_user.id).all()
+        # Die Empfehlungen brauchen nur Summen je Kategorie und Typ (inklusive archivierter Monate)
+        totals = category_type_totals(session, db_user.id)
         budgets = session.query(Budget).filter(Budget.user_id == db_user.id).all()
         goals = session.query(Goal).filter(Goal.user_id == db_user.id).all()
 
-        if not transactions:
+        if not totals:
             await update.message.reply_text("You don't have any transactions yet. Add some transactions to get personalized advice.")
             return
 
-        # Convert SQLAlchemy objects to dictionaries
         transactions_dict = [
             {
-                'amount': t.amount,
-                'category': t.category,
-                'type': t.type,
-                'date': t.date.isoformat()
-            } for t in transactions
+                'amount': total,
+                'category': category,
+                'type': transaction_type
+            } for category, transaction_type, total in totals
         ]
         budgets_dict = [
             {
@@ -590,7 +1211,10 @@ async def get_advice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             } for g in goals
         ]
 
-        advice = get_financial_recommendations(db_user.id, transactions_dict, budgets_dict, goals_dict)
+        # Blockierender HTTP-Aufruf mit Retries: im Thread-Pool, damit andere Benutzer nicht warten
+        advice = await asyncio.get_running_loop().run_in_executor(
+            None, get_financial_recommendations, db_user.id, transactions_dict, budgets_dict, goals_dict
+        )
         
         # Split the advice into chunks if it's too long
         max_message_length = 4096  # Telegram's max message length
@@ -609,84 +1233,149 @@ async def get_advice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     finally:
         session.close()
 
-async def weekly_summary(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sendet eine wöchentliche Zusammenfassung an alle Benutzer."""
+async def weekly_summary(bot, user_ids: List[int], limiter: AsyncRateLimiter) -> None:
+    """
+    Sendet die wöchentliche Zusammenfassung an die fälligen Benutzer. Die Texte werden zuerst gesammelt
+    vorberechnet und danach im Rahmen des Rate-Limits verschickt; offene Einträge aus früheren Ticks
+    desselben Durchlaufs werden dabei mit verschickt.
+    """
     session = SessionLocal()
-    users = session.query(User).all()
+    try:
+        run_id = stage_weekly_digests(session, user_ids=user_ids)
+    finally:
+        session.close()
 
-    for user in users:
-        transactions = session.query(Transaction).filter(
-            Transaction.user_id == user.id,
-            Transaction.date >= datetime.now() - timedelta(days=7)
-        ).all()
+    sent = await send_weekly_digests(bot, run_id, limiter)
+    logger.info(f"Wochenzusammenfassungen {run_id}: {sent} verschickt.")
 
-        total_expenses = sum(t.amount for t in transactions if t.type == 'expense')
-        total_income = sum(t.amount for t in transactions if t.type == 'income')
+# Jobs mit Zustellfenster je Benutzer (siehe utils.scheduler.DELIVERY_WINDOWS)
+DELIVERY_JOBS = {
+    'budget_forecast': check_budget_progress,
+    'goal_progress': check_goal_progress,
+    'weekly_summary': weekly_summary,
+}
 
-        summary = f"Wöchentliche Zusammenfassung:\n\n"
-        summary += f"Gesamtausgaben: {total_expenses}€\n"
-        summary += f"Gesamteinnahmen: {total_income}€\n"
-        summary += f"Bilanz: {total_income - total_expenses}€\n\n"
+async def delivery_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Verarbeitet jede Minute nur die Benutzer, deren Zustelltermin gerade fällig ist."""
+    session = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        due = {job: claim_due(session, job, now) for job in DELIVERY_JOBS}
+    finally:
+        session.close()
+
+    limiter = AsyncRateLimiter()
+    jobs = [
+        DELIVERY_JOBS[job](context.bot, [user_id for user_id, _ in claimed], limiter)
+        for job, claimed in due.items() if claimed
+    ]
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Fehler bei einer geplanten Zustellung: {result}")
+
+async def backfill_delivery_schedules(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Legt beim Start die Zustelltermine für Benutzer an, die noch keine haben."""
+    session = SessionLocal()
+    try:
+        created = backfill_schedules(session)
+        logger.info(f"Zustelltermine: {created} neu angelegt.")
+    finally:
+        session.close()
 
-        top_categories = session.query(
-            Transaction.category, 
-            func.sum(Transaction.amount).label('total')
-        ).filter(
-            Transaction.user_id == user.id,
-            Transaction.type == 'expense',
-            Transaction.date >= datetime.now() - timedelta(days=7)
-        ).group_by(Transaction.category).order_by(func.sum(Transaction.amount).desc()).limit(3).all()
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Setzt die Zeitzone des Benutzers, nach der sich die Zustellzeiten richten."""
+    user = update.effective_user
+    session = SessionLocal()
+    try:
+        db_user = session.query(User).filter(User.telegram_id == user.id).first()
+        if not db_user:
+            await update.message.reply_text("Bitte starte den Bot zuerst mit /start.")
+            return
 
-        summary += "Top 3 Ausgabenkategorien:\n"
-        for category, total in top_categories:
-            summary += f"- {category}: {total}€\n"
+        if not context.args:
+            await update.message.reply_text(
+                f"Deine Zeitzone: {db_user.timezone or DEFAULT_TIMEZONE}\n"
+                "Ändern mit z. B. /timezone Europe/Vienna"
+            )
+            return
 
-        await context.bot.send_message(chat_id=user.telegram_id, text=summary)
+        name = context.args[0]
+        if not is_valid_timezone(name):
+            await update.message.reply_text("Unbekannte Zeitzone. Beispiel: /timezone Europe/Berlin")
+            return
 
-    session.close()
+        db_user.timezone = name
+        schedule_user(session, db_user.id, name)
+        session.commit()
+        await update.message.reply_text(f"Zeitzone auf {name} gesetzt.")
+    finally:
+        session.close()
 
 async def create_monthly_budgets(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Erstellt neue Budgets für den aktuellen Monat basierend auf den Budgets des Vormonats."""
-    session = SessionLocal()
-    users = session.query(User).all()
-
     current_date = datetime.now()
     current_month = current_date.month
     current_year = current_date.year
+    last_month = current_month - 1 if current_month > 1 else 12
+    last_year = current_year if current_month > 1 else current_year - 1
+
+    # Ein INSERT ... SELECT für alle aktiven Benutzer statt einer Abfrage pro Benutzer.
+    # Bereits vorhandene Budgets des aktuellen Monats werden nicht doppelt angelegt.
+    current = aliased(Budget)
+    already_created = exists().where(
+        current.user_id == Budget.user_id,
+        current.name == Budget.name,
+        current.year == current_year,
+        current.month == current_month
+    )
+    source = select(
+        Budget.user_id, Budget.name, Budget.limit, literal(current_year), literal(current_month)
+    ).where(
+        Budget.year == last_year,
+        Budget.month == last_month,
+        Budget.user_id.in_(relevant_user_ids(now=current_date)),
+        ~already_created
+    )
 
-    for user in users:
-        # Hole die Budgets des Vormonats
-        last_month = current_month - 1 if current_month > 1 else 12
-        last_year = current_year if current_month > 1 else current_year - 1
-        
-        last_month_budgets = session.query(Budget).filter(
-            Budget.user_id == user.id,
-            Budget.year == last_year,
-            Budget.month == last_month
-        ).all()
+    session = SessionLocal()
+    try:
+        created = session.execute(
+            insert(Budget).from_select(['user_id', 'name', 'limit', 'year', 'month'], source)
+        ).rowcount
+        session.commit()
+        logger.info(f"Monatliche Budgets: {created} für {current_month}/{current_year} erstellt.")
+    except Exception as e:
+        session.rollback()
+        # Wie früher je Benutzer nachvollziehbar machen, für wen keine Budgets angelegt wurden
+        try:
+            affected = [user_id for (user_id,) in session.execute(
+                source.with_only_columns(Budget.user_id).distinct().order_by(Budget.user_id)
+            )]
+        except Exception:
+            affected = "unbekannt"
+        logger.error(f"Fehler beim Erstellen der monatlichen Budgets für Benutzer {affected}: {e}")
+        return
+    finally:
+        session.close()
 
-        # Erstelle neue Budgets für den aktuellen Monat
-        for budget in last_month_budgets:
-            new_budget = Budget(
-                user_id=user.id,
-                name=budget.name,
-                limit=budget.limit,
-                year=current_year,
-                month=current_month
-            )
-            session.add(new_budget)
+    limiter = AsyncRateLimiter()
+    text = f"Neue Budgets für {calendar.month_name[current_month]} {current_year} wurden erstellt."
 
+    async def run_shard(shard: int, shards: int) -> None:
+        session = SessionLocal()
         try:
-            session.commit()
-            await context.bot.send_message(
-                chat_id=user.telegram_id,
-                text=f"Neue Budgets für {calendar.month_name[current_month]} {current_year} wurden erstellt."
+            users = session.query(User.id, User.telegram_id).filter(
+                *relevant_user_criteria(now=current_date, shard=shard, shards=shards),
+                User.budgets.any((Budget.year == current_year) & (Budget.month == current_month))
             )
-        except Exception as e:
-            logger.error(f"Fehler beim Erstellen der monatlichen Budgets für Benutzer {user.id}: {e}")
-            session.rollback()
+            for page in iter_pages(users, User.id):
+                for _, telegram_id in page:
+                    await send_to_user(context.bot, telegram_id, text, limiter)
+        finally:
+            session.close()
 
-    session.close()
+    await run_sharded(run_shard)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles errors and logs them."""
@@ -710,14 +1399,13 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 # ----- Main-Funktion -----
 
-def main() -> None:
-    """Starts the Telegram bot."""
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        logger.error("No TELEGRAM_BOT_TOKEN found in environment variables.")
-        return
+def register_handlers(application: Application) -> None:
+    """Registriert alle Command-, Conversation- und Error-Handler."""
+    # Gespräche werden nur persistiert, wenn die Application einen Persistenz-Backend hat
+    persistent = application.persistence is not None
 
-    application = Application.builder().token(token).build()
+    # Aktivität vor allen anderen Handlern erfassen (für die Auswahl der Empfänger in den Jobs)
+    application.add_handler(TypeHandler(Update, track_activity), group=-1)
 
     # Command handlers
     application.add_handler(CommandHandler("start", start))
@@ -726,10 +1414,19 @@ def main() -> None:
     application.add_handler(CommandHandler("viewgoals", view_goals))
     application.add_handler(CommandHandler("report", generate_report))
     application.add_handler(CommandHandler("advice", get_advice))
+    application.add_handler(CommandHandler("trends", trends))
+    application.add_handler(CommandHandler("compare", compare))
+    application.add_handler(CommandHandler("recurring", list_recurring))
+    application.add_handler(CommandHandler("timezone", set_timezone))
+    application.add_handler(CommandHandler("household", household))
+    application.add_handler(CommandHandler("search", search))
+    application.add_handler(CallbackQueryHandler(search_page, pattern=r'^search:\d+$'))
     application.add_handler(CommandHandler("list", list_transactions))
+    application.add_handler(CommandHandler("export", export_transactions))
     application.add_handler(CommandHandler("delete", delete_transaction))
     application.add_handler(CommandHandler("mergecategories", merge_categories))
     application.add_handler(CommandHandler("debug_api", debug_api_response))
+    application.add_handler(InlineQueryHandler(inline_balance))
 
     # Conversation handlers
     application.add_handler(ConversationHandler(
@@ -737,7 +1434,9 @@ def main() -> None:
         states={
             ADD_TRANSACTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_transaction_end)]
         },
-        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')]
+        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')],
+        name='add_transaction',
+        persistent=persistent
     ))
 
     application.add_handler(ConversationHandler(
@@ -745,7 +1444,9 @@ def main() -> None:
         states={
             SET_BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_budget_end)]
         },
-        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')]
+        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')],
+        name='set_budget',
+        persistent=persistent
     ))
 
     application.add_handler(ConversationHandler(
@@ -753,18 +1454,77 @@ def main() -> None:
         states={
             SET_GOAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_goal_end)]
         },
-        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')]
+        fallbacks=[CallbackQueryHandler(cancel, pattern='^cancel$')],
+        name='set_goal',
+        persistent=persistent
     ))
 
     # Error handler
     application.add_error_handler(error_handler)
 
+    # Abfragen je Handler-Aufruf protokollieren (nur mit PROFILE_QUERIES=1)
+    profile_handlers(application)
+
+def schedule_jobs(application: Application) -> None:
+    """Plant die wiederkehrenden Jobs ein. Jeder Lauf wird per Lease auf genau einem Knoten ausgeführt."""
+    def job(callback, **kwargs):
+        return profiled(leader_only(callback, **kwargs))
+
+    schedule_budget_check_job(application, wrap=job)
+    # Prognosen, Ziel-Updates und Wochenzusammenfassungen werden je Benutzer in dessen Zeitzone verteilt
+    application.job_queue.run_once(job(backfill_delivery_schedules), when=10)
+    application.job_queue.run_repeating(job(delivery_tick, ttl=timedelta(minutes=2)), interval=60, first=30)
+    application.job_queue.run_monthly(job(create_monthly_budgets), when=time(hour=0, minute=1), day=1)
+    application.job_queue.run_monthly(job(archive_old_transactions, ttl=timedelta(hours=6)), when=time(hour=3, minute=0), day=2)
+    application.job_queue.run_daily(job(process_recurring), time=time(hour=6, minute=0, tzinfo=pytz.timezone('Europe/Berlin')))
+
+async def prewarm_imports(application: Application) -> None:
+    """Lädt selten benötigte, schwere Module nach dem Start in einem Hintergrund-Thread vor."""
+    if os.getenv("PREWARM_IMPORTS", "1") == "0":
+        return
+
+    def _load() -> None:
+        # matplotlib wird nicht vorgewärmt: es wird nur für /report matplotlib gebraucht
+        import requests  # noqa: F401
+
+    threading.Thread(target=_load, name="prewarm-imports", daemon=True).start()
+
+def build_application(token: str) -> Application:
+    """Erstellt die Application. Gesprächszustände und user_data liegen in einer gemeinsamen SQLite-Datei."""
+    persistence = SQLitePersistence(filepath=os.getenv("BOT_STATE_DB", "bot_state.db"))
+    application = Application.builder().token(token).persistence(persistence).post_init(prewarm_imports).build()
+    setup_profiling()
+    register_handlers(application)
+    return application
+
+def main() -> None:
+    """Starts the Telegram bot."""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("No TELEGRAM_BOT_TOKEN found in environment variables.")
+        return
+
+    if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if not webhook_url:
+            logger.error("BOT_MODE=webhook requires WEBHOOK_URL.")
+            return
+        run_webhook_cluster(
+            token,
+            build_application,
+            schedule_jobs,
+            webhook_url=webhook_url,
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            secret=os.getenv("WEBHOOK_SECRET"),
+            workers=int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+        )
+        return
+
+    application = build_application(token)
+
     # Scheduled jobs
-    schedule_budget_check_job(application)
-    application.job_queue.run_daily(check_budget_progress, time=time(hour=20, minute=0))
-    application.job_queue.run_repeating(check_goal_progress, interval=timedelta(weeks=1), first=time(hour=10, minute=0, tzinfo=pytz.timezone('Europe/Berlin')))
-    application.job_queue.run_repeating(weekly_summary, interval=timedelta(weeks=1), first=time(hour=9, minute=0, tzinfo=pytz.timezone('Europe/Berlin')))
-    application.job_queue.run_monthly(create_monthly_budgets, when=time(hour=0, minute=1), day=1)
+    schedule_jobs(application)
 
     # Start the Bot
     application.run_polling()
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("sqlalchemy")
+
+from telegram.ext import Application, CommandHandler, TypeHandler
+
+import telegram_budget_app
+
+def test_register_handlers_on_bare_application():
+    application = Application.builder().token("123456:TEST").build()
+    telegram_budget_app.register_handlers(application)
+
+    commands = {
+        command
+        for handler in application.handlers[0] if isinstance(handler, CommandHandler)
+        for command in handler.commands
+    }
+    assert {"start", "help", "report", "household", "timezone"} <= commands
+    assert any(isinstance(handler, TypeHandler) for handler in application.handlers[-1])
+    assert application.error_handlers
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("sqlalchemy")
+
+from benchmarks.startup import LAZY_MODULES, ROOT, measure_import
+
+# Wie `python benchmarks/startup.py --budget-ms 800`; auf langsamen CI-Maschinen per Umgebung anpassbar
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "800"))
+
+def test_heavy_modules_are_not_imported_at_startup():
+    # Frischer Interpreter, damit Importe anderer Tests nicht mitzählen
+    script = (
+        "import sys, telegram_budget_app\n"
+        f"print(' '.join(sorted(name for name in {LAZY_MODULES!r} if name in sys.modules)))"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
+
+def test_import_time_within_budget():
+    measure_import()  # wärmt Bytecode- und Dateisystem-Caches auf
+    total_ms = min(measure_import()[0] for _ in range(3))
+    assert total_ms <= STARTUP_BUDGET_MS, f"Importzeit {total_ms:.1f} ms, Budget {STARTUP_BUDGET_MS:.0f} ms"
@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, cast, func
+
+from database.models import Transaction
+from utils.archive import archived_month_rows
+
+@dataclass
+class TransactionFrame:
+    """
+    Spaltenweise Sicht auf die Transaktionen eines Benutzers.
+    Kategorien sind dictionary-kodiert: `category` enthält Indizes in `categories`.
+    """
+    amount: np.ndarray      # float64
+    day: np.ndarray         # datetime64[D]
+    month: np.ndarray       # int32, Monate seit 01.1970
+    category: np.ndarray    # int32
+    is_expense: np.ndarray  # bool
+    categories: np.ndarray  # Kategorienamen
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    def mask(self, transaction_type: str = 'expense') -> np.ndarray:
+        return self.is_expense if transaction_type == 'expense' else ~self.is_expense
+
+# Julianisches Datum des 01.01.1970 00:00
+_UNIX_EPOCH_JULIAN = 2440587.5
+_UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def epoch_day(column):
+    """SQL-Ausdruck: Tage seit dem 01.01.1970. SQLite liefert damit fertige Integer statt datetime-Objekten."""
+    return cast(func.julianday(func.date(column)) - _UNIX_EPOCH_JULIAN, Integer)
+
+def day_number(value: datetime) -> int:
+    """Tage seit dem 01.01.1970, wie `epoch_day` in SQL."""
+    return value.toordinal() - _UNIX_EPOCH_ORDINAL
+
+def frame_from_rows(rows: Sequence[Tuple[float, int, str, str]]) -> TransactionFrame:
+    """
+    Baut einen TransactionFrame aus (amount, day, category, type)-Tupeln; `day` zählt die Tage seit dem
+    01.01.1970 (siehe `epoch_day`). Die elementweise Umwandlung von datetime-Objekten in datetime64 kostete
+    ein Vielfaches der eigentlichen Auswertung.
+    """
+    rows = [row for row in rows if row[1] is not None]
+    if not rows:
+        return TransactionFrame(
+            amount=np.zeros(0), day=np.zeros(0, dtype='datetime64[D]'), month=np.zeros(0, dtype=np.int32),
+            category=np.zeros(0, dtype=np.int32), is_expense=np.zeros(0, dtype=bool), categories=np.array([], dtype=str)
+        )
+
+    amounts, days, categories, types = zip(*rows)
+    day = np.fromiter(days, dtype=np.int64, count=len(rows)).astype('datetime64[D]')
+    # Kategorien per Dict kodieren (np.unique sortiert alle Strings) und die Codes danach alphabetisch ordnen
+    index = {}
+    codes = np.fromiter((index.setdefault(c or 'unknown', len(index)) for c in categories), dtype=np.int32, count=len(rows))
+    names = np.array(list(index))
+    order = np.argsort(names)
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return TransactionFrame(
+        amount=np.fromiter((a or 0.0 for a in amounts), dtype=np.float64, count=len(rows)),
+        day=day,
+        month=day.astype('datetime64[M]').astype(np.int32),
+        category=rank[codes],
+        is_expense=np.fromiter((t == 'expense' for t in types), dtype=bool, count=len(rows)),
+        categories=names[order]
+    )
+
+def load_user_history(session, user_id: int, since: Optional[datetime] = None) -> TransactionFrame:
+    """
+    Lädt die Transaktionen eines Benutzers als Spalten, ohne ORM-Objekte zu erzeugen.
+    Archivierte Monate gehen als eine Zeile je (Monat, Kategorie, Typ) ein; alle Auswertungen hier
+    arbeiten auf Monatsebene und bleiben damit exakt.
+    """
+    query = session.query(Transaction.amount, epoch_day(Transaction.date), Transaction.category, Transaction.type).filter(
+        Transaction.user_id == user_id
+    )
+    if since is not None:
+        query = query.filter(Transaction.date >= since)
+    archived = [
+        (amount, day_number(month_start), category, kind)
+        for amount, month_start, category, kind in archived_month_rows(session, user_id, since)
+    ]
+    return frame_from_rows(query.all() + archived)
+
+def month_index(year: int, month: int) -> int:
+    return (year - 1970) * 12 + month - 1
+
+def month_label(index: int) -> str:
+    return f"{index % 12 + 1:02d}.{1970 + index // 12}"
+
+# ----- Aggregationen -----
+
+def category_totals(frame: TransactionFrame, transaction_type: str = 'expense', month: Optional[int] = None) -> np.ndarray:
+    """Summe je Kategorie (Index wie `frame.categories`)."""
+    mask = frame.mask(transaction_type)
+    if month is not None:
+        mask = mask & (frame.month == month)
+    return np.bincount(frame.category[mask], weights=frame.amount[mask], minlength=len(frame.categories))
+
+def top_categories(frame: TransactionFrame, transaction_type: str = 'expense', limit: int = 5, month: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Die `limit` größten Kategorien als (Name, Summe), absteigend sortiert."""
+    totals = category_totals(frame, transaction_type, month)
+    if limit < len(totals):
+        candidates = np.argpartition(totals, -limit)[-limit:]
+    else:
+        candidates = np.arange(len(totals))
+    order = candidates[np.argsort(totals[candidates])[::-1]]
+    return [(str(frame.categories[i]), float(totals[i])) for i in order if totals[i] > 0]
+
+def category_shares(frame: TransactionFrame, transaction_type: str = 'expense', month: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Anteil jeder Kategorie an der Gesamtsumme (0..1), absteigend sortiert."""
+    totals = category_totals(frame, transaction_type, month)
+    grand_total = totals.sum()
+    if grand_total <= 0:
+        return []
+    order = np.argsort(totals)[::-1]
+    return [(str(frame.categories[i]), float(totals[i] / grand_total)) for i in order if totals[i] > 0]
+
+def monthly_totals(frame: TransactionFrame, transaction_type: str = 'expense', first_month: Optional[int] = None,
+                   last_month: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Summen je Monat als (Monatsindizes, Summen); Monate ohne Buchungen sind 0."""
+    mask = frame.mask(transaction_type)
+    months = frame.month[mask]
+    if first_month is None:
+        first_month = int(months.min()) if len(months) else month_index(datetime.now().year, datetime.now().month)
+    if last_month is None:
+        last_month = int(months.max()) if len(months) else first_month
+    in_range = (months >= first_month) & (months <= last_month)
+    totals = np.bincount(months[in_range] - first_month, weights=frame.amount[mask][in_range],
+                         minlength=last_month - first_month + 1)
+    return np.arange(first_month, last_month + 1), totals
+
+def rolling_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Gleitender Durchschnitt; die ersten Werte mitteln über die verfügbaren Monate."""
+    cumulative = np.cumsum(np.insert(values.astype(np.float64), 0, 0.0))
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return (cumulative[1:] - cumulative[np.arange(len(values)) + 1 - counts]) / counts
+
+def month_over_month(frame: TransactionFrame, transaction_type: str = 'expense', months: int = 6,
+                     window: int = 3) -> List[Tuple[str, float, float, float]]:
+    """Die letzten `months` Monate als (Monat, Summe, Veränderung zum Vormonat, gleitender Durchschnitt)."""
+    now = datetime.now()
+    last = month_index(now.year, now.month)
+    # Zusätzliche Monate vorab, damit Veränderung und Durchschnitt auch für den ersten angezeigten Monat stimmen
+    history = max(window - 1, 1)
+    index, totals = monthly_totals(frame, transaction_type, first_month=last - months + 1 - history, last_month=last)
+    deltas = np.diff(totals, prepend=totals[0])
+    averages = rolling_average(totals, window)
+    return [
+        (month_label(int(m)), float(t), float(d), float(a))
+        for m, t, d, a in zip(index[-months:], totals[-months:], deltas[-months:], averages[-months:])
+    ]
+
+def compare_months(frame: TransactionFrame, month_a: int, month_b: int,
+                   transaction_type: str = 'expense') -> List[Tuple[str, float, float, float]]:
+    """Vergleicht zwei Monate je Kategorie als (Kategorie, Summe A, Summe B, Differenz B - A), nach |Differenz| sortiert."""
+    mask = frame.mask(transaction_type) & ((frame.month == month_a) | (frame.month == month_b))
+    period = (frame.month[mask] == month_b).astype(np.int32)
+    totals = np.bincount(frame.category[mask] * 2 + period, weights=frame.amount[mask],
+                         minlength=len(frame.categories) * 2).reshape(-1, 2)
+    deltas = totals[:, 1] - totals[:, 0]
+    order = np.argsort(np.abs(deltas))[::-1]
+    return [
+        (str(frame.categories[i]), float(totals[i, 0]), float(totals[i, 1]), float(deltas[i]))
+        for i in order if totals[i].any()
+    ]
@@ -1,126 +1,282 @@
+import asyncio
 import os
-import requests
-from dotenv import load_dotenv
 import logging
 import json
+import random
 import re
-from typing import List, Dict, Any
+import threading
+import time
+from typing import List, Dict, Any, Optional
 from telegram import Update
 from telegram.ext import ContextTypes
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
+API_URL = "https://api.perplexity.ai/chat/completions"
+MODEL = "llama-3.1-sonar-small-128k-online"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "15"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+# Kategorie für Buchungen, die ohne API gespeichert und später nachkategorisiert werden
+UNCATEGORIZED = 'uncategorized'
+
+def _api_key() -> str:
+    """Liest den API-Key erst bei Bedarf statt beim Import."""
+    return os.getenv("PERPLEXITY_API_KEY")
 
 class APIError(Exception):
     """Custom exception for API-related errors."""
     pass
 
-def categorize_transaction(text: str) -> tuple:
+class ParseError(APIError):
+    """The API answered, but the response could not be parsed."""
+    pass
+
+class CircuitOpenError(APIError):
+    """The API failed repeatedly; requests are rejected without calling it until the breaker resets."""
+    pass
+
+class CircuitBreaker:
     """
-    Uses the Perplexity API to categorize a transaction and extract the amount.
+    Öffnet nach `failure_threshold` aufeinanderfolgenden Ausfällen und lässt erst nach `reset_timeout`
+    Sekunden wieder eine einzelne Probeanfrage durch (half-open).
     """
-    url = "https://api.perplexity.ai/chat/completions"
-    
-    prompt = f"""
-    Analyze the following transaction and provide:
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing: Optional[int] = None  # Thread, der gerade die Probeanfrage sendet
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing is not None or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = threading.get_ident()
+            return True
+
+    def release_probe(self) -> None:
+        """Gibt die Probe des aufrufenden Threads frei, falls sie ohne Erfolg oder Ausfall geendet hat."""
+        with self._lock:
+            if self._probing == threading.get_ident():
+                self._probing = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = None
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"LLM API: circuit opened after {self._failures} failures.")
+                self._opened_at = time.monotonic()
+
+class LLMClient:
+    """Gemeinsamer Zugang zur Chat-API mit Timeout, Retries mit Jitter und Circuit Breaker."""
+
+    def __init__(self, url: str = API_URL, model: str = MODEL, timeout: float = LLM_TIMEOUT,
+                 retries: int = LLM_RETRIES, breaker: Optional[CircuitBreaker] = None):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+
+    def complete(self, messages: List[Dict[str, str]], temperature: float = 0.1,
+                 max_tokens: Optional[int] = None) -> str:
+        """Sendet eine Chat-Anfrage und gibt den Antworttext zurück."""
+        if not self.breaker.allow():
+            raise CircuitOpenError("The categorization service is temporarily unavailable.")
+        try:
+            return self._request(messages, temperature, max_tokens)
+        finally:
+            # Sonst bliebe der Breaker nach einer unerwarteten Ausnahme in der Probe dauerhaft offen
+            self.breaker.release_probe()
+
+    def _request(self, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int]) -> str:
+        import requests  # lazy: wird beim Start des Bots nicht benötigt
+
+        payload = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        headers = {
+            "Authorization": f"Bearer {_api_key()}",
+            "Content-Type": "application/json"
+        }
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = requests.post(self.url, json=payload, headers=headers, timeout=self.timeout)
+                # Nur Überlastung (429) und Serverfehler sind vorübergehend und werden wiederholt; bleiben sie
+                # nach allen Versuchen bestehen, zählen sie als Ausfall. Andere 4xx-Fehler werden nicht wiederholt.
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    content = response.json()['choices'][0]['message']['content']
+                    self.breaker.record_success()
+                    logger.debug(f"API response content: {content}")
+                    return content
+                error = requests.HTTPError(f"HTTP {response.status_code}", response=response)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in (401, 403):
+                    # Ungültiger oder gesperrter API-Key: jede weitere Anfrage scheitert genauso
+                    self.breaker.record_failure()
+                    logger.error(f"API request not authorized: {e}")
+                    raise APIError("The categorization service is not available. Please try again later.")
+                # Die API ist erreichbar, die Anfrage selbst ist fehlerhaft
+                self.breaker.record_success()
+                logger.error(f"API request rejected: {e}")
+                raise APIError("The API rejected the request. Please try again later.")
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+            except (requests.JSONDecodeError, KeyError, IndexError) as e:
+                self.breaker.record_success()
+                raise ParseError(f"Unexpected API response: {e}")
+            except requests.RequestException as e:
+                # Übrige Fehler (TooManyRedirects, ChunkedEncodingError, InvalidURL, ...) werden nicht wiederholt.
+                # InvalidURL ist zugleich ein ValueError und darf daher nicht als ParseError enden.
+                self.breaker.record_failure()
+                logger.error(f"API request failed: {e}")
+                raise APIError("Failed to connect to the categorization service. Please try again later.")
+
+            if attempt < self.retries:
+                # Exponentielles Backoff mit vollem Jitter
+                delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+                logger.warning(f"API request failed ({error}), retrying in {delay:.2f}s.")
+                time.sleep(delay)
+
+        self.breaker.record_failure()
+        logger.error(f"API request failed: {error}")
+        raise APIError("Failed to connect to the categorization service. Please try again later.")
+
+llm_client = LLMClient()
+
+# ----- Kategorisierung -----
+
+_CATEGORIZATION_FIELDS = """
     1. A general category (e.g., 'groceries', 'utilities', 'entertainment')
     2. A specific subcategory if applicable
     3. The amount spent
     4. The currency used
-
-    Transaction: {text}
-
-    Respond in JSON format:
-    {{
+"""
+_CATEGORIZATION_OBJECT = """{
         "category": "general_category",
         "subcategory": "specific_subcategory",
         "amount": float_value,
         "currency": "currency_code"
-    }}
-    """
+    }"""
+
+def build_categorization_messages(texts: List[str]) -> List[Dict[str, str]]:
+    """Prompt für eine oder mehrere Transaktionen; bei mehreren wird ein JSON-Array in derselben Reihenfolge verlangt."""
+    if len(texts) == 1:
+        prompt = (
+            f"\n    Analyze the following transaction and provide:{_CATEGORIZATION_FIELDS}"
+            f"\n    Transaction: {texts[0]}\n\n    Respond in JSON format:\n    {_CATEGORIZATION_OBJECT}\n"
+        )
+    else:
+        numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(texts, 1))
+        prompt = (
+            f"\n    Analyze each of the following {len(texts)} transactions and provide for each:{_CATEGORIZATION_FIELDS}"
+            f"\n    Transactions:\n    {numbered}\n\n"
+            f"    Respond with a JSON array containing exactly {len(texts)} objects in the same order:\n"
+            f"    [\n    {_CATEGORIZATION_OBJECT}\n    ]\n"
+        )
+    return [
+        {"role": "system", "content": "You are a financial categorization assistant."},
+        {"role": "user", "content": prompt}
+    ]
 
-    payload = {
-        "model": "llama-3.1-sonar-small-128k-online",
-        "messages": [
-            {"role": "system", "content": "You are a financial categorization assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.1
-    }
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def _strip_markdown(content: str) -> str:
+    # Entferne mögliche Markdown-Formatierung
+    return re.sub(r'```json\n|\n```', '', content)
 
+def parse_categorization(content: str) -> tuple:
+    """Liest (category, subcategory, amount, currency) aus einer Einzelantwort, notfalls per Regex."""
+    content = _strip_markdown(content)
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        content = result['choices'][0]['message']['content']
-        
-        logger.debug(f"API response content: {content}")
-        
-        # Entferne mögliche Markdown-Formatierung
-        content = re.sub(r'```json\n|\n```', '', content)
-        
-        # Try to parse the response as JSON
-        try:
-            parsed_content = json.loads(content)
-            category = parsed_content['category']
-            subcategory = parsed_content.get('subcategory', '')
-            amount = float(parsed_content['amount'])
-            currency = parsed_content['currency']
-        except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract information using regex
-            category_match = re.search(r'"category":\s*"(.+?)"', content)
-            subcategory_match = re.search(r'"subcategory":\s*"(.+?)"', content)
-            amount_match = re.search(r'"amount":\s*([\d.]+)', content)
-            currency_match = re.search(r'"currency":\s*"(\w+)"', content)
-            
-            if category_match and amount_match:
-                category = category_match.group(1)
-                subcategory = subcategory_match.group(1) if subcategory_match else ''
-                amount = float(amount_match.group(1))
-                currency = currency_match.group(1) if currency_match else 'EUR'
-            else:
-                raise ValueError(f"Could not extract required information from API response: {content}")
-
-        return category, subcategory, amount, currency
-
-    except requests.RequestException as e:
-        logger.error(f"API request failed: {e}")
-        raise APIError("Failed to connect to the categorization service. Please try again later.")
-    except Exception as e:
-        logger.error(f"Unexpected error in categorize_transaction: {e}")
-        raise APIError(f"An unexpected error occurred: {str(e)}. Please try again later.")
+        parsed_content = json.loads(content)
+        return (
+            parsed_content['category'],
+            parsed_content.get('subcategory', ''),
+            float(parsed_content['amount']),
+            parsed_content['currency']
+        )
+    except (ValueError, KeyError, TypeError):
+        # If JSON parsing fails, try to extract information using regex
+        category_match = re.search(r'"category":\s*"(.+?)"', content)
+        subcategory_match = re.search(r'"subcategory":\s*"(.+?)"', content)
+        amount_match = re.search(r'"amount":\s*([\d.]+)', content)
+        currency_match = re.search(r'"currency":\s*"(\w+)"', content)
+
+        if category_match and amount_match:
+            return (
+                category_match.group(1),
+                subcategory_match.group(1) if subcategory_match else '',
+                float(amount_match.group(1)),
+                currency_match.group(1) if currency_match else 'EUR'
+            )
+        raise ParseError(f"Could not extract required information from API response: {content}")
+
+def parse_categorizations(content: str, count: int) -> List[tuple]:
+    """Liest ein JSON-Array mit genau `count` Ergebnissen."""
+    content = _strip_markdown(content)
+    try:
+        parsed_content = json.loads(content)
+        if not isinstance(parsed_content, list) or len(parsed_content) != count:
+            raise ValueError(f"Expected {count} results, got: {content}")
+        return [
+            (
+                item['category'],
+                item.get('subcategory', ''),
+                float(item['amount']),
+                item.get('currency') or 'EUR'
+            )
+            for item in parsed_content
+        ]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Could not parse batch response: {e}")
+        raise ParseError("The categorization service returned an unexpected response.")
+
+def categorize_transaction(text: str) -> tuple:
+    """
+    Uses the Perplexity API to categorize a transaction and extract the amount.
+    """
+    return parse_categorization(llm_client.complete(build_categorization_messages([text])))
+
+def categorize_transactions(texts: List[str]) -> List[tuple]:
+    """
+    Categorizes several transactions with a single Perplexity API request.
+    Returns one (category, subcategory, amount, currency) tuple per input line, in the same order.
+    """
+    return parse_categorizations(llm_client.complete(build_categorization_messages(texts)), len(texts))
+
+# ----- Empfehlungen -----
 
 def get_financial_recommendations(user_id: int, transactions: List[Dict[str, Any]], budgets: List[Dict[str, Any]], goals: List[Dict[str, Any]]) -> str:
     """Generates financial recommendations based on user data."""
     context = create_financial_context(transactions, budgets, goals)
-    
-    url = "https://api.perplexity.ai/chat/completions"
-    payload = {
-        "model": "llama-3.1-sonar-small-128k-online",
-        "messages": [
-            {"role": "system", "content": "You are a financial advisor. Provide personalized advice based on the user's financial data."},
-            {"role": "user", "content": f"Based on this financial data, provide 3 specific recommendations:\n\n{context}"}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 500
-    }
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
-        response.raise_for_status()
-        result = response.json()
-        return result['choices'][0]['message']['content']
-    except requests.RequestException as e:
+        return llm_client.complete(
+            [
+                {"role": "system", "content": "You are a financial advisor. Provide personalized advice based on the user's financial data."},
+                {"role": "user", "content": f"Based on this financial data, provide 3 specific recommendations:\n\n{context}"}
+            ],
+            temperature=0.7,
+            max_tokens=500
+        )
+    except APIError as e:
         logger.error(f"Failed to get recommendations: {e}")
         raise APIError("Failed to generate recommendations. Please try again later.")
 
@@ -165,45 +321,9 @@ def get_top_categories(transactions: List[Dict[str, Any]], transaction_type: str
 
 async def debug_api_response(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Debug function to check raw API response."""
-    user_input = "Test transaction 50€ for groceries"
-    url = "https://api.perplexity.ai/chat/completions"
-    
-    prompt = f"""
-    Analyze the following transaction and provide:
-    1. A general category (e.g., 'groceries', 'utilities', 'entertainment')
-    2. A specific subcategory if applicable
-    3. The amount spent
-    4. The currency used
-
-    Transaction: {user_input}
-
-    Respond in JSON format:
-    {{
-        "category": "general_category",
-        "subcategory": "specific_subcategory",
-        "amount": float_value,
-        "currency": "currency_code"
-    }}
-    """
-
-    payload = {
-        "model": "llama-3.1-sonar-small-128k-online",
-        "messages": [
-            {"role": "system", "content": "You are a financial categorization assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.1
-    }
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
+    messages = build_categorization_messages(["Test transaction 50€ for groceries"])
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        content = result['choices'][0]['message']['content']
+        content = await asyncio.get_running_loop().run_in_executor(None, llm_client.complete, messages)
         await update.message.reply_text(f"Raw API response:\n\n{content}")
     except Exception as e:
         await update.message.reply_text(f"Error: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,198 @@
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.models import MonthlyAggregate, Transaction
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Transaktionen, die älter als so viele volle Monate sind, wandern ins Archiv
+RETENTION_MONTHS = int(os.getenv("RETENTION_MONTHS", "24"))
+# Kategorien ohne Namen, damit der Unique-Constraint der Monatssummen greift (NULL ist in SQLite nie gleich)
+UNKNOWN_CATEGORY = 'unknown'
+STREAM_BATCH_SIZE = 5000
+
+ArchivedTransaction = namedtuple(
+    'ArchivedTransaction', 'id amount description date category subcategory currency type recurring_id'
+)
+
+# Je Jahr eine Datei; je (Benutzer, Monat) ein zlib-komprimierter JSON-Block
+_PARTITION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    user_id INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (user_id, month)
+)
+"""
+_FILE_PATTERN = re.compile(r'transactions_(\d{4})\.sqlite$')
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Erster Tag des ältesten Monats, der noch in der Haupttabelle bleibt."""
+    now = now or datetime.now()
+    months = now.year * 12 + now.month - 1 - RETENTION_MONTHS
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def archive_path(year: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"transactions_{year}.sqlite")
+
+def _connect(year: int) -> sqlite3.Connection:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    connection = sqlite3.connect(archive_path(year))
+    connection.execute(_PARTITION_SCHEMA)
+    return connection
+
+def _pack(rows: List[ArchivedTransaction]) -> bytes:
+    data = [[*row[:3], row.date.isoformat() if row.date else None, *row[4:]] for row in rows]
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 9)
+
+def _unpack(payload: bytes) -> List[ArchivedTransaction]:
+    return [
+        ArchivedTransaction(*row[:3], datetime.fromisoformat(row[3]) if row[3] else None, *row[4:])
+        for row in json.loads(zlib.decompress(payload))
+    ]
+
+def _write_partitions(year: int, partitions: Dict[Tuple[int, int], List[ArchivedTransaction]]) -> None:
+    """Schreibt die Blöcke eines Jahres; vorhandene Blöcke werden zusammengeführt (doppelte IDs zählen einmal)."""
+    connection = _connect(year)
+    try:
+        with connection:
+            for (user_id, month), rows in partitions.items():
+                existing = connection.execute(
+                    "SELECT payload FROM partitions WHERE user_id = ? AND month = ?", (user_id, month)
+                ).fetchone()
+                merged = {row.id: row for row in (_unpack(existing[0]) if existing else [])}
+                merged.update((row.id, row) for row in rows)
+                ordered = sorted(merged.values(), key=lambda row: (row.date or datetime.min, row.id))
+                connection.execute(
+                    "INSERT OR REPLACE INTO partitions (user_id, month, row_count, payload) VALUES (?, ?, ?, ?)",
+                    (user_id, month, len(ordered), _pack(ordered))
+                )
+    finally:
+        connection.close()
+
+def archive_transactions(session, now: Optional[datetime] = None) -> int:
+    """
+    Verschiebt alle Transaktionen vor dem Stichtag monatsweise ins Archiv. Je Monat werden zuerst die
+    Archivblöcke geschrieben und danach in einer Transaktion die Monatssummen fortgeschrieben und die
+    Zeilen aus der Haupttabelle gelöscht. Ein abgebrochener Lauf kann gefahrlos wiederholt werden.
+    Gibt die Anzahl archivierter Transaktionen zurück.
+    """
+    cutoff = archive_cutoff(now)
+    month_key = func.strftime('%Y-%m', Transaction.date)
+    months = [
+        key for (key,) in session.query(month_key).filter(
+            Transaction.date.isnot(None), Transaction.date < cutoff
+        ).group_by(month_key).order_by(month_key)
+    ]
+
+    archived = 0
+    for key in months:
+        year, month = (int(part) for part in key.split('-'))
+        start = datetime(year, month, 1)
+        end = datetime(year + month // 12, month % 12 + 1, 1)
+        in_month = (Transaction.date >= start, Transaction.date < end)
+
+        # Blöcke werden an Benutzergrenzen geschrieben, damit nie ein ganzer Monat im Speicher liegt
+        partitions: Dict[Tuple[int, int], List[ArchivedTransaction]] = {}
+        buffered = 0
+        for row in session.query(
+            Transaction.user_id, *(getattr(Transaction, name) for name in ArchivedTransaction._fields)
+        ).filter(*in_month).order_by(Transaction.user_id).yield_per(STREAM_BATCH_SIZE):
+            if buffered >= STREAM_BATCH_SIZE and (row[0], month) not in partitions:
+                _write_partitions(year, partitions)
+                partitions, buffered = {}, 0
+            partitions.setdefault((row[0], month), []).append(ArchivedTransaction(*row[1:]))
+            buffered += 1
+        if partitions:
+            _write_partitions(year, partitions)
+
+        category = func.coalesce(Transaction.category, UNKNOWN_CATEGORY)
+        for user_id, category_name, transaction_type, total, count in session.query(
+            Transaction.user_id, category, Transaction.type, func.sum(Transaction.amount), func.count(Transaction.id)
+        ).filter(*in_month).group_by(Transaction.user_id, category, Transaction.type):
+            stmt = sqlite_insert(MonthlyAggregate).values(
+                user_id=user_id, year=year, month=month, category=category_name, type=transaction_type,
+                total=total or 0.0, count=count
+            )
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=[MonthlyAggregate.user_id, MonthlyAggregate.year, MonthlyAggregate.month,
+                                MonthlyAggregate.category, MonthlyAggregate.type],
+                set_={'total': MonthlyAggregate.total + stmt.excluded.total,
+                      'count': MonthlyAggregate.count + stmt.excluded.count}
+            ))
+        count = session.query(Transaction).filter(*in_month).delete(synchronize_session=False)
+        session.commit()
+        archived += count
+        logger.info(f"Archiv: {count} Transaktionen aus {key} verschoben.")
+    return archived
+
+def archive_years() -> List[int]:
+    years = []
+    for path in glob.glob(os.path.join(ARCHIVE_DIR, 'transactions_*.sqlite')):
+        match = _FILE_PATTERN.search(path)
+        if match:
+            years.append(int(match.group(1)))
+    return sorted(years)
+
+def load_archived_transactions(user_id: int, since: Optional[datetime] = None,
+                               until: Optional[datetime] = None) -> List[ArchivedTransaction]:
+    """Liest die archivierten Transaktionen eines Benutzers; es werden nur die betroffenen Jahresdateien geöffnet."""
+    rows = []
+    for year in archive_years():
+        if (since and year < since.year) or (until and year > until.year):
+            continue
+        connection = sqlite3.connect(archive_path(year))
+        try:
+            for (payload,) in connection.execute(
+                "SELECT payload FROM partitions WHERE user_id = ? ORDER BY month", (user_id,)
+            ):
+                rows.extend(
+                    row for row in _unpack(payload)
+                    if (since is None or row.date >= since) and (until is None or row.date < until)
+                )
+        finally:
+            connection.close()
+    return rows
+
+def archived_month_rows(session, user_id: int, since: Optional[datetime] = None) -> List[Tuple[float, datetime, str, str]]:
+    """Monatssummen als (amount, date, category, type)-Zeilen mit dem Monatsersten als Datum, z. B. für Auswertungen."""
+    query = session.query(
+        MonthlyAggregate.total, MonthlyAggregate.year, MonthlyAggregate.month,
+        MonthlyAggregate.category, MonthlyAggregate.type
+    ).filter(MonthlyAggregate.user_id == user_id)
+    if since is not None:
+        query = query.filter(MonthlyAggregate.year * 12 + MonthlyAggregate.month >= since.year * 12 + since.month)
+    return [(total, datetime(year, month, 1), category, kind) for total, year, month, category, kind in query]
+
+def category_type_totals(session, user_id: int, category: Optional[str] = None) -> List[Tuple[str, str, float]]:
+    """Gesamtsummen je (Kategorie, Typ) über Haupttabelle und Archiv, ohne einzelne Zeilen zu laden."""
+    hot = session.query(Transaction.category, Transaction.type, func.sum(Transaction.amount)).filter(
+        Transaction.user_id == user_id
+    )
+    cold = session.query(MonthlyAggregate.category, MonthlyAggregate.type, func.sum(MonthlyAggregate.total)).filter(
+        MonthlyAggregate.user_id == user_id
+    )
+    if category is not None:
+        hot = hot.filter(Transaction.category == category)
+        cold = cold.filter(MonthlyAggregate.category == category)
+
+    totals: Dict[Tuple[str, str], float] = {}
+    for query, group in ((hot, (Transaction.category, Transaction.type)),
+                         (cold, (MonthlyAggregate.category, MonthlyAggregate.type))):
+        for name, kind, total in query.group_by(*group):
+            key = (name or UNKNOWN_CATEGORY, kind)
+            totals[key] = totals.get(key, 0.0) + (total or 0.0)
+    return [(name, kind, total) for (name, kind), total in totals.items()]
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+from utils.api_integration import ParseError, categorize_transaction, categorize_transactions
+
+logger = logging.getLogger(__name__)
+
+# Sammelfenster und maximale Anzahl Beschreibungen je API-Anfrage
+BATCH_WINDOW = int(os.getenv("CATEGORIZE_WINDOW_MS", "50")) / 1000
+BATCH_SIZE = int(os.getenv("CATEGORIZE_BATCH_SIZE", "20"))
+
+def _coalesce_key(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+class CategorizationBatcher:
+    """
+    Sammelt Kategorisierungen mehrerer Handler für ein kurzes Zeitfenster und schickt sie als eine Anfrage.
+    Gleiche Beschreibungen, die bereits warten oder unterwegs sind, teilen sich ein Ergebnis.
+    Die blockierenden HTTP-Aufrufe laufen im Thread-Pool, damit der Event-Loop frei bleibt.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW, max_items: int = BATCH_SIZE):
+        self.window = window
+        self.max_items = max_items
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        self._texts: Dict[str, str] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def categorize(self, text: str) -> tuple:
+        """Gibt (category, subcategory, amount, currency) zurück, wie categorize_transaction."""
+        key = _coalesce_key(text)
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._texts[key] = text
+            self._queue.append(key)
+            if len(self._queue) >= self.max_items:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        # shield: bricht ein Handler ab, bekommen die anderen Wartenden trotzdem ihr Ergebnis
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, keys: List[str]) -> None:
+        loop = asyncio.get_running_loop()
+        texts = [self._texts.pop(key) for key in keys]
+        try:
+            if len(texts) == 1:
+                results = [await loop.run_in_executor(None, categorize_transaction, texts[0])]
+            else:
+                try:
+                    results = await loop.run_in_executor(None, categorize_transactions, texts)
+                except ParseError:
+                    # Antwort unbrauchbar: jede Beschreibung einzeln nachfragen
+                    logger.warning(f"Sammelanfrage mit {len(texts)} Einträgen nicht auswertbar, frage einzeln an.")
+                    results = await asyncio.gather(
+                        *(loop.run_in_executor(None, categorize_transaction, text) for text in texts),
+                        return_exceptions=True
+                    )
+        except Exception as e:
+            results = [e] * len(keys)
+
+        for key, result in zip(keys, results):
+            future = self._futures.pop(key)
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+categorizer = CategorizationBatcher()
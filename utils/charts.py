@@ -0,0 +1,155 @@
+import struct
+import zlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Diagramme werden direkt mit numpy gerastert und als PNG kodiert, ohne matplotlib zu laden.
+# Beschriftungen stehen in der Bildunterschrift; die Farben passen zu den Emoji-Quadraten dort.
+# Die letzte Farbe steht für "Sonstige".
+PALETTE = [
+    ((221, 46, 68), '🟥'),
+    ((244, 144, 12), '🟧'),
+    ((253, 203, 88), '🟨'),
+    ((120, 177, 89), '🟩'),
+    ((85, 172, 238), '🟦'),
+    ((170, 142, 214), '🟪'),
+    ((193, 105, 79), '🟫'),
+    ((49, 55, 61), '⬛'),
+]
+BACKGROUND = (255, 255, 255)
+EMPTY = (225, 228, 232)
+OTHERS = 'Sonstige'
+# Kantenglättung per Supersampling
+SUPERSAMPLING = 2
+
+def limit_slices(items: Sequence[Tuple[str, float]], limit: int = len(PALETTE)) -> List[Tuple[str, float]]:
+    """Behält die größten `limit - 1` Einträge und fasst den Rest zu "Sonstige" zusammen."""
+    items = sorted(((name, value) for name, value in items if value > 0), key=lambda item: item[1], reverse=True)
+    if len(items) <= limit:
+        return items
+    head = items[:limit - 1]
+    return head + [(OTHERS, sum(value for _, value in items[limit - 1:]))]
+
+def _colors(count: int) -> np.ndarray:
+    return np.array([color for color, _ in PALETTE[:count]], dtype=np.float32)
+
+def _pie(size: int, values: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """Rastert ein Tortendiagramm (Start oben, im Uhrzeigersinn). Gibt (Farbe, Deckung) je Pixel zurück."""
+    scaled = size * SUPERSAMPLING
+    center = (scaled - 1) / 2
+    y, x = np.mgrid[0:scaled, 0:scaled].astype(np.float32)
+    dx, dy = x - center, y - center
+    inside = dx * dx + dy * dy <= (scaled * 0.46) ** 2
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.sum() <= 0:
+        colors = np.broadcast_to(np.array(EMPTY, dtype=np.float32), (scaled, scaled, 3))
+    else:
+        angle = (np.arctan2(dx, -dy) / (2 * np.pi)) % 1.0
+        bounds = np.cumsum(values / values.sum())[:-1]
+        colors = _colors(len(values))[np.searchsorted(bounds, angle, side='right')]
+    return _downsample(colors * inside[..., None]), _downsample(inside.astype(np.float32))
+
+def _downsample(image: np.ndarray) -> np.ndarray:
+    factor = SUPERSAMPLING
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    return image.reshape(height, factor, width, factor, *image.shape[2:]).mean(axis=(1, 3))
+
+def _composite(canvas: np.ndarray, top: int, left: int, color: np.ndarray, coverage: np.ndarray) -> None:
+    """Legt eine vorgemultiplizierte Farbfläche mit Deckung auf die Leinwand."""
+    height, width = coverage.shape
+    region = canvas[top:top + height, left:left + width]
+    region[:] = color + region * (1 - coverage[..., None])
+
+def render_report(expenses: Sequence[Tuple[str, float]], income: Sequence[Tuple[str, float]],
+                  width: int = 800) -> bytes:
+    """
+    Standardbericht als PNG: oben die Tortendiagramme für Ausgaben und Einnahmen, darunter die
+    Ausgabenkategorien als Balken in denselben Farben. Erwartet bereits mit limit_slices gekürzte Daten.
+    """
+    pie_size = width // 2 - 40
+    bar_height, bar_gap = 22, 8
+    bars_top = pie_size + 40
+    height = bars_top + max(len(expenses), 1) * (bar_height + bar_gap) + 20
+
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:] = BACKGROUND
+
+    for index, items in enumerate((expenses, income)):
+        color, coverage = _pie(pie_size, [value for _, value in items])
+        _composite(canvas, 20, index * (width // 2) + 20, color, coverage)
+
+    if expenses:
+        largest = max(value for _, value in expenses)
+        colors = _colors(len(expenses))
+        for index, (_, value) in enumerate(expenses):
+            top = bars_top + index * (bar_height + bar_gap)
+            length = max(int(round((width - 40) * value / largest)), 1)
+            canvas[top:top + bar_height, 20:20 + length] = colors[index]
+
+    return encode_png(np.clip(canvas + 0.5, 0, 255).astype(np.uint8))
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """Kodiert ein RGB-Bild (H x B x 3, uint8) als PNG."""
+    height, width, _ = pixels.shape
+    # Filtertyp 0 (keiner) am Anfang jeder Zeile
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, width * 3)], axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ))
+
+def legend(title: str, items: Sequence[Tuple[str, float]]) -> str:
+    """Bildunterschrift mit Farbquadrat, Kategorie und Anteil je Eintrag."""
+    total = sum(value for _, value in items)
+    if not total:
+        return f"{title}: keine"
+    lines = [f"{title}:"]
+    for (_, emoji), (name, value) in zip(PALETTE, items):
+        lines.append(f"{emoji} {name}: {value:.2f}€ ({value / total * 100:.1f}%)")
+    return "\n".join(lines)
+
+# ----- Textmodus -----
+
+_EIGHTHS = ' ▏▎▍▌▋▊▉'
+_SPARKS = '▁▂▃▄▅▆▇█'
+
+def text_bar(fraction: float, width: int = 12) -> str:
+    """Balken aus Blockzeichen mit Achtel-Auflösung."""
+    eighths = int(round(max(0.0, min(fraction, 1.0)) * width * 8))
+    full, rest = divmod(eighths, 8)
+    return '█' * full + (_EIGHTHS[rest] if rest else '')
+
+def sparkline(values: Sequence[float]) -> str:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return ''
+    low, high = values.min(), values.max()
+    if high <= low:
+        return _SPARKS[0] * len(values)
+    levels = np.round((values - low) / (high - low) * (len(_SPARKS) - 1)).astype(int)
+    return ''.join(_SPARKS[level] for level in levels)
+
+def text_report(expenses: Sequence[Tuple[str, float]], income: Sequence[Tuple[str, float]],
+                monthly_expenses: Sequence[float] = ()) -> str:
+    """Kompakte Übersicht für den Chat mit Unicode-Balken und einer Sparkline der Monatsausgaben."""
+    lines = []
+    for title, items in (("Ausgaben", expenses), ("Einnahmen", income)):
+        total = sum(value for _, value in items)
+        lines.append(f"{title} ({total:.2f}€):")
+        if not total:
+            lines.append("  keine")
+        for name, value in items:
+            share = value / total
+            lines.append(f"{text_bar(share)} {share * 100:.1f}% {name} ({value:.2f}€)")
+        lines.append("")
+    if len(monthly_expenses):
+        lines.append(f"Ausgaben der letzten {len(monthly_expenses)} Monate: {sparkline(monthly_expenses)}")
+    return "\n".join(lines).strip()
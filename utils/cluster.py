@@ -0,0 +1,166 @@
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telegram import Bot, Update
+from telegram.ext import Application, ContextTypes
+
+from database import SessionLocal
+from database.models import JobLease
+
+logger = logging.getLogger(__name__)
+
+# Eindeutige Kennung dieses Prozesses für die Job-Leases
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def shard_for_update(data: Dict, workers: int) -> int:
+    """Ordnet ein Update anhand der Telegram-User-ID einem Worker zu."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('chat')
+        if sender and 'id' in sender:
+            return sender['id'] % workers
+    # Updates ohne Absender (z. B. Umfragen) landen immer beim ersten Worker
+    return 0
+
+def acquire_job_lease(name: str, holder: str, ttl: timedelta) -> bool:
+    """Versucht, die Lease für einen Job zu übernehmen. Gibt True zurück, wenn dieser Knoten sie hält."""
+    session = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        stmt = sqlite_insert(JobLease).values(name=name, holder=holder, expires_at=now + ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[JobLease.name],
+            set_={'holder': holder, 'expires_at': now + ttl},
+            where=(JobLease.expires_at < now) | (JobLease.holder == holder)
+        )
+        session.execute(stmt)
+        session.commit()
+        return session.query(JobLease.holder).filter(JobLease.name == name).scalar() == holder
+    finally:
+        session.close()
+
+def leader_only(callback: Callable, ttl: timedelta = timedelta(minutes=10)) -> Callable:
+    """Führt einen Job nur aus, wenn dieser Knoten die Lease für den aktuellen Lauf erhält."""
+    @functools.wraps(callback)
+    async def wrapper(context: ContextTypes.DEFAULT_TYPE) -> None:
+        if not acquire_job_lease(callback.__name__, NODE_ID, ttl):
+            logger.info(f"Job {callback.__name__} läuft bereits auf einem anderen Knoten.")
+            return
+        await callback(context)
+    return wrapper
+
+async def _worker_main(index: int, token: str, queue, build_application: Callable, schedule_jobs: Optional[Callable]) -> None:
+    """Verarbeitet die Updates eines Shards in einer eigenen Application."""
+    application: Application = build_application(token)
+    if schedule_jobs and index == 0:
+        schedule_jobs(application)
+
+    async with application:
+        # post_init wird nur von run_polling/run_webhook aufgerufen; die Worker starten die Application selbst
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.stop()
+
+def _run_worker(index: int, token: str, queue, build_application: Callable, schedule_jobs: Optional[Callable]) -> None:
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    try:
+        asyncio.run(_worker_main(index, token, queue, build_application, schedule_jobs))
+    except KeyboardInterrupt:
+        pass
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, queues: List, url_path: str, secret: Optional[str]) -> None:
+    """Minimaler HTTP-Endpunkt für Telegram: prüft Pfad und Secret und leitet das Update an den Shard weiter."""
+    status = '200 OK'
+    try:
+        method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        if method != 'POST' or path != url_path:
+            status = '404 Not Found'
+        elif secret and not hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', ''), secret):
+            status = '403 Forbidden'
+        else:
+            data = json.loads(body)
+            queues[shard_for_update(data, len(queues))].put_nowait(data)
+    except (ValueError, asyncio.IncompleteReadError) as e:
+        logger.warning(f"Ungültige Webhook-Anfrage: {e}")
+        status = '400 Bad Request'
+
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode('latin-1'))
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def _serve(token: str, queues: List, webhook_url: str, listen: str, port: int, secret: Optional[str]) -> None:
+    url_path = urlsplit(webhook_url).path or '/'
+    server = await asyncio.start_server(
+        lambda r, w: _handle_request(r, w, queues, url_path, secret), host=listen, port=port
+    )
+
+    bot = Bot(token)
+    async with bot:
+        await bot.set_webhook(url=webhook_url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook aktiv auf {listen}:{port}{url_path} mit {len(queues)} Workern.")
+
+    async with server:
+        await server.serve_forever()
+
+def run_webhook_cluster(token: str, build_application: Callable, schedule_jobs: Optional[Callable], *,
+                        webhook_url: str, listen: str = "0.0.0.0", port: int = 8443,
+                        secret: Optional[str] = None, workers: int = 1) -> None:
+    """
+    Startet den Webhook-Server und `workers` Prozesse. Updates werden nach User-ID auf die Worker verteilt,
+    sodass der Gesprächszustand eines Benutzers immer im selben Prozess liegt.
+    """
+    workers = max(1, workers)
+    queues = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [
+        multiprocessing.Process(
+            target=_run_worker,
+            args=(index, token, queue, build_application, schedule_jobs),
+            name=f"worker{index}",
+            daemon=True
+        )
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(_serve(token, queues, webhook_url, listen, port, secret))
+    except KeyboardInterrupt:
+        logger.info("Webhook-Server wird beendet.")
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=10)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from database import SessionLocal
+from database.models import Transaction, User, WeeklyDigest
+from utils.jobs import mark_blocked, relevant_user_criteria
+from utils.ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+STAGE_BATCH_SIZE = 1000
+SEND_BATCH_SIZE = 500
+# Ältere Durchläufe werden beim Staging aufgeräumt
+KEEP_RUNS_FOR = timedelta(weeks=4)
+
+def run_id_for(now: datetime) -> str:
+    year, week, _ = now.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def render_digest(totals: Dict[str, float], top_categories: List[Tuple[str, float]]) -> str:
+    total_expenses = totals.get('expense', 0)
+    total_income = totals.get('income', 0)
+
+    summary = "Wöchentliche Zusammenfassung:\n\n"
+    summary += f"Gesamtausgaben: {total_expenses}€\n"
+    summary += f"Gesamteinnahmen: {total_income}€\n"
+    summary += f"Bilanz: {total_income - total_expenses}€\n\n"
+    summary += "Top 3 Ausgabenkategorien:\n"
+    for category, total in top_categories:
+        summary += f"- {category}: {total}€\n"
+    return summary
+
+def stage_weekly_digests(session, now: Optional[datetime] = None, user_ids: Optional[List[int]] = None) -> str:
+    """
+    Stufe 1: berechnet die Wochensummen und Top-3-Kategorien aller Benutzer mit zwei gruppierten Abfragen und
+    legt die fertigen Texte für aktive, nicht blockierte Benutzer in weekly_digests ab. Bereits vorhandene
+    Einträge des Durchlaufs bleiben unverändert, sodass ein abgebrochener Lauf einfach erneut gestartet werden
+    kann. Mit `user_ids` werden nur diese Benutzer vorbereitet (ein Tick des Schedulers). Gibt die Run-ID zurück.
+    """
+    now = now or datetime.now()
+    since = now - timedelta(days=7)
+    run_id = run_id_for(now)
+
+    session.query(WeeklyDigest).filter(WeeklyDigest.created_at < now - KEEP_RUNS_FOR).delete(synchronize_session=False)
+
+    totals: Dict[int, Dict[str, float]] = {}
+    for user_id, tx_type, total in session.query(
+        Transaction.user_id, Transaction.type, func.sum(Transaction.amount)
+    ).filter(
+        Transaction.date >= since, *_user_filter(Transaction.user_id, user_ids)
+    ).group_by(Transaction.user_id, Transaction.type):
+        totals.setdefault(user_id, {})[tx_type] = total or 0.0
+
+    # Top 3 je Benutzer über eine Fensterfunktion statt einer Abfrage pro Benutzer
+    category_total = func.sum(Transaction.amount).label('total')
+    ranked = session.query(
+        Transaction.user_id,
+        Transaction.category,
+        category_total,
+        func.row_number().over(
+            partition_by=Transaction.user_id, order_by=func.sum(Transaction.amount).desc()
+        ).label('rank')
+    ).filter(
+        Transaction.type == 'expense',
+        Transaction.date >= since,
+        *_user_filter(Transaction.user_id, user_ids)
+    ).group_by(Transaction.user_id, Transaction.category).subquery()
+
+    top: Dict[int, List[Tuple[str, float]]] = {}
+    for user_id, category, total in session.query(ranked.c.user_id, ranked.c.category, ranked.c.total).filter(
+        ranked.c.rank <= 3
+    ).order_by(ranked.c.user_id, ranked.c.rank):
+        top.setdefault(user_id, []).append((category, total))
+
+    already_staged = session.query(WeeklyDigest.user_id).filter(WeeklyDigest.run_id == run_id)
+    users = session.query(User.id, User.telegram_id).filter(
+        ~User.id.in_(already_staged), *relevant_user_criteria(now), *_user_filter(User.id, user_ids)
+    ).order_by(User.id).yield_per(STAGE_BATCH_SIZE)
+
+    batch = []
+    staged = 0
+    for user_id, telegram_id in users:
+        batch.append(dict(
+            run_id=run_id,
+            user_id=user_id,
+            telegram_id=telegram_id,
+            text=render_digest(totals.get(user_id, {}), top.get(user_id, [])),
+            created_at=now
+        ))
+        if len(batch) >= STAGE_BATCH_SIZE:
+            session.bulk_insert_mappings(WeeklyDigest, batch)
+            staged += len(batch)
+            batch = []
+    if batch:
+        session.bulk_insert_mappings(WeeklyDigest, batch)
+        staged += len(batch)
+    session.commit()
+
+    logger.info(f"Wochenzusammenfassungen {run_id}: {staged} neu vorbereitet.")
+    return run_id
+
+def _user_filter(column, user_ids: Optional[List[int]]) -> list:
+    return [column.in_(user_ids)] if user_ids is not None else []
+
+async def send_weekly_digests(bot, run_id: str, limiter: Optional[AsyncRateLimiter] = None,
+                              shard: int = 0, shards: int = 1) -> int:
+    """
+    Stufe 2: verschickt die noch offenen Zusammenfassungen eines Durchlaufs (bzw. eines Shards) im Rahmen
+    des Rate-Limits. Jeder Eintrag wird direkt nach dem Versand als gesendet markiert; ein Neustart setzt
+    bei den offenen Einträgen fort.
+    """
+    limiter = limiter or AsyncRateLimiter()
+    last_id = 0
+    sent = 0
+    while True:
+        session = SessionLocal()
+        try:
+            rows = session.query(WeeklyDigest.id, WeeklyDigest.telegram_id, WeeklyDigest.text).filter(
+                WeeklyDigest.run_id == run_id,
+                WeeklyDigest.sent_at.is_(None),
+                WeeklyDigest.id > last_id,
+                WeeklyDigest.user_id % shards == shard
+            ).order_by(WeeklyDigest.id).limit(SEND_BATCH_SIZE).all()
+        finally:
+            session.close()
+        if not rows:
+            return sent
+
+        session = SessionLocal()
+        try:
+            for digest_id, telegram_id, text in rows:
+                last_id = digest_id
+                error = await _send(bot, limiter, telegram_id, text)
+                if error is False:
+                    continue
+                # Sofort markieren: nach einem Absturz wird höchstens die gerade gesendete Nachricht wiederholt
+                session.query(WeeklyDigest).filter(WeeklyDigest.id == digest_id).update(
+                    {WeeklyDigest.sent_at: datetime.now(), WeeklyDigest.error: error}, synchronize_session=False
+                )
+                session.commit()
+                sent += error is None
+        finally:
+            session.close()
+
+async def _send(bot, limiter: AsyncRateLimiter, telegram_id: int, text: str):
+    """
+    Sendet eine Nachricht. Gibt None bei Erfolg, einen Fehlertext bei dauerhaften Fehlern
+    und False bei vorübergehenden Fehlern zurück (der Eintrag bleibt dann offen).
+    """
+    for _ in range(3):
+        await limiter.acquire()
+        try:
+            await bot.send_message(chat_id=telegram_id, text=text)
+            return None
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Forbidden as e:
+            mark_blocked(telegram_id)
+            return str(e)
+        except BadRequest as e:
+            return str(e)
+        except Exception as e:
+            logger.error(f"Fehler beim Senden der Wochenzusammenfassung an {telegram_id}: {e}")
+            return False
+    return False
@@ -0,0 +1,209 @@
+import calendar
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, case, cast, func
+from sqlalchemy.sql import Select
+
+from database.models import Budget, MonthlyAggregate, Transaction, User
+from utils.recurring import upcoming_recurring
+
+# Monate Historie für die Saisonalität
+HISTORY_MONTHS = 12
+# Grenzen für den Saisonfaktor, damit einzelne Ausreißer-Monate die Prognose nicht dominieren
+SEASONALITY_BOUNDS = (0.5, 2.0)
+
+@dataclass
+class BudgetForecast:
+    user_id: int
+    telegram_id: int
+    category: str
+    limit: float
+    spent: float
+    projected: float
+    exhaustion_date: Optional[date]
+
+    @property
+    def percentage(self) -> float:
+        return (self.spent / self.limit) * 100 if self.limit > 0 else 0
+
+def _month_start(now: datetime, months_back: int = 0) -> datetime:
+    month = now.month - months_back
+    year = now.year
+    while month < 1:
+        month += 12
+        year -= 1
+    return datetime(year, month, 1)
+
+def _month_number(value: datetime) -> int:
+    """Fortlaufende Monatsnummer (Jahr * 12 + Monat - 1), wie in den Historienabfragen."""
+    return value.year * 12 + value.month - 1
+
+def _filter_users(query, column, user_ids):
+    """`user_ids` ist eine Liste von IDs oder eine Unterabfrage (z. B. aus utils.jobs.relevant_user_ids)."""
+    if user_ids is None:
+        return query
+    return query.filter(column.in_(user_ids if isinstance(user_ids, Select) else list(user_ids)))
+
+def forecast_budgets(session, now: Optional[datetime] = None, user_ids=None) -> List[BudgetForecast]:
+    """
+    Projiziert die Ausgaben bis Monatsende für alle Budgets aller (bzw. der angegebenen) Benutzer auf einmal.
+    Die Tagesrate des laufenden Monats wird mit einer saisonbereinigten Rate aus den letzten zwölf Monaten
+    gemischt; je weiter der Monat fortgeschritten ist, desto stärker zählt der laufende Monat.
+    Wiederkehrende Zahlungen fließen nicht in die Raten ein, sondern werden zu ihrem Termin addiert.
+    """
+    now = now or datetime.now()
+    month_start = _month_start(now)
+    history_start = _month_start(now, HISTORY_MONTHS)
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+    # Budgets: je (Benutzer, Kategorie) gilt das zuletzt angelegte
+    budget_rows = _filter_users(
+        session.query(Budget.user_id, Budget.name, Budget.limit, User.telegram_id)
+        .join(User, User.id == Budget.user_id)
+        .order_by(Budget.id),
+        Budget.user_id, user_ids
+    ).all()
+    keys: Dict[Tuple[int, str], int] = {}
+    limits: List[float] = []
+    owners: List[Tuple[int, int, str]] = []
+    for user_id, name, limit, telegram_id in budget_rows:
+        index = keys.setdefault((user_id, name), len(limits))
+        if index == len(limits):
+            limits.append(0.0)
+            owners.append((user_id, telegram_id, name))
+        limits[index] = limit or 0.0
+    if not limits:
+        return []
+
+    count = len(limits)
+    limit = np.array(limits)
+    spent = np.zeros(count)
+    recurring_spent = np.zeros(count)
+    upcoming = np.zeros(count)
+    history_total = np.zeros(count)
+    same_month = np.zeros(count)
+
+    # Laufender Monat: eine gruppierte Abfrage für alle Benutzer
+    recurring_amount = func.sum(case((Transaction.recurring_id.isnot(None), Transaction.amount), else_=0.0))
+    current = _filter_users(
+        session.query(Transaction.user_id, Transaction.category, func.sum(Transaction.amount), recurring_amount)
+        .filter(Transaction.type == 'expense', Transaction.date >= month_start)
+        .group_by(Transaction.user_id, Transaction.category),
+        Transaction.user_id, user_ids
+    ).all()
+    index, values = _map_rows(keys, ((u, c, s) for u, c, s, _ in current))
+    np.add.at(spent, index, values)
+    index, values = _map_rows(keys, ((u, c, r) for u, c, _, r in current))
+    np.add.at(recurring_spent, index, values)
+
+    # Noch anstehende wiederkehrende Zahlungen bis Monatsende
+    next_month_start = month_start + timedelta(days=days_in_month)
+    index, values = _map_rows(keys, upcoming_recurring(session, now, next_month_start, user_ids))
+    np.add.at(upcoming, index, values)
+
+    # Historie: Monatssummen der letzten zwölf Monate aus der Haupttabelle und aus den archivierten
+    # Monatssummen (utils.archive). Wiederkehrende Zahlungen zählen nicht zur Rate; in archivierten Monaten
+    # lassen sie sich nicht herausrechnen, was nur bei RETENTION_MONTHS < HISTORY_MONTHS vorkommt.
+    month_number = (cast(func.strftime('%Y', Transaction.date), Integer) * 12
+                    + cast(func.strftime('%m', Transaction.date), Integer) - 1)
+    variable_amount = func.sum(case((Transaction.recurring_id.is_(None), Transaction.amount), else_=0.0))
+    history = _filter_users(
+        session.query(Transaction.user_id, Transaction.category, month_number, variable_amount)
+        .filter(Transaction.type == 'expense', Transaction.date >= history_start, Transaction.date < month_start)
+        .group_by(Transaction.user_id, Transaction.category, month_number),
+        Transaction.user_id, user_ids
+    ).all()
+    archived_month = MonthlyAggregate.year * 12 + MonthlyAggregate.month - 1
+    history += _filter_users(
+        session.query(MonthlyAggregate.user_id, MonthlyAggregate.category, archived_month, MonthlyAggregate.total)
+        .filter(MonthlyAggregate.type == 'expense',
+                archived_month >= _month_number(history_start), archived_month < _month_number(month_start)),
+        MonthlyAggregate.user_id, user_ids
+    ).all()
+    index, values = _map_rows(keys, ((u, c, s) for u, c, _, s in history))
+    np.add.at(history_total, index, values)
+    same_index, same_values = _map_rows(keys, ((u, c, s) for u, c, m, s in history if m % 12 + 1 == now.month))
+    np.add.at(same_month, same_index, same_values)
+
+    # Durchschnitt über alle Kalendermonate seit der ersten Ausgabe des Benutzers im Fenster, d. h. Monate
+    # ohne Ausgaben in der Kategorie zählen mit 0; Monate vor der ersten Buchung zählen nicht
+    first_month: Dict[int, int] = {}
+    for user_id, _, month, _ in history:
+        first_month[user_id] = min(first_month.get(user_id, month), month)
+    current_month = _month_number(month_start)
+    history_months = np.array(
+        [current_month - first_month.get(user_id, current_month) for user_id, _, _ in owners], dtype=np.float64
+    )
+
+    # Tagesraten
+    elapsed_days = max((now - month_start).total_seconds() / 86400, 1.0)
+    remaining_days = max(days_in_month - elapsed_days, 0.0)
+    current_rate = (spent - recurring_spent) / elapsed_days
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_month = np.where(history_months > 0, history_total / history_months, 0.0)
+        seasonality = np.where((average_month > 0) & (same_month > 0), same_month / average_month, 1.0)
+    seasonality = np.clip(seasonality, *SEASONALITY_BOUNDS)
+    seasonal_rate = np.where(average_month > 0, average_month * seasonality / days_in_month, current_rate)
+
+    weight = elapsed_days / days_in_month
+    rate = weight * current_rate + (1 - weight) * seasonal_rate
+    projected = spent + rate * remaining_days + upcoming
+
+    # Tag, an dem das Budget bei dieser Rate aufgebraucht ist (anstehende Daueraufträge bereits abgezogen)
+    headroom = np.maximum(limit - spent - upcoming, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_until_exhausted = np.where(headroom <= 0, 0.0, np.where(rate > 0, headroom / rate, np.inf))
+    exhausted_in_month = (spent < limit) & (days_until_exhausted <= remaining_days)
+
+    forecasts = []
+    for i, (user_id, telegram_id, name) in enumerate(owners):
+        exhaustion_date = None
+        if exhausted_in_month[i]:
+            exhaustion_date = (now + timedelta(days=float(days_until_exhausted[i]))).date()
+        forecasts.append(BudgetForecast(
+            user_id=user_id,
+            telegram_id=telegram_id,
+            category=name,
+            limit=float(limit[i]),
+            spent=float(spent[i]),
+            projected=float(projected[i]),
+            exhaustion_date=exhaustion_date
+        ))
+    return forecasts
+
+def _map_rows(keys: Dict[Tuple[int, str], int], rows: Iterable[Tuple[int, str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Ordnet aggregierte (Benutzer, Kategorie, Summe)-Zeilen den Budget-Indizes zu; Kategorien ohne Budget entfallen."""
+    index = []
+    values = []
+    for user_id, category, total in rows:
+        position = keys.get((user_id, category))
+        if position is not None:
+            index.append(position)
+            values.append(total or 0.0)
+    return np.array(index, dtype=np.int64), np.array(values, dtype=np.float64)
+
+def forecast_warnings(forecasts: List[BudgetForecast]) -> Dict[int, str]:
+    """Fasst die Warnungen je Telegram-ID zu einer Nachricht zusammen."""
+    messages: Dict[int, List[str]] = {}
+    for forecast in forecasts:
+        if forecast.limit <= 0:
+            continue
+        if forecast.spent >= forecast.limit:
+            line = f"- {forecast.category}: Budget bereits überschritten ({forecast.spent:.2f}€ von {forecast.limit:.2f}€)."
+        elif forecast.exhaustion_date is not None:
+            line = (f"- {forecast.category}: Bei diesem Tempo ist dein Budget am {forecast.exhaustion_date.strftime('%d.%m.')} "
+                    f"aufgebraucht (Prognose {forecast.projected:.2f}€ von {forecast.limit:.2f}€).")
+        elif forecast.percentage >= 80:
+            line = f"- {forecast.category}: Du hast bereits {forecast.percentage:.1f}% deines Budgets ausgegeben."
+        else:
+            continue
+        messages.setdefault(forecast.telegram_id, []).append(line)
+
+    return {
+        telegram_id: "Budget-Prognose für diesen Monat:\n\n" + "\n".join(lines)
+        for telegram_id, lines in messages.items()
+    }
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import secrets
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import SessionLocal
+from database.households import household_budget_status, household_splits, normalize_category
+from database.models import Household, HouseholdAggregate, HouseholdBudget, HouseholdMember, HouseholdMemberAggregate, Transaction, User
+from utils.jobs import send_to_user
+from utils.ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Ein gemeinsamer Limiter für alle Haushaltsbenachrichtigungen, damit parallele Fan-outs
+# zusammen unter Telegrams Limit bleiben
+household_limiter = AsyncRateLimiter()
+
+def membership(session, user_id: int) -> Optional[HouseholdMember]:
+    return session.query(HouseholdMember).filter(HouseholdMember.user_id == user_id).first()
+
+def create_household(session, user_id: int, name: str) -> Household:
+    """Legt einen Haushalt mit Einladungscode an; der Ersteller ist das erste Mitglied."""
+    household = Household(name=name, invite_code=secrets.token_urlsafe(6))
+    household.members.append(HouseholdMember(user_id=user_id))
+    session.add(household)
+    session.commit()
+    return household
+
+def join_household(session, user_id: int, invite_code: str) -> Optional[Household]:
+    household = session.query(Household).filter(Household.invite_code == invite_code).first()
+    if household is None:
+        return None
+    session.add(HouseholdMember(household_id=household.id, user_id=user_id))
+    session.commit()
+    return household
+
+def leave_household(session, member: HouseholdMember) -> bool:
+    """
+    Entfernt die Mitgliedschaft. Verlässt das letzte Mitglied den Haushalt, werden Haushalt, Budgets und
+    Summen gelöscht und die Buchungen wieder rein persönlich. Gibt True zurück, wenn der Haushalt gelöscht wurde.
+    """
+    household = member.household
+    session.delete(member)
+    session.flush()
+    remaining = session.query(HouseholdMember.id).filter(HouseholdMember.household_id == household.id).count()
+    if not remaining:
+        # Massenoperationen: die Summen des Haushalts werden ohnehin gelöscht
+        session.query(Transaction).filter(Transaction.household_id == household.id).update(
+            {Transaction.household_id: None}, synchronize_session=False
+        )
+        for model in (HouseholdAggregate, HouseholdMemberAggregate):
+            session.query(model).filter(model.household_id == household.id).delete(synchronize_session=False)
+        session.delete(household)
+    session.commit()
+    return not remaining
+
+def set_household_budget(session, household_id: int, category: str, limit: float) -> None:
+    stmt = sqlite_insert(HouseholdBudget).values(
+        household_id=household_id, name=normalize_category(category), limit=limit
+    )
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[HouseholdBudget.household_id, HouseholdBudget.name], set_={'limit': stmt.excluded.limit}
+    ))
+    session.commit()
+
+def household_overview(session, household: Household, now: Optional[datetime] = None) -> str:
+    """Monatsübersicht: Budgets mit Ausgaben aus den Monatssummen und die Aufteilung zwischen den Mitgliedern."""
+    now = now or datetime.now()
+    lines = [f"Haushalt {household.name} (Einladungscode: {household.invite_code})", ""]
+
+    spent = dict(session.query(HouseholdAggregate.category, HouseholdAggregate.total).filter(
+        HouseholdAggregate.household_id == household.id,
+        HouseholdAggregate.year == now.year,
+        HouseholdAggregate.month == now.month,
+        HouseholdAggregate.type == 'expense'
+    ).all())
+    budgets = session.query(HouseholdBudget.name, HouseholdBudget.limit).filter(
+        HouseholdBudget.household_id == household.id
+    ).order_by(HouseholdBudget.name).all()
+
+    lines.append(f"Ausgaben {now.month:02d}/{now.year}: {sum(spent.values()):.2f}€")
+    for name, limit in budgets:
+        total = spent.get(name, 0.0)
+        lines.append(f"- {name}: {total:.2f}€ von {limit:.2f}€ ({total / limit * 100 if limit else 0:.0f}%)")
+
+    lines.extend(["", "Aufteilung:"])
+    for name, paid, owed, balance in household_splits(session, household.id, now):
+        lines.append(f"- {name}: bezahlt {paid:.2f}€, Anteil {owed:.2f}€, Saldo {balance:+.2f}€")
+    return "\n".join(lines)
+
+async def notify_household(bot, household_id: int, text: str, limiter: Optional[AsyncRateLimiter] = None) -> int:
+    """Schickt die Nachricht nebenläufig an alle Mitglieder; gibt die Anzahl erfolgreicher Zustellungen zurück."""
+    session = SessionLocal()
+    try:
+        telegram_ids = [
+            telegram_id for (telegram_id,) in session.query(User.telegram_id).join(
+                HouseholdMember, HouseholdMember.user_id == User.id
+            ).filter(HouseholdMember.household_id == household_id, User.is_blocked.isnot(True))
+        ]
+    finally:
+        session.close()
+
+    limiter = limiter or household_limiter
+    results = await asyncio.gather(
+        *(send_to_user(bot, telegram_id, text, limiter) for telegram_id in telegram_ids), return_exceptions=True
+    )
+    return sum(1 for result in results if result is True)
+
+async def check_household_budget(bot, user_id: int, category: str, amount: float) -> None:
+    """
+    Warnt alle Mitglieder, sobald eine Buchung das Haushaltsbudget der Kategorie überschreitet.
+    Eine Abfrage über die Monatssummen, unabhängig von der Zahl der Mitglieder.
+    """
+    session = SessionLocal()
+    try:
+        status = household_budget_status(session, user_id, category)
+    finally:
+        session.close()
+    if status is None:
+        return
+
+    household_id, name, limit, total = status
+    # Nur beim Überschreiten warnen, nicht bei jeder weiteren Buchung
+    if total > limit >= total - amount:
+        await notify_household(
+            bot, household_id,
+            f"⚠️ Haushalt {name}: Das gemeinsame Budget für {category} ist überschritten! "
+            f"Limit: {limit:.2f}€, Ausgaben diesen Monat: {total:.2f}€."
+        )
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import or_, select
+from telegram.error import Forbidden
+
+from database import SessionLocal
+from database.models import User
+from utils.ratelimit import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Benutzer ohne Interaktion in diesem Zeitraum bekommen keine Job-Nachrichten mehr
+ACTIVE_WITHIN = timedelta(days=int(os.getenv("ACTIVE_USER_DAYS", "90")))
+JOB_SHARDS = int(os.getenv("JOB_SHARDS", "4"))
+STREAM_BATCH_SIZE = 1000
+
+# last_active_at wird höchstens alle zehn Minuten je Benutzer geschrieben
+ACTIVITY_WRITE_INTERVAL = 600
+_MAX_TRACKED_USERS = 100_000
+_last_activity_write: Dict[int, float] = {}
+
+def relevant_user_criteria(now: Optional[datetime] = None, shard: Optional[int] = None, shards: int = 1) -> List:
+    """Filter für Benutzer, die Job-Nachrichten bekommen sollen: nicht blockiert, kürzlich aktiv, im Shard."""
+    now = now or datetime.now()
+    criteria = [
+        User.is_blocked.isnot(True),
+        # Benutzer aus der Zeit vor der Aktivitätserfassung haben noch keinen Zeitstempel
+        or_(User.last_active_at.is_(None), User.last_active_at >= now - ACTIVE_WITHIN)
+    ]
+    if shard is not None and shards > 1:
+        criteria.append(User.id % shards == shard)
+    return criteria
+
+def relevant_user_ids(**kwargs):
+    """Unterabfrage der IDs relevanter Benutzer, z. B. für `Transaction.user_id.in_(...)`."""
+    return select(User.id).where(*relevant_user_criteria(**kwargs))
+
+def iter_pages(query, key_column, batch_size: int = STREAM_BATCH_SIZE):
+    """
+    Liefert die Zeilen seitenweise per Keyset-Pagination (die erste Spalte muss `key_column` sein).
+    Anders als yield_per bleibt dabei kein Cursor offen, während zwischen den Seiten Nachrichten gesendet werden.
+    """
+    last_key = None
+    while True:
+        page = query if last_key is None else query.filter(key_column > last_key)
+        rows = page.order_by(key_column).limit(batch_size).all()
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][0]
+
+async def run_sharded(job: Callable[[int, int], Awaitable[None]], shards: int = JOB_SHARDS) -> None:
+    """Führt `job(shard, shards)` für alle Shards nebenläufig aus; jeder Shard nutzt seine eigene Session."""
+    results = await asyncio.gather(*(job(shard, shards) for shard in range(shards)), return_exceptions=True)
+    for shard, result in enumerate(results):
+        if isinstance(result, Exception):
+            logger.error(f"Shard {shard}/{shards} von {getattr(job, '__name__', job)} fehlgeschlagen: {result}")
+
+def mark_blocked(telegram_id: int) -> None:
+    session = SessionLocal()
+    try:
+        session.query(User).filter(User.telegram_id == telegram_id).update(
+            {User.is_blocked: True}, synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
+
+async def send_to_user(bot, telegram_id: int, text: str, limiter: Optional[AsyncRateLimiter] = None) -> bool:
+    """Sendet eine Job-Nachricht. Hat der Benutzer den Bot blockiert, wird er markiert und künftig übersprungen."""
+    if limiter:
+        await limiter.acquire()
+    try:
+        await bot.send_message(chat_id=telegram_id, text=text)
+        return True
+    except Forbidden:
+        logger.info(f"Benutzer {telegram_id} hat den Bot blockiert.")
+        mark_blocked(telegram_id)
+    except Exception as e:
+        logger.error(f"Fehler beim Senden an {telegram_id}: {e}")
+    return False
+
+async def track_activity(update, context) -> None:
+    """Aktualisiert last_active_at (gedrosselt) und hebt eine Blockierung auf, sobald der Benutzer wieder schreibt."""
+    user = update.effective_user
+    if not user:
+        return
+
+    now = time.monotonic()
+    if now - _last_activity_write.get(user.id, float('-inf')) < ACTIVITY_WRITE_INTERVAL:
+        return
+    if len(_last_activity_write) >= _MAX_TRACKED_USERS:
+        _last_activity_write.clear()
+    _last_activity_write[user.id] = now
+
+    session = SessionLocal()
+    try:
+        session.query(User).filter(User.telegram_id == user.id).update(
+            {User.last_active_at: datetime.now(), User.is_blocked: False}, synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
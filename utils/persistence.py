@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS callback_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+# bot_data und callback_data haben jeweils nur eine Zeile
+_SINGLETON_ID = 0
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistiert user_data, chat_data, bot_data und die Gesprächszustände in einer SQLite-Datei (WAL).
+    Es werden nur geänderte Einträge geschrieben; alle Änderungen eines Persistenz-Durchlaufs landen
+    gesammelt in einer Transaktion.
+    """
+
+    def __init__(self, filepath: str = "bot_state.db", update_interval: float = 5, store_data: PersistenceInput = None):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self._connection = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        # Tabelle -> Schlüssel -> serialisierte Daten (None = löschen)
+        self._pending: Dict[str, Dict[object, Optional[bytes]]] = {}
+        self._flush_scheduled = False
+
+    # ----- Schreiben -----
+
+    def _stage(self, table: str, key: object, data: Optional[object]) -> None:
+        """Merkt eine Änderung vor und plant das Schreiben für den aktuellen Durchlauf ein."""
+        payload = None if data is None else pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        self._pending.setdefault(table, {})[key] = payload
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            try:
+                asyncio.get_running_loop().call_soon(self._write_pending)
+            except RuntimeError:
+                self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Schreibt alle vorgemerkten Änderungen in einer Transaktion."""
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for table, rows in pending.items():
+                upserts = [(key, payload) for key, payload in rows.items() if payload is not None]
+                deletes = [(key,) for key, payload in rows.items() if payload is None]
+                if table == 'conversations':
+                    upserts = [(name, key, payload) for (name, key), payload in upserts]
+                    deletes = [(name, key) for ((name, key),) in deletes]
+                    cursor.executemany(
+                        "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                        "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                        upserts
+                    )
+                    cursor.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", deletes)
+                else:
+                    cursor.executemany(
+                        f"INSERT INTO {table} (id, data) VALUES (?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                        upserts
+                    )
+                    cursor.executemany(f"DELETE FROM {table} WHERE id = ?", deletes)
+            cursor.execute("COMMIT")
+        except sqlite3.Error as e:
+            cursor.execute("ROLLBACK")
+            logger.error(f"Fehler beim Schreiben der Persistenz: {e}")
+        finally:
+            cursor.close()
+
+    # ----- Lesen -----
+
+    def _load_table(self, table: str) -> Dict[int, object]:
+        rows = self._connection.execute(f"SELECT id, data FROM {table}").fetchall()
+        return {row_id: pickle.loads(data) for row_id, data in rows}
+
+    def _load_singleton(self, table: str) -> Optional[object]:
+        row = self._connection.execute(f"SELECT data FROM {table} WHERE id = ?", (_SINGLETON_ID,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return self._load_table('user_data')
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return self._load_table('chat_data')
+
+    async def get_bot_data(self) -> Dict:
+        return self._load_singleton('bot_data') or {}
+
+    async def get_callback_data(self) -> Optional[object]:
+        return self._load_singleton('callback_data')
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        rows = self._connection.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    # ----- Aktualisieren -----
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._stage('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._stage('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        self._stage('bot_data', _SINGLETON_ID, data)
+
+    async def update_callback_data(self, data: object) -> None:
+        self._stage('callback_data', _SINGLETON_ID, data)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._stage('conversations', (name, json.dumps(key)), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage('user_data', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage('chat_data', chat_id, None)
+
+    # Die Daten liegen bereits im Speicher der Application; vor jedem Update ist nichts nachzuladen
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Schreibt ausstehende Änderungen und schließt die Datenbank."""
+        self._write_pending()
+        self._connection.close()
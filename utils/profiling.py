@@ -0,0 +1,181 @@
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+
+from sqlalchemy import event
+
+from database.engine import engine as default_engine
+from database.models import Base
+
+logger = logging.getLogger(__name__)
+
+# Abfragen je Handler- und Job-Aufruf mitzählen und protokollieren (PROFILE_QUERIES=1)
+PROFILE_QUERIES = os.getenv("PROFILE_QUERIES", "0") == "1"
+# Abfragen ab dieser Dauer mit Ausführungsplan protokollieren; 0 = aus
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# Warnung, wenn ein Aufruf mehr Abfragen absetzt
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "20"))
+# So viele Statements je Scope werden für Fehlermeldungen aufbewahrt
+_MAX_STATEMENTS = 50
+
+@dataclass
+class QueryStats:
+    """
+    Abfragen eines Scopes. `rows` zählt die gelesenen Ergebniszeilen (nur SQLite), `changed` die von
+    INSERT/UPDATE/DELETE betroffenen Zeilen und `loaded` die geladenen ORM-Objekte.
+    """
+    name: str
+    queries: int = 0
+    rows: int = 0
+    changed: int = 0
+    loaded: int = 0
+    elapsed: float = 0.0  # Sekunden in der Datenbank
+    statements: List[str] = field(default_factory=list)
+    parent: Optional['QueryStats'] = None
+
+    def chain(self) -> Iterator['QueryStats']:
+        scope = self
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+    def summary(self) -> str:
+        return (f"{self.name}: {self.queries} Abfragen, {self.rows} Zeilen gelesen, {self.changed} geändert, "
+                f"{self.loaded} Objekte geladen, {self.elapsed * 1000:.1f} ms in der Datenbank")
+
+# Über asyncio-Tasks hinweg vererbt, d. h. per gather gestartete Shards zählen zum aufrufenden Job.
+# Aufrufe im Thread-Pool (run_in_executor) übernehmen den Kontext nicht.
+_current: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar('query_scope', default=None)
+
+def _count_row(cursor, row):
+    # row_factory von sqlite3: wird für jede tatsächlich abgeholte Zeile aufgerufen
+    scope = _current.get()
+    if scope is not None:
+        for stats in scope.chain():
+            stats.rows += 1
+    return row
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    # rowcount ist bei SELECT immer -1; gelesene Zeilen werden daher beim Abholen gezählt
+    if _current.get() is not None and conn.dialect.name == 'sqlite':
+        cursor.row_factory = _count_row
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    scope = _current.get()
+    if scope is not None:
+        affected = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        for stats in scope.chain():
+            stats.queries += 1
+            stats.changed += affected
+            stats.elapsed += elapsed
+            if len(stats.statements) < _MAX_STATEMENTS:
+                stats.statements.append(statement)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+def _log_slow_query(conn, statement: str, parameters, executemany: bool, elapsed: float) -> None:
+    plan = ''
+    if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        # Eigener DBAPI-Cursor, damit der Plan nicht selbst durch die Listener läuft
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters or ())
+            plan = "\n".join(" ".join(str(value) for value in row) for row in cursor.fetchall())
+        except Exception as e:
+            plan = f"(kein Plan: {e})"
+        finally:
+            cursor.close()
+    logger.warning(f"Langsame Abfrage ({elapsed * 1000:.1f} ms): {statement}\n{plan}".rstrip())
+
+def _on_load(target, context) -> None:
+    scope = _current.get()
+    if scope is not None:
+        for stats in scope.chain():
+            stats.loaded += 1
+
+def install(engine=None) -> None:
+    """Registriert die Listener (mehrfacher Aufruf ist unschädlich)."""
+    engine = engine or default_engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    if not event.contains(Base, 'load', _on_load):
+        event.listen(Base, 'load', _on_load, propagate=True)
+
+@contextmanager
+def query_scope(name: str) -> Iterator[QueryStats]:
+    """Zählt die Abfragen im Block; verschachtelte Scopes zählen auch beim äußeren mit."""
+    stats = QueryStats(name=name, parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def assert_max_queries(limit: int, name: str = 'block', engine=None) -> Iterator[QueryStats]:
+    """
+    Schlägt fehl, wenn der Block mehr als `limit` Abfragen absetzt, z. B. um sicherzustellen, dass ein Job
+    unabhängig von der Zahl der Benutzer mit einer festen Zahl Abfragen auskommt:
+
+        with assert_max_queries(3):
+            goal_pace(session, user_ids)
+    """
+    install(engine)
+    with query_scope(name) as stats:
+        yield stats
+    if stats.queries > limit:
+        raise AssertionError(
+            f"{stats.summary()} (erlaubt: {limit})\n" + "\n".join(f"  {statement}" for statement in stats.statements)
+        )
+
+def profiled(callback: Callable, name: Optional[str] = None) -> Callable:
+    """Umhüllt einen async Handler oder Job und protokolliert Abfragen und Laufzeit je Aufruf."""
+    if not PROFILE_QUERIES:
+        return callback
+    name = name or getattr(callback, '__name__', repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        with query_scope(name) as stats:
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                total = (time.perf_counter() - started) * 1000
+                if stats.queries > QUERY_BUDGET:
+                    logger.warning(f"Abfragebudget überschritten – {stats.summary()}, {total:.1f} ms gesamt")
+                else:
+                    logger.info(f"Profil {stats.summary()}, {total:.1f} ms gesamt")
+    return wrapper
+
+def profile_handlers(application) -> None:
+    """Umhüllt die Callbacks aller registrierten Handler, auch die in ConversationHandlern."""
+    if not PROFILE_QUERIES:
+        return
+
+    def wrap(handler) -> None:
+        nested = [*getattr(handler, 'entry_points', ()), *getattr(handler, 'fallbacks', ()),
+                  *(h for handlers in getattr(handler, 'states', {}).values() for h in handlers)]
+        if nested:
+            for inner in nested:
+                wrap(inner)
+        elif hasattr(handler, 'callback'):
+            handler.callback = profiled(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+def setup(engine=None) -> None:
+    """Aktiviert die Listener, wenn Profiling oder das Protokoll langsamer Abfragen eingeschaltet ist."""
+    if PROFILE_QUERIES or SLOW_QUERY_MS:
+        install(engine)
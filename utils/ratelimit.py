@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+class AsyncRateLimiter:
+    """Token-Bucket für ausgehende Nachrichten, damit Telegrams Limits (ca. 30 Nachrichten/s) eingehalten werden."""
+
+    def __init__(self, rate: float = 25.0, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wartet, bis eine weitere Nachricht gesendet werden darf."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,204 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import Select
+
+from database.models import RecurringTransaction, Transaction, User
+
+logger = logging.getLogger(__name__)
+
+# Bekannte Perioden in Tagen und die erlaubte Abweichung
+PERIODS = (
+    (7, 1),      # wöchentlich
+    (14, 2),     # zweiwöchentlich
+    (30, 3),     # monatlich
+    (91, 7),     # quartalsweise
+    (365, 10),   # jährlich
+)
+MIN_OCCURRENCES = 3
+# Anteil der Abstände, die zur Periode passen müssen
+MIN_REGULARITY = 0.75
+
+_AMOUNT_PATTERN = re.compile(r'(\d+(?:[.,]\d{1,2})?)\s*(?:€|eur|euro)?', re.IGNORECASE)
+_NOISE_PATTERN = re.compile(r'[\d€$.,:;!?()\-+/]|\b(?:eur|euro|für|for|fuer|am|im|the)\b', re.IGNORECASE)
+
+def parse_amount(text: str) -> Optional[float]:
+    """Liest den ersten Betrag aus einer Beschreibung wie '12,99€ Netflix' (ohne API)."""
+    match = _AMOUNT_PATTERN.search(text or '')
+    if not match:
+        return None
+    return float(match.group(1).replace(',', '.'))
+
+def normalize_description(text: str) -> str:
+    """Entfernt Beträge, Währungen und Füllwörter: '12,99€ für Netflix' -> 'netflix'."""
+    return ' '.join(_NOISE_PATTERN.sub(' ', (text or '').lower()).split())
+
+def signature(description: str, amount: float, transaction_type: str) -> Optional[str]:
+    """Schlüssel für gleichartige Zahlungen; None, wenn die Beschreibung nur aus dem Betrag besteht."""
+    text = normalize_description(description)
+    if not text:
+        return None
+    return f"{transaction_type}|{text}|{round(amount or 0)}"
+
+def _detect_period(dates: List[datetime]) -> Optional[int]:
+    """Gibt die Periode in Tagen zurück, wenn die Abstände regelmäßig genug sind."""
+    if len(dates) < MIN_OCCURRENCES:
+        return None
+    intervals = [(later - earlier).days for earlier, later in zip(dates, dates[1:])]
+    typical = median(intervals)
+    for period, tolerance in PERIODS:
+        if abs(typical - period) <= tolerance:
+            regular = sum(1 for interval in intervals if abs(interval - period) <= tolerance)
+            if regular / len(intervals) >= MIN_REGULARITY:
+                return period
+    return None
+
+def _next_date(last_date: datetime, interval_days: int) -> datetime:
+    """Nächster Termin; monatliche Zahlungen bleiben auf demselben Kalendertag."""
+    if interval_days == 30:
+        month = last_date.month % 12 + 1
+        year = last_date.year + (1 if month == 1 else 0)
+        for day in (last_date.day, 30, 29, 28):
+            try:
+                return last_date.replace(year=year, month=month, day=day)
+            except ValueError:
+                continue
+    return last_date + timedelta(days=interval_days)
+
+def detect_recurring(session, batch_size: int = 5000) -> int:
+    """
+    Durchsucht alle Transaktionen in einem sortierten Durchlauf nach wiederkehrenden Zahlungen und
+    aktualisiert die Tabelle recurring_transactions. Es wird immer nur ein Benutzer im Speicher gehalten.
+    Gibt die Anzahl erkannter Einträge zurück.
+    """
+    rows = session.query(
+        Transaction.id, Transaction.user_id, Transaction.date, Transaction.amount, Transaction.description,
+        Transaction.category, Transaction.subcategory, Transaction.currency, Transaction.type
+    ).filter(Transaction.date.isnot(None)).order_by(Transaction.user_id, Transaction.date).yield_per(batch_size)
+
+    detected = 0
+    current_user = None
+    groups: Dict[str, Tuple[List[datetime], List[int], tuple]] = {}
+    for row in rows:
+        if row.user_id != current_user:
+            detected += _store_groups(session, current_user, groups)
+            current_user = row.user_id
+            groups = {}
+        key = signature(row.description, row.amount, row.type)
+        if key is None:
+            continue
+        dates, ids, _ = groups.get(key, ([], [], None))
+        dates.append(row.date)
+        ids.append(row.id)
+        groups[key] = (dates, ids, row)
+    detected += _store_groups(session, current_user, groups)
+
+    session.commit()
+    return detected
+
+def _store_groups(session, user_id: Optional[int], groups: Dict[str, Tuple[List[datetime], List[int], tuple]]) -> int:
+    detected = 0
+    for key, (dates, ids, last) in groups.items():
+        interval_days = _detect_period(dates)
+        if interval_days is None:
+            continue
+
+        values = dict(
+            user_id=user_id,
+            signature=key,
+            description=last.description,
+            amount=last.amount,
+            category=last.category,
+            subcategory=last.subcategory,
+            currency=last.currency,
+            type=last.type,
+            interval_days=interval_days,
+            occurrences=len(dates),
+            last_date=dates[-1],
+            next_date=_next_date(dates[-1], interval_days),
+            active=True
+        )
+        # auto_book bleibt bei bestehenden Einträgen unverändert
+        update = {name: value for name, value in values.items() if name not in ('user_id', 'signature')}
+        session.execute(
+            sqlite_insert(RecurringTransaction).values(**values).on_conflict_do_update(
+                index_elements=[RecurringTransaction.user_id, RecurringTransaction.signature], set_=update
+            )
+        )
+        recurring_id = session.query(RecurringTransaction.id).filter(
+            RecurringTransaction.user_id == user_id, RecurringTransaction.signature == key
+        ).scalar()
+        session.query(Transaction).filter(Transaction.id.in_(ids)).update(
+            {Transaction.recurring_id: recurring_id}, synchronize_session=False
+        )
+        detected += 1
+    return detected
+
+def match_recurring(session, user_id: int, text: str, transaction_type: str) -> Optional[RecurringTransaction]:
+    """Sucht einen bekannten wiederkehrenden Eintrag zur Eingabe, damit keine API-Anfrage nötig ist."""
+    amount = parse_amount(text)
+    key = signature(text, amount, transaction_type) if amount is not None else None
+    if key is None:
+        return None
+    return session.query(RecurringTransaction).filter(
+        RecurringTransaction.user_id == user_id,
+        RecurringTransaction.signature == key,
+        RecurringTransaction.active.is_(True)
+    ).first()
+
+def mark_booked(recurring: RecurringTransaction, booked_at: datetime) -> None:
+    """Schiebt den nächsten Termin nach einer (manuellen oder automatischen) Buchung weiter."""
+    recurring.last_date = booked_at
+    recurring.next_date = _next_date(booked_at, recurring.interval_days)
+    recurring.occurrences = (recurring.occurrences or 0) + 1
+
+def book_due_recurring(session, now: Optional[datetime] = None) -> List[Tuple[int, str, float, str]]:
+    """
+    Bucht alle fälligen Einträge mit auto_book ohne API-Anfrage.
+    Gibt (Telegram-ID, Beschreibung, Betrag, Währung) je Buchung zurück.
+    """
+    now = now or datetime.now()
+    due = session.query(RecurringTransaction, User.telegram_id).join(User, User.id == RecurringTransaction.user_id).filter(
+        RecurringTransaction.active.is_(True),
+        RecurringTransaction.auto_book.is_(True),
+        RecurringTransaction.next_date <= now
+    ).all()
+
+    booked = []
+    for recurring, telegram_id in due:
+        # Verpasste Termine werden einzeln nachgebucht
+        while recurring.next_date <= now:
+            session.add(Transaction(
+                user_id=recurring.user_id,
+                amount=recurring.amount,
+                description=recurring.description,
+                date=recurring.next_date,
+                category=recurring.category,
+                subcategory=recurring.subcategory,
+                currency=recurring.currency,
+                type=recurring.type,
+                recurring_id=recurring.id
+            ))
+            booked.append((telegram_id, recurring.description, recurring.amount, recurring.currency))
+            mark_booked(recurring, recurring.next_date)
+    session.commit()
+    return booked
+
+def upcoming_recurring(session, start: datetime, end: datetime, user_ids=None) -> List[Tuple[int, str, float]]:
+    """Summe der noch anstehenden wiederkehrenden Ausgaben je (Benutzer, Kategorie) im Zeitraum."""
+    query = session.query(
+        RecurringTransaction.user_id, RecurringTransaction.category, func.sum(RecurringTransaction.amount)
+    ).filter(
+        RecurringTransaction.active.is_(True),
+        RecurringTransaction.type == 'expense',
+        RecurringTransaction.next_date > start,
+        RecurringTransaction.next_date < end
+    ).group_by(RecurringTransaction.user_id, RecurringTransaction.category)
+    if user_ids is not None:
+        query = query.filter(RecurringTransaction.user_id.in_(user_ids if isinstance(user_ids, Select) else list(user_ids)))
+    return query.all()
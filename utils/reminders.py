@@ -1,44 +1,70 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, union_all
 from telegram.ext import Application
-from telegram import Update
 from telegram.ext import ContextTypes
 from database import SessionLocal
-from database.models import Budget, Transaction, User
-from sqlalchemy import func
+from database.models import Budget, MonthlyAggregate, Transaction, User
+from utils.archive import UNKNOWN_CATEGORY
+from utils.jobs import relevant_user_criteria, send_to_user
+from utils.ratelimit import AsyncRateLimiter
 import logging
 
 logger = logging.getLogger(__name__)
 
+def overspent_budgets(session, now: Optional[datetime] = None) -> List[Tuple[int, str, float, float]]:
+    """
+    Alle überschrittenen Budgets relevanter Benutzer in einer Abfrage als (telegram_id, name, limit, total).
+    `Budget.name` muss mit `Transaction.category` übereinstimmen; archivierte Monate zählen über die Monatssummen mit.
+    """
+    budget_users = select(Budget.user_id)
+    spent = union_all(
+        select(
+            Transaction.user_id.label('user_id'),
+            func.coalesce(Transaction.category, UNKNOWN_CATEGORY).label('category'),
+            Transaction.amount.label('amount')
+        ).where(Transaction.type == 'expense', Transaction.user_id.in_(budget_users)),
+        select(
+            MonthlyAggregate.user_id.label('user_id'),
+            MonthlyAggregate.category.label('category'),
+            MonthlyAggregate.total.label('amount')
+        ).where(MonthlyAggregate.type == 'expense', MonthlyAggregate.user_id.in_(budget_users))
+    ).subquery()
+    totals = select(
+        spent.c.user_id, spent.c.category, func.sum(spent.c.amount).label('total')
+    ).group_by(spent.c.user_id, spent.c.category).subquery()
+
+    return session.query(User.telegram_id, Budget.name, Budget.limit, totals.c.total).join(
+        User, User.id == Budget.user_id
+    ).join(
+        totals, and_(totals.c.user_id == Budget.user_id, totals.c.category == Budget.name)
+    ).filter(
+        totals.c.total > Budget.limit, *relevant_user_criteria(now=now)
+    ).order_by(User.id).all()
+
 async def budget_check(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Überprüft die Budgets der Benutzer und sendet Warnungen bei Überschreitungen."""
     session = SessionLocal()
-    budgets = session.query(Budget).all()
-    for budget in budgets:
-        user = session.query(User).filter(User.id == budget.user_id).first()
-        if not user:
-            logger.error(f"Benutzer mit ID {budget.user_id} nicht gefunden.")
-            continue
-
-        total = session.query(func.sum(Transaction.amount)).filter(
-            Transaction.user_id == budget.user_id,
-            Transaction.category == budget.name,  # Sicherstellen, dass `Budget.name` mit `Transaction.category` übereinstimmt
-            Transaction.type == 'expense'
-        ).scalar() or 0.0
-
-        if total > budget.limit:
-            try:
-                await context.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"Warnung: Du hast dein Budget für {budget.name} überschritten! Limit: {budget.limit}€, Ausgaben: {total}€."
-                )
-            except Exception as e:
-                logger.error(f"Fehler beim Senden der Warnung: {e}")
-    session.close()
-
-def schedule_budget_check_job(application: Application):
-    """Plant tägliche Budgetüberprüfungen ein."""
+    try:
+        overspent = overspent_budgets(session)
+    finally:
+        session.close()
+
+    limiter = AsyncRateLimiter()
+    for telegram_id, name, limit, total in overspent:
+        await send_to_user(
+            context.bot, telegram_id,
+            f"Warnung: Du hast dein Budget für {name} überschritten! Limit: {limit}€, Ausgaben: {total}€.",
+            limiter
+        )
+
+def schedule_budget_check_job(application: Application, wrap=None):
+    """Plant tägliche Budgetüberprüfungen ein. `wrap` kann den Job z. B. auf einen Knoten beschränken."""
     # Stellen Sie sicher, dass die JobQueue korrekt eingerichtet ist
     if application.job_queue is not None:
-        application.job_queue.run_repeating(budget_check, interval=86400, first=0)  # Alle 24 Stunden
+        callback = wrap(budget_check) if wrap else budget_check
+        application.job_queue.run_repeating(callback, interval=86400, first=0)  # Alle 24 Stunden
     else:
         logger.error("JobQueue ist nicht verfügbar. Budget-Überprüfungen können nicht geplant werden.")
 
@@ -0,0 +1,125 @@
+import logging
+import os
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.models import ScheduledDelivery, User
+from utils.jobs import ACTIVE_WITHIN, STREAM_BATCH_SIZE, relevant_user_criteria
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Europe/Berlin")
+# Höchstens so viele Zustellungen je Job und Tick; der Rest wird im nächsten Tick abgearbeitet
+MAX_DELIVERIES_PER_TICK = int(os.getenv("MAX_DELIVERIES_PER_TICK", "500"))
+
+@dataclass(frozen=True)
+class DeliveryWindow:
+    hour: int  # Beginn des Fensters in Ortszeit des Benutzers
+    minutes: int  # Länge des Fensters, über die die Benutzer per Hash verteilt werden
+    weekday: Optional[int] = None  # 0 = Montag; None = täglich
+
+# Zustellfenster je Job
+DELIVERY_WINDOWS: Dict[str, DeliveryWindow] = {
+    'budget_forecast': DeliveryWindow(hour=19, minutes=120),
+    'goal_progress': DeliveryWindow(hour=10, minutes=120, weekday=6),
+    'weekly_summary': DeliveryWindow(hour=8, minutes=180, weekday=0),
+}
+
+def user_timezone(name: Optional[str]):
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+def jitter(user_id: int, job: str, window: DeliveryWindow) -> timedelta:
+    """Fester Versatz innerhalb des Fensters, damit nicht alle Benutzer in derselben Sekunde dran sind."""
+    return timedelta(seconds=zlib.crc32(f"{job}:{user_id}".encode()) % (window.minutes * 60))
+
+def next_due(job: str, user_id: int, timezone: Optional[str], after: datetime) -> datetime:
+    """Nächster Zustelltermin nach `after` (beides naive UTC-Zeitpunkte)."""
+    window = DELIVERY_WINDOWS[job]
+    tz = user_timezone(timezone)
+    local_after = pytz.utc.localize(after).astimezone(tz)
+    offset = jitter(user_id, job, window)
+
+    day = local_after.date()
+    if window.weekday is not None:
+        day += timedelta(days=(window.weekday - day.weekday()) % 7)
+    step = timedelta(days=1 if window.weekday is None else 7)
+    while True:
+        local_due = tz.localize(datetime(day.year, day.month, day.day, window.hour) + offset)
+        due = local_due.astimezone(pytz.utc).replace(tzinfo=None)
+        if due > after:
+            return due
+        day += step
+
+def schedule_user(session, user_id: int, timezone: Optional[str], now: Optional[datetime] = None) -> None:
+    """Legt die Zustelltermine eines Benutzers an bzw. berechnet sie neu (z. B. nach /timezone)."""
+    now = now or datetime.utcnow()
+    for job in DELIVERY_WINDOWS:
+        due_at = next_due(job, user_id, timezone, now)
+        session.execute(
+            sqlite_insert(ScheduledDelivery).values(user_id=user_id, job=job, due_at=due_at).on_conflict_do_update(
+                index_elements=[ScheduledDelivery.user_id, ScheduledDelivery.job], set_={'due_at': due_at}
+            )
+        )
+
+def backfill_schedules(session, now: Optional[datetime] = None) -> int:
+    """Legt fehlende Zustelltermine für alle relevanten Benutzer an. Gibt die Anzahl neuer Einträge zurück."""
+    now = now or datetime.utcnow()
+    created = 0
+    for job in DELIVERY_WINDOWS:
+        scheduled = session.query(ScheduledDelivery.user_id).filter(ScheduledDelivery.job == job)
+        users = session.query(User.id, User.timezone).filter(
+            ~User.id.in_(scheduled), *relevant_user_criteria()
+        ).order_by(User.id).yield_per(STREAM_BATCH_SIZE)
+
+        batch = []
+        for user_id, timezone in users:
+            batch.append(dict(user_id=user_id, job=job, due_at=next_due(job, user_id, timezone, now)))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                session.bulk_insert_mappings(ScheduledDelivery, batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            session.bulk_insert_mappings(ScheduledDelivery, batch)
+            created += len(batch)
+    session.commit()
+    return created
+
+def claim_due(session, job: str, now: Optional[datetime] = None,
+              limit: int = MAX_DELIVERIES_PER_TICK) -> List[Tuple[int, int]]:
+    """
+    Holt die fälligen Einträge eines Jobs über den Index (job, due_at), schiebt sie auf ihren nächsten
+    Termin und gibt (user_id, telegram_id) der relevanten Benutzer zurück. Inaktive oder blockierte
+    Benutzer werden ebenfalls weitergeschoben, damit sie nicht in jedem Tick erneut gelesen werden.
+    """
+    now = now or datetime.utcnow()
+    rows = session.query(
+        ScheduledDelivery.id, ScheduledDelivery.user_id, User.telegram_id, User.timezone,
+        User.is_blocked, User.last_active_at
+    ).join(User, User.id == ScheduledDelivery.user_id).filter(
+        ScheduledDelivery.job == job,
+        ScheduledDelivery.due_at <= now
+    ).order_by(ScheduledDelivery.due_at).limit(limit).all()
+    if not rows:
+        return []
+
+    session.bulk_update_mappings(ScheduledDelivery, [
+        {'id': row.id, 'due_at': next_due(job, row.user_id, row.timezone, now)} for row in rows
+    ])
+    session.commit()
+
+    active_since = datetime.now() - ACTIVE_WITHIN
+    return [
+        (row.user_id, row.telegram_id) for row in rows
+        if not row.is_blocked and (row.last_active_at is None or row.last_active_at >= active_since)
+    ]
+
+def is_valid_timezone(name: str) -> bool:
+    return name in pytz.all_timezones_set
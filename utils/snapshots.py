@@ -0,0 +1,220 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session, object_session
+
+from database.models import Budget, Transaction, User
+
+logger = logging.getLogger(__name__)
+
+# So lange beantworten Telegram-Server dieselbe Inline-Anfrage eines Benutzers aus ihrem Cache
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+# Schnappschüsse werden spätestens nach dieser Zeit neu geladen, damit Buchungen anderer Prozesse
+# (z. B. Jobs auf dem Leader im Cluster-Betrieb) ankommen
+SNAPSHOT_TTL = int(os.getenv("INLINE_SNAPSHOT_TTL", "300"))
+MAX_SNAPSHOTS = int(os.getenv("INLINE_CACHE_SIZE", "10000"))
+# Telegram erlaubt höchstens 50 Ergebnisse je Antwort
+MAX_RESULTS = 50
+
+@dataclass
+class Snapshot:
+    """Summen des laufenden Monats je Kategorie und die Budgetlimits eines Benutzers."""
+    user_id: int
+    telegram_id: int
+    year: int
+    month: int
+    expenses: Dict[str, float] = field(default_factory=dict)
+    income: Dict[str, float] = field(default_factory=dict)
+    budgets: Dict[str, float] = field(default_factory=dict)
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    def covers(self, date: Optional[datetime]) -> bool:
+        return date is not None and (date.year, date.month) == (self.year, self.month)
+
+    def add(self, category: Optional[str], kind: Optional[str], amount: float) -> None:
+        totals = self.expenses if kind == 'expense' else self.income if kind == 'income' else None
+        if totals is None or not category:
+            return
+        totals[category] = totals.get(category, 0.0) + amount
+
+class SnapshotCache:
+    """
+    Schnappschüsse je Telegram-ID für Inline-Anfragen. Buchungen über das ORM werden nach dem Commit
+    eingerechnet, Budgetänderungen verwerfen den Schnappschuss. Der Zugriff ist threadsicher.
+    """
+
+    def __init__(self, max_size: int = MAX_SNAPSHOTS, ttl: float = SNAPSHOT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._snapshots: 'OrderedDict[int, Snapshot]' = OrderedDict()
+        self._telegram_ids: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int, now: Optional[datetime] = None) -> Optional[Snapshot]:
+        """Gibt den Schnappschuss zurück, solange er aktuell ist und im laufenden Monat liegt."""
+        now = now or datetime.now()
+        with self._lock:
+            snapshot = self._snapshots.get(telegram_id)
+            if snapshot is None:
+                return None
+            if (snapshot.year, snapshot.month) != (now.year, now.month) or time.monotonic() - snapshot.loaded_at > self.ttl:
+                self._drop(telegram_id)
+                return None
+            self._snapshots.move_to_end(telegram_id)
+            return snapshot
+
+    def load(self, session, telegram_id: int, now: Optional[datetime] = None) -> Optional[Snapshot]:
+        """Baut den Schnappschuss mit zwei gruppierten Abfragen neu auf; None für unbekannte Benutzer."""
+        now = now or datetime.now()
+        user_id = session.query(User.id).filter(User.telegram_id == telegram_id).scalar()
+        if user_id is None:
+            return None
+
+        month_start = datetime(now.year, now.month, 1)
+        next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+        snapshot = Snapshot(user_id=user_id, telegram_id=telegram_id, year=now.year, month=now.month)
+        for category, kind, total in session.query(
+            Transaction.category, Transaction.type, func.sum(Transaction.amount)
+        ).filter(
+            Transaction.user_id == user_id, Transaction.date >= month_start, Transaction.date < next_month
+        ).group_by(Transaction.category, Transaction.type):
+            snapshot.add(category, kind, total or 0.0)
+
+        # Budgets ohne Monat gelten dauerhaft; ein Budget für den laufenden Monat hat Vorrang
+        for name, limit, year in session.query(Budget.name, Budget.limit, Budget.year).filter(
+            Budget.user_id == user_id,
+            (Budget.year.is_(None)) | ((Budget.year == now.year) & (Budget.month == now.month))
+        ).order_by(Budget.year.isnot(None)):
+            snapshot.budgets[name] = limit or 0.0
+
+        with self._lock:
+            self._snapshots[telegram_id] = snapshot
+            self._snapshots.move_to_end(telegram_id)
+            self._telegram_ids[user_id] = telegram_id
+            while len(self._snapshots) > self.max_size:
+                _, oldest = self._snapshots.popitem(last=False)
+                self._telegram_ids.pop(oldest.user_id, None)
+        return snapshot
+
+    def apply(self, user_id: int, category: Optional[str], kind: Optional[str], date: Optional[datetime], amount: float) -> None:
+        with self._lock:
+            snapshot = self._snapshots.get(self._telegram_ids.get(user_id))
+            if snapshot is not None and snapshot.covers(date):
+                snapshot.add(category, kind, amount)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Verwirft den Schnappschuss eines Benutzers oder ohne Angabe alle."""
+        with self._lock:
+            if user_id is None:
+                self._snapshots.clear()
+                self._telegram_ids.clear()
+            elif user_id in self._telegram_ids:
+                self._drop(self._telegram_ids[user_id])
+
+    def _drop(self, telegram_id: int) -> None:
+        snapshot = self._snapshots.pop(telegram_id, None)
+        if snapshot is not None:
+            self._telegram_ids.pop(snapshot.user_id, None)
+
+snapshot_cache = SnapshotCache()
+
+# ----- Fortschreiben beim Schreiben -----
+# Die Änderungen werden während des Flushs in session.info gesammelt und erst nach dem Commit
+# übernommen, damit zurückgerollte Buchungen den Cache nicht verfälschen. Massenoperationen
+# (query.update/delete) laufen an den Listenern vorbei; sie betreffen nur archivierte Monate
+# oder Felder, die hier keine Rolle spielen.
+
+_FIELDS = ('user_id', 'category', 'type', 'date', 'amount')
+
+def _record(target, change: tuple) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('snapshot_changes', []).append(change)
+
+def _values(target) -> tuple:
+    return tuple(getattr(target, name) for name in _FIELDS)
+
+@event.listens_for(Transaction, 'after_insert')
+def _transaction_inserted(mapper, connection, target) -> None:
+    _record(target, ('add', _values(target), 1))
+
+@event.listens_for(Transaction, 'after_delete')
+def _transaction_deleted(mapper, connection, target) -> None:
+    _record(target, ('add', _values(target), -1))
+
+@event.listens_for(Transaction, 'after_update')
+def _transaction_updated(mapper, connection, target) -> None:
+    state = inspect(target)
+    histories = {name: state.attrs[name].history for name in _FIELDS}
+    if not any(history.has_changes() for history in histories.values()):
+        return
+    old = tuple(
+        history.deleted[0] if history.deleted else getattr(target, name)
+        for name, history in histories.items()
+    )
+    _record(target, ('add', old, -1))
+    _record(target, ('add', _values(target), 1))
+
+@event.listens_for(Budget, 'after_insert')
+@event.listens_for(Budget, 'after_update')
+@event.listens_for(Budget, 'after_delete')
+def _budget_changed(mapper, connection, target) -> None:
+    _record(target, ('invalidate', target.user_id))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session) -> None:
+    for change in session.info.pop('snapshot_changes', ()):
+        if change[0] == 'invalidate':
+            snapshot_cache.invalidate(change[1])
+        else:
+            (user_id, category, kind, date, amount), sign = change[1], change[2]
+            snapshot_cache.apply(user_id, category, kind, date, sign * (amount or 0.0))
+
+@event.listens_for(Session, 'after_rollback')
+@event.listens_for(Session, 'after_begin')
+def _discard_changes(session, *args) -> None:
+    # after_begin: Reste einer Session, die ohne Commit geschlossen wurde
+    session.info.pop('snapshot_changes', None)
+
+# ----- Inline-Antworten -----
+
+def _budget_note(snapshot: Snapshot, category: str) -> str:
+    limit = snapshot.budgets.get(category)
+    if not limit:
+        return "kein Budget"
+    spent = snapshot.expenses.get(category, 0.0)
+    return f"{spent / limit * 100:.0f}% von {limit:.2f}€ Budget"
+
+def inline_entries(snapshot: Snapshot, query: str) -> List[Tuple[str, str, str]]:
+    """
+    Ergebnisse für eine Inline-Anfrage als (title, description, message)-Tupel: ohne Suchbegriff eine
+    Monatsübersicht, sonst die passenden Kategorien nach Ausgaben sortiert.
+    """
+    period = f"{snapshot.month:02d}/{snapshot.year}"
+    query = query.strip().lower()
+    entries = []
+    if not query:
+        spent, earned = sum(snapshot.expenses.values()), sum(snapshot.income.values())
+        text = f"{period}: Ausgaben {spent:.2f}€, Einnahmen {earned:.2f}€, Saldo {earned - spent:.2f}€"
+        entries.append(("Monatsübersicht", text, text))
+
+    categories = set(snapshot.expenses) | set(snapshot.budgets)
+    matching = sorted(
+        (category for category in categories if query in category.lower()),
+        key=lambda category: snapshot.expenses.get(category, 0.0), reverse=True
+    )
+    for category in matching[:MAX_RESULTS - len(entries)]:
+        spent = snapshot.expenses.get(category, 0.0)
+        note = _budget_note(snapshot, category)
+        entries.append((
+            f"{category}: {spent:.2f}€", f"{period}, {note}",
+            f"{category} im {period}: {spent:.2f}€ ausgegeben ({note})"
+        ))
+    return entries
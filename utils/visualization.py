@@ -1,33 +1,78 @@
-import matplotlib.pyplot as plt
-from sqlalchemy.orm import sessionmaker
-from database import engine
-from database.models import Transaction
-import os
+import threading
+from datetime import datetime
+from typing import List, Tuple
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+import numpy as np
 
-def generate_financial_report(user_id: int) -> str:
+from database import SessionLocal
+from utils.analytics import load_user_history, month_index, monthly_totals, top_categories
+
+_pyplot = None
+_pyplot_lock = threading.Lock()
+
+def load_pyplot():
     """
-    Generiert einen Diagrammbericht der Ausgaben und Einnahmen des Benutzers und gibt den Pfad zum Bild zurück.
+    Importiert matplotlib.pyplot beim ersten Aufruf (ohne GUI-Backend) und gibt das Modul zurück.
+    Der Import ist teuer und wird deshalb nicht beim Start des Bots ausgeführt.
     """
-    session = SessionLocal()
-    transactions = session.query(Transaction).filter(Transaction.user_id == user_id).all()
+    global _pyplot
+    with _pyplot_lock:
+        if _pyplot is None:
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            _pyplot = plt
+    return _pyplot
 
-    session.close()
+def load_report_data(user_id: int, months: int = 12) -> Tuple[List[Tuple[str, float]], List[Tuple[str, float]], np.ndarray]:
+    """Summen je Kategorie für Ausgaben und Einnahmen sowie die Monatsausgaben der letzten `months` Monate."""
+    session = SessionLocal()
+    try:
+        frame = load_user_history(session, user_id)
+    finally:
+        session.close()
 
-    if not transactions:
+    if not len(frame):
         raise ValueError("Keine Transaktionen gefunden.")
 
+    now = datetime.now()
+    current = month_index(now.year, now.month)
+    _, monthly = monthly_totals(frame, 'expense', first_month=current - months + 1, last_month=current)
+    return (
+        top_categories(frame, 'expense', limit=len(frame.categories)),
+        top_categories(frame, 'income', limit=len(frame.categories)),
+        monthly
+    )
+
+def render_chart_report(user_id: int) -> Tuple[bytes, str]:
+    """Standardbericht ohne matplotlib: PNG-Bytes und Bildunterschrift mit Legende."""
+    from utils.charts import legend, limit_slices, render_report
+
+    expenses, income, _ = load_report_data(user_id)
+    expenses, income = limit_slices(expenses), limit_slices(income)
+    caption = f"Dein Finanzbericht:\n\n{legend('Ausgaben', expenses)}\n\n{legend('Einnahmen', income)}"
+    return render_report(expenses, income), caption
+
+def render_text_report(user_id: int) -> str:
+    """Bericht als Text mit Unicode-Balken, z. B. für Clients ohne Bildvorschau."""
+    from utils.charts import limit_slices, text_report
+
+    expenses, income, monthly = load_report_data(user_id)
+    return text_report(limit_slices(expenses), limit_slices(income), monthly)
+
+def generate_financial_report(user_id: int) -> str:
+    """
+    Generiert einen Diagrammbericht der Ausgaben und Einnahmen des Benutzers mit matplotlib und gibt den Pfad
+    zum Bild zurück. Optionales Backend für /report matplotlib; der Standardbericht nutzt utils.charts.
+    """
+    expenses, income, _ = load_report_data(user_id)
+
     # Aggregiere die Ausgaben und Einnahmen nach Kategorie
-    expense_data = {}
-    income_data = {}
-    for tx in transactions:
-        if tx.type == 'expense':
-            expense_data[tx.category] = expense_data.get(tx.category, 0) + tx.amount
-        else:
-            income_data[tx.category] = income_data.get(tx.category, 0) + tx.amount
+    expense_data = dict(expenses)
+    income_data = dict(income)
 
     # Erstelle zwei Tortendiagramme
+    plt = load_pyplot()
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
 
     # Ausgaben